@@ -0,0 +1,108 @@
+import random
+
+import networkx as nx
+import pytest
+
+from sp_benchmark import SpStandInServer, SpSyntheticWorld
+from sp_index import SpIndex
+from sp_rest_client import SpRestClient
+from sp_scrapper_cache import SpScrapperCache
+
+
+@pytest.fixture(scope='session')
+def world():
+    return SpSyntheticWorld(2000, 800)
+
+
+@pytest.fixture(scope='session')
+def server(world):
+    with SpStandInServer(world) as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def make_cache(server, tmp_path):
+    """
+    :return: Function creating SpScrapperCache with SQLite level 2 cache. Caches created with the same name share it.
+    """
+
+    caches = []
+
+    def make(name='sp', **kwargs):
+        cache = SpScrapperCache(SpRestClient(server.url), **kwargs)
+        cache.init_sqlite(str(tmp_path / ('%s.sqlite' % name)))
+        caches.append(cache)
+        return cache
+
+    yield make
+
+    for cache in caches:
+        cache.stop_watching()
+        cache.flush()
+        cache.storage.close()
+
+
+@pytest.fixture(scope='session')
+def full_index(world, server, tmp_path_factory):
+    """
+    :return: SpIndex of the whole synthetic world.
+    """
+
+    path = tmp_path_factory.mktemp('full')
+    cache = SpScrapperCache(SpRestClient(server.url))
+    cache.init_sqlite(str(path / 'sp.sqlite'))
+
+    for id in range(world.persons):
+        cache.get_person_by_ref({'id': str(id), 'slug': 'x'})
+    for id in range(world.companies):
+        cache.get_company_by_ref({'id': str(id), 'slug': 'x'})
+
+    cache.flush()
+    index = SpIndex.build(cache.storage, str(path / 'index'))
+    cache.storage.close()
+
+    yield index
+    index.close()
+
+
+@pytest.fixture(scope='session')
+def full_nx_graph(full_index):
+    """
+    :return: networkx graph of index node ids and relations of the whole synthetic world.
+    """
+
+    graph = nx.Graph()
+    graph.add_nodes_from(range(len(full_index.nodes)))
+
+    for node_id in range(len(full_index.nodes)):
+        graph.add_edges_from((node_id, target) for target, _ in full_index.neighbours(node_id))
+
+    return graph
+
+
+@pytest.fixture
+def person_refs(world):
+    """
+    :return: Function returning n reproducible person refs of people sitting on at least one board.
+    """
+
+    def refs(n, seed=0):
+        r = random.Random(seed)
+        return [world.random_person_ref(r) for _ in range(n)]
+
+    return refs
+
+
+@pytest.fixture
+def graph_contents():
+    """
+    :return: Function returning comparable people, companies and relations of a SpGraph.
+    """
+
+    def contents(graph):
+        graph_json = graph.to_json()
+        return graph_json['persons'], graph_json['companies'], \
+            sorted((relation['company'], relation['person'], tuple(relation['roles'] or ()))
+                   for relation in graph_json['relations'])
+
+    return contents
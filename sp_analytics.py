@@ -0,0 +1,382 @@
+import argparse
+import json
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from sp_graph import SpGraph
+from sp_metrics import enable_logging, get_logger, metrics
+
+logger = get_logger('analytics')
+
+
+class SpAnalytics:
+    """
+    Network analytics of the person-company graph with sparse linear algebra.
+
+    The graph is held as a symmetric scipy CSR adjacency matrix of all nodes, built from SpGraph or from SpIndex,
+    which compiles the whole level 2 cache. Person-company bipartite matrix and person-person co-board projection
+    are derived from it. Every measure is computed with sparse matrix products over all nodes at once,
+    instead of per node Python loops of networkx.
+    """
+
+    def __init__(self, adjacency, is_person, keys, labels):
+        """
+        Use from_graph or from_index.
+
+        :param adjacency: symmetric scipy sparse adjacency matrix of all nodes
+        :param is_person: numpy bool array, True for people and False for companies
+        :param keys: list of node 'unique' keys or document ids
+        :param labels: list of node display labels
+        """
+
+        self.adjacency = sparse.csr_matrix(adjacency, dtype=np.float64)
+        self.is_person = is_person
+        self.keys = keys
+        self.labels = labels
+
+        self.persons = np.flatnonzero(is_person)
+        self.companies = np.flatnonzero(~is_person)
+
+    @staticmethod
+    def from_graph(sp_graph: SpGraph):
+        """
+        :param sp_graph: crawled graph
+        :return: SpAnalytics of the graph.
+        """
+
+        n = len(sp_graph.natural_keys)
+        edges = np.fromiter(sp_graph.edge_records.keys(), dtype=np.int64, count=len(sp_graph.edge_records))
+        company_ids = edges >> 32
+        person_ids = edges & 0xffffffff
+
+        adjacency = sparse.coo_matrix((np.ones(2 * len(edges)),
+                                       (np.concatenate([company_ids, person_ids]),
+                                        np.concatenate([person_ids, company_ids]))), shape=(n, n))
+
+        return SpAnalytics(adjacency,
+                           np.frombuffer(bytes(sp_graph.kinds), dtype=np.uint8) == SpGraph.PERSON,
+                           [sp_graph.node_key(node_id) for node_id in range(n)],
+                           [sp_graph.label(node_id) for node_id in range(n)])
+
+    @staticmethod
+    def from_index(sp_index):
+        """
+        :param sp_index: SpIndex of the cached store, its memory-mapped arrays are copied at once, not node by node
+        :return: SpAnalytics of the indexed graph. The index can be closed afterwards.
+        """
+
+        n = len(sp_index.nodes)
+        offsets = np.array(sp_index.offsets, dtype=np.int64)
+        targets = np.array(sp_index.targets, dtype=np.int32)
+
+        adjacency = sparse.csr_matrix((np.ones(len(targets)), targets, offsets), shape=(n, n))
+
+        return SpAnalytics(adjacency,
+                           np.array([doc_id.startswith('p_') for doc_id in sp_index.nodes], dtype=bool),
+                           list(sp_index.nodes),
+                           [(label or {}).get('name', doc_id)
+                            for doc_id, label in zip(sp_index.nodes, sp_index.labels)])
+
+    def bipartite(self):
+        """
+        :return: scipy CSR matrix of people (rows, in the order of self.persons) by companies
+        (columns, in the order of self.companies), 1 for board membership.
+        """
+
+        return self.adjacency[self.persons][:, self.companies]
+
+    def projection(self, max_board=None):
+        """
+        Projects the bipartite graph onto people. Two people are connected if they sit on a board together.
+
+        :param max_board: companies with more people are skipped, None for no limit.
+        Boards of n people add n^2 entries, so very large ones dominate memory without adding much information.
+        :return: scipy CSR matrix of people by people (in the order of self.persons),
+        values are numbers of shared companies, diagonal is zero.
+        """
+
+        with metrics.timer('sp_analytics_seconds', operation='projection'):
+            bipartite = self.bipartite().tocsc()
+
+            if max_board is not None:
+                bipartite = bipartite[:, np.flatnonzero(np.diff(bipartite.indptr) <= max_board)]
+
+            projection = (bipartite @ bipartite.T).tocsr()
+            projection.setdiag(0)
+            projection.eliminate_zeros()
+
+        return projection
+
+    def degree(self):
+        """
+        :return: numpy array of numbers of neighbours by node id, companies of people and people of companies
+        """
+
+        return np.diff(self.adjacency.indptr)
+
+    def components(self):
+        """
+        :return: Tuple of number of connected components and numpy array of component numbers by node id.
+        """
+
+        with metrics.timer('sp_analytics_seconds', operation='components'):
+            return csgraph.connected_components(self.adjacency, directed=False)
+
+    def pagerank(self, damping=0.85, tol=1e-6, max_iter=100):
+        """
+        Computes PageRank with power iteration over the sparse adjacency matrix.
+        Converges the same way as networkx pagerank.
+
+        :param damping: probability of following a relation
+        :param tol: error tolerance per node
+        :param max_iter: maximal number of iterations
+        :return: numpy array of PageRank by node id, summing up to 1.
+        """
+
+        n = self.adjacency.shape[0]
+        if n == 0:
+            return np.zeros(0)
+
+        degree = np.asarray(self.adjacency.sum(axis=1)).ravel()
+        dangling = degree == 0
+        inverse_degree = np.divide(1.0, degree, out=np.zeros(n), where=~dangling)
+        rank = np.full(n, 1.0 / n)
+
+        with metrics.timer('sp_analytics_seconds', operation='pagerank'):
+            for i in range(max_iter):
+                previous = rank
+                rank = damping * (self.adjacency @ (previous * inverse_degree)) + \
+                    (damping * previous[dangling].sum() + 1.0 - damping) / n
+
+                if np.abs(rank - previous).sum() < n * tol:
+                    break
+            else:
+                logger.warning('PageRank did not converge in %s iterations.', max_iter)
+
+        return rank
+
+    def betweenness(self, samples=None, batch_size=32, seed=0, normalized=True):
+        """
+        Computes betweenness centrality with Brandes' algorithm, run for a batch of sources at once:
+        every BFS layer of all sources of a batch is a single sparse-dense matrix product.
+        Large graphs can be approximated from a random sample of sources.
+
+        :param samples: number of sampled source nodes, None for all nodes (exact)
+        :param batch_size: number of sources traversed at once, memory is about 4 * 8 * nodes * batch_size bytes
+        :param seed: random seed of source sampling
+        :param normalized: True to divide by the number of pairs of other nodes, as networkx does
+        :return: numpy array of betweenness by node id
+        """
+
+        n = self.adjacency.shape[0]
+        sources = np.arange(n)
+
+        if samples is not None and samples < n:
+            sources = np.random.default_rng(seed).choice(n, samples, replace=False)
+
+        centrality = np.zeros(n)
+
+        with metrics.timer('sp_analytics_seconds', operation='betweenness'):
+            for i in range(0, len(sources), batch_size):
+                centrality += self.__dependencies(sources[i:i + batch_size])
+
+        # every pair is counted from both of its ends, and sampled sources stand for all nodes
+        centrality *= n / max(len(sources), 1) / 2
+
+        if normalized and n > 2:
+            centrality *= 2 / ((n - 1) * (n - 2))
+
+        return centrality
+
+    def communities(self, max_iter=30, seed=0):
+        """
+        Detects communities with bipartite label propagation. Companies take the label most common
+        on their boards, then people take the label most common among their companies, until labels settle.
+        Every update of a side is vectorized over all its nodes.
+
+        :param max_iter: maximal number of rounds
+        :param seed: random seed of tie breaking
+        :return: numpy array of community numbers by node id, numbered from 0 by decreasing size
+        """
+
+        n = self.adjacency.shape[0]
+        rng = np.random.default_rng(seed)
+        labels = rng.permutation(n)
+
+        sides = [(self.companies, self.adjacency[self.companies]), (self.persons, self.adjacency[self.persons])]
+
+        with metrics.timer('sp_analytics_seconds', operation='communities'):
+            for i in range(max_iter):
+                changed = 0
+
+                for node_ids, rows in sides:
+                    new_labels = self.__majority(rows, labels, labels[node_ids], rng)
+                    changed += np.count_nonzero(new_labels != labels[node_ids])
+                    labels[node_ids] = new_labels
+
+                logger.debug('Label propagation round %s changed %s labels.', i, changed)
+
+                if changed == 0:
+                    break
+
+        _, labels, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+        return np.argsort(np.argsort(-sizes, kind='stable'))[labels]
+
+    def modularity(self, communities):
+        """
+        :param communities: numpy array of community numbers by node id
+        :return: Newman modularity of the partition of the adjacency matrix.
+        """
+
+        adjacency = self.adjacency.tocoo()
+        total = adjacency.sum()
+
+        if total == 0:
+            return 0.0
+
+        inside = adjacency.data[communities[adjacency.row] == communities[adjacency.col]].sum()
+        community_degrees = np.bincount(communities, weights=np.asarray(self.adjacency.sum(axis=1)).ravel())
+
+        return float(inside / total - ((community_degrees / total) ** 2).sum())
+
+    def top(self, scores, k=10, kind=None):
+        """
+        :param scores: numpy array of scores by node id
+        :param k: number of nodes
+        :param kind: 'person' or 'company' to rank one kind only, None for both
+        :return: list of {'key', 'label', 'score'} json objects of k best scored nodes
+        """
+
+        node_ids = np.arange(len(scores)) if kind is None else self.persons if kind == 'person' else self.companies
+        best = node_ids[np.argsort(-scores[node_ids], kind='stable')[:k]]
+
+        return [{'key': self.keys[node_id], 'label': self.labels[node_id], 'score': float(scores[node_id])}
+                for node_id in best]
+
+    def summary(self, k=10, betweenness_samples=256, max_board=None):
+        """
+        Computes all measures.
+
+        :param k: number of top ranked nodes per measure
+        :param betweenness_samples: sampled sources of betweenness, None for exact betweenness
+        :param max_board: see projection
+        :return: json object with graph size, components, communities and top ranked people and companies
+        """
+
+        count, components = self.components()
+        component_sizes = np.sort(np.bincount(components))[::-1] if len(components) > 0 else np.zeros(0, dtype=int)
+        communities = self.communities()
+        projection = self.projection(max_board)
+        co_board_degree = np.zeros(len(self.keys))
+        co_board_degree[self.persons] = np.diff(projection.indptr)
+
+        return {
+            'persons': len(self.persons),
+            'companies': len(self.companies),
+            'relations': self.adjacency.nnz // 2,
+            'co_board_pairs': projection.nnz // 2,
+            'components': count,
+            'largest_components': component_sizes[:k].tolist(),
+            'communities': int(communities.max()) + 1 if len(communities) > 0 else 0,
+            'largest_communities': np.bincount(communities)[:k].tolist() if len(communities) > 0 else [],
+            'modularity': self.modularity(communities),
+            'top_degree_companies': self.top(self.degree(), k, 'company'),
+            'top_co_board_persons': self.top(co_board_degree, k, 'person'),
+            'top_pagerank_persons': self.top(self.pagerank(), k, 'person'),
+            'top_betweenness_persons': self.top(self.betweenness(betweenness_samples), k, 'person')
+        }
+
+    def __dependencies(self, sources):
+        """
+        Brandes' dependency accumulation for a batch of sources.
+
+        :param sources: numpy array of source node ids
+        :return: numpy array of summed dependencies of the sources by node id
+        """
+
+        n = self.adjacency.shape[0]
+        columns = np.arange(len(sources))
+
+        # node id x source: hops from the source (-1 for not reached) and number of shortest paths
+        hops = np.full((n, len(sources)), -1, dtype=np.int32)
+        paths = np.zeros((n, len(sources)))
+        hops[sources, columns] = 0
+        paths[sources, columns] = 1
+
+        depth = 0
+        while True:
+            reached = self.adjacency @ np.where(hops == depth, paths, 0)
+            new = (hops == -1) & (reached > 0)
+
+            if not new.any():
+                break
+
+            depth += 1
+            hops[new] = depth
+            paths[new] = reached[new]
+
+        dependencies = np.zeros((n, len(sources)))
+
+        for d in range(depth, 0, -1):
+            coefficients = np.where(hops == d, (1 + dependencies) / np.where(paths > 0, paths, 1), 0)
+            dependencies += np.where(hops == d - 1, paths * (self.adjacency @ coefficients), 0)
+
+        dependencies[sources, columns] = 0
+        return dependencies.sum(axis=1)
+
+    @staticmethod
+    def __majority(rows, labels, current, rng):
+        """
+        :param rows: scipy CSR adjacency rows of the updated nodes
+        :param labels: numpy array of labels by node id
+        :param current: numpy array of current labels of the updated nodes
+        :param rng: numpy random generator breaking ties
+        :return: numpy array of labels most common among neighbours of the updated nodes,
+        the current label is kept on ties and by nodes without neighbours
+        """
+
+        n = len(labels)
+        if rows.nnz == 0:
+            return current.copy()
+
+        row_ids = np.repeat(np.arange(rows.shape[0], dtype=np.int64), np.diff(rows.indptr))
+        pairs, counts = np.unique(row_ids * n + labels[rows.indices], return_counts=True)
+        row_ids, neighbour_labels = pairs // n, pairs % n
+
+        # current label wins ties, other ties are broken at random
+        scores = counts + 0.5 * (neighbour_labels == current[row_ids]) + 0.1 * rng.random(len(counts))
+        order = np.lexsort((-scores, row_ids))
+        first = order[np.r_[True, row_ids[order][1:] != row_ids[order][:-1]]]
+
+        result = current.copy()
+        result[row_ids[first]] = neighbour_labels[first]
+        return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Computes network measures of the indexed level 2 cache.')
+    parser.add_argument('--index-path', default='sp_index', help='index built with sp_index.py')
+    parser.add_argument('--top', type=int, default=10, help='number of top ranked nodes per measure')
+    parser.add_argument('--betweenness-samples', type=int, default=256, help='0 for exact betweenness')
+    parser.add_argument('--max-board', type=int, default=None, help='larger boards are left out of the projection')
+    parser.add_argument('--output', default=None, help='json file path, stdout if not set')
+    args = parser.parse_args()
+    enable_logging()
+
+    from sp_index import SpIndex
+
+    index = SpIndex(args.index_path)
+    analytics = SpAnalytics.from_index(index)
+    logger.info('Loaded %s nodes and %s relations.', len(analytics.keys), analytics.adjacency.nnz // 2)
+
+    result = analytics.summary(args.top, args.betweenness_samples or None, args.max_board)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(result, output_file, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    index.close()
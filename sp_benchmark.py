@@ -0,0 +1,708 @@
+import argparse
+import email.parser
+import email.policy
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from sp_graph import SpGraph
+from sp_metrics import enable_logging, get_logger, metrics
+from sp_name_index import SpNameIndex
+from sp_rest_client import SpRestClient
+from sp_rest_scheduler import SpRestScheduler
+from sp_scrapper import SpScrapper
+from sp_scrapper_cache import SpScrapperCache
+
+logger = get_logger('benchmark')
+
+
+class SpSyntheticWorld:
+    """
+    Deterministic synthetic registry of people and companies. Documents follow sp_rest_company_schema.json.
+
+    Company board sizes follow a Pareto distribution and board members are drawn with a skew,
+    so that a few people sit on many boards, like in the real registry.
+    Relations are kept in compact CSR arrays and documents are generated on request,
+    so worlds of millions of entities fit in memory.
+    """
+
+    FIRST_NAMES = ['Adam', 'Agnieszka', 'Aleksander', 'Alicja', 'Andrzej', 'Anna', 'Barbara', 'Bartłomiej',
+                   'Beata', 'Bożena', 'Dariusz', 'Dorota', 'Elżbieta', 'Ewa', 'Grzegorz', 'Halina',
+                   'Irena', 'Jacek', 'Jadwiga', 'Jan', 'Janusz', 'Jerzy', 'Joanna', 'Józef',
+                   'Katarzyna', 'Krzysztof', 'Łukasz', 'Magdalena', 'Małgorzata', 'Marek', 'Maria', 'Michał',
+                   'Paweł', 'Piotr', 'Renata', 'Stanisław', 'Tadeusz', 'Tomasz', 'Wojciech', 'Zofia']
+
+    LAST_NAMES = ['Nowak', 'Kowalski', 'Wiśniewski', 'Wójcik', 'Kowalczyk', 'Kamiński', 'Lewandowski', 'Zieliński',
+                  'Szymański', 'Woźniak', 'Dąbrowski', 'Kozłowski', 'Jankowski', 'Mazur', 'Kwiatkowski', 'Krawczyk',
+                  'Piotrowski', 'Grabowski', 'Nowakowski', 'Pawłowski', 'Michalski', 'Nowicki', 'Adamczyk', 'Dudek',
+                  'Zając', 'Wieczorek', 'Jabłoński', 'Król', 'Majewski', 'Olszewski', 'Jaworski', 'Wróbel',
+                  'Malinowski', 'Pawlak', 'Witkowski', 'Walczak', 'Stępień', 'Górski', 'Rutkowski', 'Michalak',
+                  'Sikora', 'Ostrowski', 'Baran', 'Duda', 'Szewczyk', 'Tomaszewski', 'Pietrzak', 'Marciniak',
+                  'Wróblewski', 'Zalewski', 'Jakubowski', 'Jasiński', 'Zawadzki', 'Sadowski', 'Bąk', 'Chmielewski',
+                  'Włodarczyk', 'Borkowski', 'Czarnecki', 'Sawicki']
+
+    FIRST_YEAR = 1930
+    YEARS = 70
+
+    COMPANY_WORDS = ['Polska', 'Mazowiecka', 'Bałtycka', 'Śląska', 'Górnicza', 'Energetyczna', 'Handlowa', 'Budowlana',
+                     'Inwestycyjna', 'Transportowa', 'Rolnicza', 'Medyczna', 'Finansowa', 'Techniczna', 'Spożywcza',
+                     'Chemiczna', 'Leśna', 'Morska', 'Miejska', 'Cyfrowa']
+
+    COMPANY_KINDS = ['Grupa', 'Fabryka', 'Agencja', 'Spółdzielnia', 'Hurtownia', 'Kompania', 'Centrala', 'Korporacja',
+                     'Fundacja', 'Sieć']
+
+    LEGAL_FORMS = ['SPÓŁKA Z OGRANICZONĄ ODPOWIEDZIALNOŚCIĄ', 'SPÓŁKA AKCYJNA']
+
+    # roles and sections of company documents they are listed in
+    ROLES = [('PREZES ZARZĄDU', 'representation'),
+             ('CZŁONEK ZARZĄDU', 'representation'),
+             ('PROKURENT', 'representation'),
+             ('PRZEWODNICZĄCY RADY NADZORCZEJ', 'directorsBoard'),
+             ('CZŁONEK RADY NADZORCZEJ', 'directorsBoard')]
+
+    def __init__(self, persons=10000, companies=4000, board_alpha=1.8, max_board_size=40, person_skew=1.5,
+                 missing_rate=0.0, seed=0):
+        """
+        :param persons: number of people
+        :param companies: number of companies
+        :param board_alpha: Pareto shape of company board sizes, lower means heavier tail; mean size is alpha / (alpha - 1)
+        :param max_board_size: maximal number of people of a company
+        :param person_skew: skew of board member draws, 1 for uniform, higher concentrates boards on fewer people
+        :param missing_rate: fraction of people whose documents are not available
+        :param seed: random seed, the same seed gives the same world
+        """
+
+        max_persons = (len(self.FIRST_NAMES) + 1) * len(self.FIRST_NAMES) * len(self.LAST_NAMES) * self.YEARS
+        if persons > max_persons:
+            raise Exception('At most %s unique people can be generated.' % max_persons)
+
+        self.persons = persons
+        self.companies = companies
+        self.missing_rate = missing_rate
+        self.seed = seed
+
+        r = random.Random(seed)
+
+        # company -> people relations
+        self.company_offsets = array('q', [0])
+        self.company_persons = array('i')
+        self.company_roles = bytearray()
+
+        for _ in range(companies):
+            board_size = min(max_board_size, max(1, int(r.paretovariate(board_alpha))), persons)
+            members = set()
+
+            while len(members) < board_size:
+                members.add(int(persons * r.random() ** person_skew))
+
+            for person_id in sorted(members):
+                self.company_persons.append(person_id)
+                self.company_roles.append(r.randrange(len(self.ROLES)))
+
+            self.company_offsets.append(len(self.company_persons))
+
+        # person -> companies relations, built with counting sort
+        counts = array('q', [0]) * (persons + 1)
+        for person_id in self.company_persons:
+            counts[person_id + 1] += 1
+
+        self.person_offsets = array('q', [0]) * (persons + 1)
+        for person_id in range(persons):
+            self.person_offsets[person_id + 1] = self.person_offsets[person_id] + counts[person_id + 1]
+
+        self.person_companies = array('i', [0]) * len(self.company_persons)
+        self.person_roles = bytearray(len(self.company_persons))
+        positions = array('q', self.person_offsets[:-1])
+
+        for company_id in range(companies):
+            for i in range(self.company_offsets[company_id], self.company_offsets[company_id + 1]):
+                person_id = self.company_persons[i]
+                self.person_companies[positions[person_id]] = company_id
+                self.person_roles[positions[person_id]] = self.company_roles[i]
+                positions[person_id] += 1
+
+    def relations(self):
+        """
+        :return: Number of person-company relations.
+        """
+
+        return len(self.company_persons)
+
+    def person_info(self, person_id):
+        """
+        :param person_id: person number
+        :return: person_info json object. Name and birth year are unique for every person.
+        """
+
+        first_names = len(self.FIRST_NAMES)
+        last_names = len(self.LAST_NAMES)
+
+        first = person_id % first_names
+        last = (person_id // first_names) % last_names
+        year = (person_id // (first_names * last_names)) % self.YEARS
+        middle = person_id // (first_names * last_names * self.YEARS)
+
+        names = [self.FIRST_NAMES[first]] + ([self.FIRST_NAMES[middle - 1]] if middle > 0 else []) + \
+                [self.LAST_NAMES[last]]
+        name = ' '.join(names)
+
+        return {'id': str(person_id), 'slug': self.__slug(name), 'name': name,
+                'birthYear': str(self.FIRST_YEAR + year)}
+
+    def company_info(self, company_id):
+        """
+        :param company_id: company number
+        :return: company_info json object. KRS, NIP and REGON are unique for every company.
+        """
+
+        kinds = len(self.COMPANY_KINDS)
+        words = len(self.COMPANY_WORDS)
+
+        name = '%s %s %s %s' % (self.COMPANY_KINDS[company_id % kinds],
+                                self.COMPANY_WORDS[(company_id // kinds) % words],
+                                company_id // (kinds * words) + 1,
+                                self.LEGAL_FORMS[company_id % len(self.LEGAL_FORMS)])
+
+        return {'id': str(company_id), 'slug': self.__slug(name), 'name': name,
+                'krs': str(company_id + 1).zfill(10),
+                'nip': str(5000000000 + company_id),
+                'regon': str(100000000 + company_id),
+                'legalForm': self.LEGAL_FORMS[company_id % len(self.LEGAL_FORMS)],
+                'registerDate': '%s-%02d-%02d' % (2001 + company_id % 20, company_id % 12 + 1, company_id % 28 + 1),
+                'location': 'Warszawa', 'courtDesignation': 'XII WYDZIAŁ GOSPODARCZY KRS', 'oppStatus': '',
+                'www': '', 'email': '', 'startCapital': '5000.00', 'signature': '', 'representation': '',
+                'representativeName': ''}
+
+    def person(self, person_id):
+        """
+        :param person_id: person number
+        :return: person json object or None if the person is missing
+        """
+
+        if person_id < 0 or person_id >= self.persons or self.__missing(person_id):
+            return None
+
+        companies = []
+        for i in range(self.person_offsets[person_id], self.person_offsets[person_id + 1]):
+            company_info = self.company_info(self.person_companies[i])
+            companies.append({'id': company_info['id'], 'slug': company_info['slug'], 'name': company_info['name'],
+                              'information': '', 'roles': [self.ROLES[self.person_roles[i]][0]]})
+
+        return {'information': self.person_info(person_id), 'companies': companies}
+
+    def company(self, company_id):
+        """
+        :param company_id: company number
+        :return: company json object or None if there is no such company
+        """
+
+        if company_id < 0 or company_id >= self.companies:
+            return None
+
+        doc = {'information': self.company_info(company_id), 'representation': [], 'directorsBoard': [],
+               'shareholders': [], 'connections': [], 'ownerCompanies': [], 'professions': [], 'proxies': [],
+               'buttons': [], 'summaryText': ''}
+
+        for i in range(self.company_offsets[company_id], self.company_offsets[company_id + 1]):
+            person_ref = dict(self.person_info(self.company_persons[i]), type='person')
+            doc[self.ROLES[self.company_roles[i]][1]].append(person_ref)
+
+        return doc
+
+    def search(self, phrase, limit=20):
+        """
+        Finds people by 'first [middle] last' name and companies by KRS, NIP or REGON.
+
+        :param phrase: query string
+        :param limit: maximal number of results
+        :return: list of search result json objects
+        """
+
+        words = phrase.split()
+        results = []
+
+        if len(words) == 1 and words[0].isdigit():
+            number = int(words[0])
+            for company_id in [number - 1, number - 5000000000, number - 100000000]:
+                if 0 <= company_id < self.companies:
+                    results.append(dict(self.company_info(company_id), type='company'))
+            return results[:limit]
+
+        if len(words) not in [2, 3] or words[0] not in self.FIRST_NAMES or words[-1] not in self.LAST_NAMES:
+            return results
+
+        first_names = len(self.FIRST_NAMES)
+        last_names = len(self.LAST_NAMES)
+        middle = 0
+
+        if len(words) == 3:
+            if words[1] not in self.FIRST_NAMES:
+                return results
+            middle = self.FIRST_NAMES.index(words[1]) + 1
+
+        base = self.FIRST_NAMES.index(words[0]) + first_names * self.LAST_NAMES.index(words[-1]) + \
+            first_names * last_names * self.YEARS * middle
+
+        for year in range(self.YEARS):
+            person_id = base + first_names * last_names * year
+            if person_id >= self.persons or len(results) >= limit:
+                break
+            results.append(dict(self.person_info(person_id), type='person'))
+
+        return results
+
+    def random_person_ref(self, r):
+        """
+        :param r: random.Random
+        :return: person_ref of a random person sitting on at least one board
+        """
+
+        while True:
+            person_id = r.randrange(self.persons)
+            if self.person_offsets[person_id + 1] > self.person_offsets[person_id] and not self.__missing(person_id):
+                return dict(self.person_info(person_id), type='person')
+
+    def __missing(self, person_id):
+        return self.missing_rate > 0 and random.Random(self.seed * 1000003 + person_id).random() < self.missing_rate
+
+    @staticmethod
+    def __slug(name):
+        return '-'.join(SpNameIndex.words(name))
+
+
+class SpStandInServer:
+    """
+    Local HTTP server serving search, person and company API endpoints from SpSyntheticWorld.
+    Latency, server errors and throttling can be injected.
+    """
+
+    def __init__(self, world: SpSyntheticWorld, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 host='127.0.0.1', port=0, seed=0):
+        """
+        :param world: synthetic world served
+        :param latency: seconds added to every response
+        :param jitter: maximal random seconds added on top of the latency
+        :param error_rate: fraction of requests answered with HTTP 503
+        :param throttle_rate: fraction of requests answered with HTTP 429 and Retry-After
+        :param host: listening address
+        :param port: listening port, 0 for any free port
+        :param seed: random seed of injected failures
+        """
+
+        self.world = world
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.requests = 0
+
+        self.server = ThreadingHTTPServer((host, port), self.__handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        :return: API base url, to be passed to SpRestClient
+        """
+
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%s/api/' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            # headers and body are written separately, Nagle's algorithm would delay the body until an ACK
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                fields = self.__fields()
+                endpoint = self.path.rstrip('/').rsplit('/', 1)[-1]
+
+                with stand_in.random_lock:
+                    stand_in.requests += 1
+                    delay = stand_in.latency + stand_in.random.uniform(0, stand_in.jitter)
+                    dice = stand_in.random.random()
+
+                time.sleep(delay)
+
+                if dice < stand_in.throttle_rate:
+                    return self.__reply(429, {'error': 'too many requests'}, {'Retry-After': '0.1'})
+
+                if dice < stand_in.throttle_rate + stand_in.error_rate:
+                    return self.__reply(503, {'error': 'service unavailable'})
+
+                if endpoint == 'search':
+                    return self.__reply(200, stand_in.world.search(fields.get('phrase', '')))
+
+                if endpoint in ['person', 'company'] and fields.get('id', '').isdigit():
+                    method = stand_in.world.person if endpoint == 'person' else stand_in.world.company
+                    doc = method(int(fields['id']))
+                    if doc is not None:
+                        return self.__reply(200, doc)
+
+                return self.__reply(404, {'error': 'not found'})
+
+            def log_message(self, *args):
+                pass
+
+            def __fields(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                content_type = self.headers.get('Content-Type', '')
+
+                if content_type.startswith('multipart/form-data'):
+                    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+                    # urllib3 sends utf-8 values without a charset, which email would decode as ascii
+                    return {part.get_param('name', header='content-disposition'):
+                            part.get_payload(decode=True).decode('utf-8')
+                            for part in message.iter_parts()}
+
+                return {k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}
+
+            def __reply(self, status, doc, headers=None):
+                data = json.dumps(doc).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class SpBenchmark:
+    """
+    Repeatable benchmarks of SpGraph, SpScrapperCache and SpScrapper against a synthetic world.
+    Every benchmark returns a flat dictionary of measurements. Keys ending with '_per_second' are throughputs,
+    keys ending with '_seconds' are latencies, and keys ending with '_bytes' are memory.
+    """
+
+    def __init__(self, world: SpSyntheticWorld, server: SpStandInServer, work_dir=None, seed=0):
+        """
+        :param world: synthetic world
+        :param server: running stand-in API server of the world
+        :param work_dir: directory for level 2 cache databases, None for a temporary one
+        :param seed: random seed of queries
+        """
+
+        self.world = world
+        self.server = server
+        self.work_dir = work_dir if work_dir is not None else tempfile.mkdtemp(prefix='sp_benchmark_')
+        self.seed = seed
+
+    def graph(self, queries=200):
+        """
+        Builds SpGraph of the whole world and queries shortest paths between random people.
+
+        :param queries: number of path queries
+        :return: dictionary of measurements
+        """
+
+        start = time.perf_counter()
+        graph = self.__build_graph()
+        build_seconds = time.perf_counter() - start
+
+        tracemalloc.start()
+        graph = self.__build_graph()
+        graph_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        r = random.Random(self.seed)
+        latencies = []
+        found = 0
+
+        for _ in range(queries):
+            source_id = graph.get_person_id(self.world.random_person_ref(r))
+            target_id = graph.get_person_id(self.world.random_person_ref(r))
+
+            start = time.perf_counter()
+            path = graph.shortest_path(source_id, target_id)
+            latencies.append(time.perf_counter() - start)
+            found += path is not None
+
+        start = time.perf_counter()
+        graph.nx_graph
+        nx_seconds = time.perf_counter() - start
+
+        return {
+            'nodes': len(graph.natural_keys),
+            'relations': self.world.relations(),
+            'build_seconds': build_seconds,
+            'build_relations_per_second': self.world.relations() / build_seconds,
+            'graph_bytes': graph_bytes,
+            'path_found_rate': found / max(queries, 1),
+            'path_median_seconds': statistics.median(latencies) if latencies else 0,
+            'path_p95_seconds': self.__percentile(latencies, 0.95),
+            'nx_graph_seconds': nx_seconds
+        }
+
+    def cache(self, lookups=5000, cache_max_items=None, skew=2.0):
+        """
+        Looks up skewed random people and their companies through a cold SpScrapperCache with SQLite storage.
+
+        :param lookups: number of person lookups
+        :param cache_max_items: level 1 cache limit per entity type, None for no limit
+        :param skew: skew of looked up people, higher repeats popular people more often
+        :return: dictionary of measurements
+        """
+
+        cache = self.__cache('cache', cache_max_items=cache_max_items)
+        r = random.Random(self.seed)
+        metrics.reset()
+
+        start = time.perf_counter()
+        for _ in range(lookups):
+            person_id = int(self.world.persons * r.random() ** skew)
+            person = cache.get_person_by_ref(self.world.person_info(person_id))
+            for company_ref in (person or {}).get('companies', []):
+                cache.get_company_by_ref(company_ref)
+        cache.flush()
+        seconds = time.perf_counter() - start
+
+        result = self.__cache_measurements(cache)
+        result.update({
+            'lookups': lookups,
+            'seconds': seconds,
+            'lookups_per_second': lookups / seconds,
+        })
+        cache.storage.close()
+        return result
+
+    def scrapper(self, distance=2, queries=10, max_workers=1):
+        """
+        Runs expand_person and find_path queries on a cold cache, then repeats them on the warm cache.
+
+        :param distance: query distance measured in companies
+        :param queries: number of queries of each kind
+        :param max_workers: SpScrapper concurrency
+        :return: dictionary of measurements
+        """
+
+        cache = self.__cache('scrapper_%s' % max_workers)
+        scrapper = SpScrapper(cache, max_workers)
+        r = random.Random(self.seed)
+        person_refs = [self.world.random_person_ref(r) for _ in range(queries * 3)]
+        result = {}
+
+        for phase in ['cold', 'warm']:
+            metrics.reset()
+            api_calls = cache.api_calls
+            expand_latencies = []
+            path_latencies = []
+            nodes = 0
+
+            for i in range(queries):
+                start = time.perf_counter()
+                graph = scrapper.expand_person(person_refs[i], distance)
+                expand_latencies.append(time.perf_counter() - start)
+                nodes += len(graph.natural_keys)
+
+            for i in range(queries):
+                start = time.perf_counter()
+                scrapper.find_path(person_refs[queries + 2 * i], person_refs[queries + 2 * i + 1], distance)
+                path_latencies.append(time.perf_counter() - start)
+
+            seconds = sum(expand_latencies) + sum(path_latencies)
+            result.update({
+                '%s_expand_median_seconds' % phase: statistics.median(expand_latencies),
+                '%s_expand_p95_seconds' % phase: self.__percentile(expand_latencies, 0.95),
+                '%s_path_median_seconds' % phase: statistics.median(path_latencies),
+                '%s_path_p95_seconds' % phase: self.__percentile(path_latencies, 0.95),
+                '%s_nodes_per_second' % phase: nodes / max(sum(expand_latencies), 1e-9),
+                '%s_api_calls' % phase: cache.api_calls - api_calls,
+                '%s_queries_per_second' % phase: 2 * queries / max(seconds, 1e-9)
+            })
+            result.update({'%s_%s' % (phase, k): v for k, v in self.__cache_measurements(cache).items()})
+
+        cache.storage.close()
+        return result
+
+    def run(self, graph_queries=200, cache_lookups=5000, scrapper_queries=10, distance=2, workers=(1,)):
+        """
+        Runs all benchmarks.
+
+        :return: dictionary of benchmark name to measurements
+        """
+
+        report = {'graph': self.graph(graph_queries), 'cache': self.cache(cache_lookups)}
+        for max_workers in workers:
+            report['scrapper_%s' % max_workers] = self.scrapper(distance, scrapper_queries, max_workers)
+
+        report['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return report
+
+    def close(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def __build_graph(self):
+        graph = SpGraph()
+
+        for company_id in range(self.world.companies):
+            company_info = self.world.company_info(company_id)
+            graph.add_company(company_info)
+
+            for i in range(self.world.company_offsets[company_id], self.world.company_offsets[company_id + 1]):
+                person_info = self.world.person_info(self.world.company_persons[i])
+                graph.add_person(person_info)
+                graph.add_company_person(company_info, person_info,
+                                         company_person={'roles': [self.world.ROLES[self.world.company_roles[i]][0]]})
+
+        return graph
+
+    def __cache(self, name, cache_max_items=None):
+        path = os.path.join(self.work_dir, '%s.sqlite' % name)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+        client = SpRestClient(self.server.url, scheduler=SpRestScheduler(max_concurrency=16, backoff=0.05))
+        cache = SpScrapperCache(client, cache_max_items=cache_max_items)
+        cache.init_sqlite(path)
+        return cache
+
+    @staticmethod
+    def __cache_measurements(cache: SpScrapperCache):
+        lookups = {}
+        for counter in metrics.to_dict()['counters']:
+            if counter['name'] == 'sp_cache_lookups_total':
+                key = '%s_%s' % (counter['labels']['layer'], counter['labels']['result'])
+                lookups[key] = lookups.get(key, 0) + counter['value']
+
+        l1 = lookups.get('l1_hit', 0) + lookups.get('l1_miss', 0)
+        l2 = lookups.get('l2_hit', 0) + lookups.get('l2_miss', 0)
+
+        return {
+            'l1_hit_rate': lookups.get('l1_hit', 0) / l1 if l1 > 0 else 0,
+            'l2_hit_rate': lookups.get('l2_hit', 0) / l2 if l2 > 0 else 0,
+            'api_fetched': lookups.get('api_fetched', 0),
+            'api_failed': lookups.get('api_failed', 0),
+            'l1_items': len(cache.person_cache) + len(cache.company_cache)
+        }
+
+    @staticmethod
+    def __percentile(values, fraction):
+        if len(values) == 0:
+            return 0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Compares benchmark report with a baseline report.
+
+    :param report: current report
+    :param baseline: baseline report
+    :param tolerance: allowed relative slowdown
+    :return: list of (benchmark, measurement, baseline value, current value) tuples of regressions
+    """
+
+    regressions = []
+
+    for benchmark, measurements in report.items():
+        if not isinstance(measurements, dict) or not isinstance(baseline.get(benchmark), dict):
+            continue
+
+        for key, value in measurements.items():
+            base = baseline[benchmark].get(key)
+            if not isinstance(base, (int, float)) or base <= 0:
+                continue
+
+            if key.endswith('_per_second') and value < base * (1 - tolerance):
+                regressions.append((benchmark, key, base, value))
+            elif (key.endswith('_seconds') or key.endswith('_bytes') or key.endswith('_api_calls')) \
+                    and value > base * (1 + tolerance):
+                regressions.append((benchmark, key, base, value))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks graph, cache and scrapper against a local stand-in API.')
+    parser.add_argument('--persons', type=int, default=20000)
+    parser.add_argument('--companies', type=int, default=8000)
+    parser.add_argument('--board-alpha', type=float, default=1.8)
+    parser.add_argument('--person-skew', type=float, default=1.5)
+    parser.add_argument('--missing-rate', type=float, default=0.01)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--jitter', type=float, default=0.002)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--graph-queries', type=int, default=200)
+    parser.add_argument('--cache-lookups', type=int, default=2000)
+    parser.add_argument('--scrapper-queries', type=int, default=5)
+    parser.add_argument('--distance', type=int, default=2)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='json file to write the report to')
+    parser.add_argument('--baseline', default=None, help='json report to compare with, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    enable_logging()
+
+    start_time = time.perf_counter()
+    synthetic_world = SpSyntheticWorld(args.persons, args.companies, args.board_alpha, person_skew=args.person_skew,
+                                       missing_rate=args.missing_rate, seed=args.seed)
+    logger.info('Generated %s people, %s companies and %s relations in %.1fs.',
+                args.persons, args.companies, synthetic_world.relations(), time.perf_counter() - start_time)
+
+    # per layer progress would drown the report
+    get_logger('scrapper').setLevel('WARNING')
+    get_logger('cache').setLevel('ERROR')
+
+    with SpStandInServer(synthetic_world, args.latency, args.jitter, args.error_rate, args.throttle_rate,
+                         seed=args.seed) as stand_in_server:
+        benchmark = SpBenchmark(synthetic_world, stand_in_server, seed=args.seed)
+        benchmark_report = benchmark.run(args.graph_queries, args.cache_lookups, args.scrapper_queries, args.distance,
+                                         args.workers)
+        benchmark.close()
+
+    benchmark_report['config'] = vars(args)
+    print(json.dumps(benchmark_report, indent=2))
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(benchmark_report, output_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            found_regressions = compare(benchmark_report, json.load(baseline_file), args.tolerance)
+
+        for name, measurement, baseline_value, current_value in found_regressions:
+            logger.warning('Regression in %s %s: %s -> %s', name, measurement, baseline_value, current_value)
+
+        if len(found_regressions) > 0:
+            exit(1)
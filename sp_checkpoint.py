@@ -0,0 +1,179 @@
+import itertools
+import json
+import os
+
+from sp_graph import SpCompanyPersonRecord, SpCompanyRecord, SpGraph, SpPersonRecord
+from sp_metrics import get_logger, metrics
+
+logger = get_logger('checkpoint')
+
+
+class SpCheckpoint:
+    """
+    Append-only checkpoint of a neighbourhood crawl, written at BFS layer boundaries.
+
+    The file holds json lines. The first one describes the crawl root, every next one holds the nodes, records
+    and relations added to the graph by a single layer, together with the frontier left after the layer.
+    A layer line is appended and synced only once the layer is complete, so a crawl interrupted in the middle
+    of a layer resumes from the previous one. A torn last line is dropped on load.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: checkpoint file path
+        """
+
+        self.path = path
+
+        # number of graph nodes and relations already written, node ids written without a record
+        self.node_count = 0
+        self.edge_count = 0
+        self.bare_ids = set()
+
+    def exists(self):
+        """
+        :return: True if the checkpoint holds a crawl root.
+        """
+
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def start(self, kind, ref):
+        """
+        Starts a new crawl. Overwrites the checkpoint.
+
+        :param kind: 'person' or 'company'
+        :param ref: person_ref or company_ref of the crawl root
+        """
+
+        self.node_count = 0
+        self.edge_count = 0
+        self.bare_ids = set()
+
+        with open(self.path, 'w', encoding='utf-8') as checkpoint_file:
+            self.__write(checkpoint_file, {'kind': kind, 'ref': ref})
+
+    def save(self, sp_graph: SpGraph, companies, distance, depth):
+        """
+        Appends a completed layer.
+
+        :param sp_graph: graph being built
+        :param companies: company json objects forming the frontier left after the layer
+        :param distance: distance explored so far, see SpScrapper.expand_person
+        :param depth: depth of the people visited by the layer
+        """
+
+        with metrics.timer('sp_checkpoint_seconds', operation='save'):
+            nodes = [[sp_graph.kinds[node_id], sp_graph.natural_keys[node_id], self.__record(sp_graph, node_id)]
+                     for node_id in range(self.node_count, len(sp_graph.natural_keys))]
+
+            records = [[node_id, sp_graph.records[node_id].to_dict()]
+                       for node_id in sorted(self.bare_ids)
+                       if sp_graph.records[node_id] is not None]
+
+            edges = [[edge >> 32, edge & 0xffffffff, None if record is None else record.to_dict()]
+                     for edge, record in itertools.islice(sp_graph.edge_records.items(), self.edge_count, None)]
+
+            frontier = [{'id': company['information']['id'], 'slug': company['information'].get('slug')}
+                        for company in companies]
+
+            with open(self.path, 'a', encoding='utf-8') as checkpoint_file:
+                self.__write(checkpoint_file, {'distance': distance,
+                                               'depth': depth,
+                                               'nodes': nodes,
+                                               'records': records,
+                                               'edges': edges,
+                                               'frontier': frontier})
+
+        self.bare_ids.difference_update(node_id for node_id, _ in records)
+        self.bare_ids.update(self.node_count + i for i, node in enumerate(nodes) if node[2] is None)
+        self.node_count = len(sp_graph.natural_keys)
+        self.edge_count = len(sp_graph.edge_records)
+
+        logger.info('Checkpoint after layer %s: %s nodes, %s relations, %s frontier companies.',
+                    depth, self.node_count, self.edge_count, len(frontier))
+
+    def load(self):
+        """
+        Restores the graph and the frontier of the last completed layer. Later saves append to it.
+
+        :return: Tuple of root kind, root ref, SpGraph, list of frontier company refs, distance explored
+        and depth of the last layer. Distance and depth are 0 and None if no layer was completed.
+        """
+
+        with metrics.timer('sp_checkpoint_seconds', operation='load'):
+            sp_graph = SpGraph()
+            root = None
+            frontier = []
+            distance = 0
+            depth = None
+            offset = 0
+
+            with open(self.path, 'rb') as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line) if line.endswith(b'\n') else None
+                    except ValueError:
+                        entry = None
+
+                    if entry is None:
+                        logger.warning('Dropping incomplete checkpoint layer after distance %s.', distance)
+                        break
+
+                    offset += len(line)
+
+                    if root is None:
+                        root = entry
+                        continue
+
+                    for kind, natural_key, record in entry['nodes']:
+                        sp_graph.add_node(tuple(natural_key), kind, self.__restore_record(kind, record))
+
+                    for node_id, record in entry['records']:
+                        sp_graph.add_node(sp_graph.natural_keys[node_id], sp_graph.kinds[node_id],
+                                          self.__restore_record(sp_graph.kinds[node_id], record))
+
+                    for company_id, person_id, record in entry['edges']:
+                        sp_graph.add_edge(company_id, person_id,
+                                          None if record is None else SpCompanyPersonRecord(record))
+
+                    frontier = entry['frontier']
+                    distance = entry['distance']
+                    depth = entry['depth']
+
+            if root is None:
+                raise ValueError('Checkpoint %s holds no crawl.' % self.path)
+
+            # next layers are appended after the last complete one
+            with open(self.path, 'r+b') as checkpoint_file:
+                checkpoint_file.truncate(offset)
+
+        self.node_count = len(sp_graph.natural_keys)
+        self.edge_count = len(sp_graph.edge_records)
+        self.bare_ids = {node_id for node_id, record in enumerate(sp_graph.records) if record is None}
+
+        logger.info('Checkpoint loaded after layer %s: %s nodes, %s relations, %s frontier companies.',
+                    depth, self.node_count, self.edge_count, len(frontier))
+
+        return root['kind'], root['ref'], sp_graph, frontier, distance, depth
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @staticmethod
+    def __record(sp_graph: SpGraph, node_id):
+        record = sp_graph.records[node_id]
+        return None if record is None else record.to_dict()
+
+    @staticmethod
+    def __restore_record(kind, record):
+        if record is None:
+            return None
+
+        return SpPersonRecord(record) if kind == SpGraph.PERSON else SpCompanyRecord(record)
+
+    @staticmethod
+    def __write(checkpoint_file, entry):
+        checkpoint_file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
@@ -0,0 +1,357 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+from sp_graph import SpGraph
+from sp_metrics import enable_logging, get_logger
+from sp_rest_client import SpRestClient
+from sp_scrapper import SpScrapper
+from sp_scrapper_cache import SpScrapperCache
+
+logger = get_logger('cli')
+
+
+class SpCliError(Exception):
+    """
+    Raised for people or companies which cannot be found. Reported on stderr.
+    """
+
+    pass
+
+
+class SpCli:
+    """
+    Headless command line front end for scripted and batch use.
+
+    People and companies are given either as 'id/slug', or as a search query optionally followed by '#n',
+    which picks the n-th search result (the first one by default), e.g. 'Jerzy Mazgaj#3'.
+
+    Results are written as json lines, one object per query, or as csv rows.
+    Plotting libraries are imported only by export to an image file.
+    """
+
+    SEARCH_FIELDS = ['query', 'type', 'id', 'slug', 'name', 'birthYear', 'krs']
+    PATH_FIELDS = ['person_1', 'person_2', 'found', 'path']
+    EXPAND_FIELDS = ['query', 'company', 'person', 'roles']
+
+    def __init__(self, sp_scrapper_cache: SpScrapperCache, scrapper_workers=4, output_format='json', out=None):
+        """
+        :param sp_scrapper_cache: cache with level 2 cache initialized
+        :param scrapper_workers: number of concurrent fetches per BFS layer, see SpScrapper
+        :param output_format: 'json' for json lines or 'csv'
+        :param out: output stream, defaults to stdout
+        """
+
+        self.sp_scrapper_cache = sp_scrapper_cache
+        self.sp_scrapper = SpScrapper(sp_scrapper_cache, scrapper_workers)
+        self.output_format = output_format
+        self.out = out if out is not None else sys.stdout
+        self.csv_writer = None
+        self.errors = 0
+
+    def search(self, queries, type=None):
+        """
+        Writes search results of every query.
+
+        :param queries: list of search queries
+        :param type: 'person' or 'company' to limit results to one type, None for both
+        """
+
+        for query in queries:
+            for result in self.sp_scrapper_cache.search(query, type):
+                if type is None or result.get('type') == type:
+                    self.__write(self.SEARCH_FIELDS, dict(result, query=query))
+
+    def path(self, pairs, distance):
+        """
+        Writes the path of every pair of people, or that there is none. All pairs share one expansion graph.
+
+        :param pairs: list of (person spec, person spec) tuples
+        :param distance: distance measured in 'company' nodes
+        """
+
+        refs = {}
+        for spec in {spec for pair in pairs for spec in pair}:
+            refs[spec] = self.__resolve(spec, self.__person_ref)
+
+        pairs = [pair for pair in pairs if refs[pair[0]] is not None and refs[pair[1]] is not None]
+        specs = {(id(refs[spec_1]), id(refs[spec_2])): (spec_1, spec_2) for spec_1, spec_2 in pairs}
+
+        graph = SpGraph()
+        labels = None
+
+        for person_ref_1, person_ref_2, path in self.sp_scrapper.find_paths([(refs[spec_1], refs[spec_2])
+                                                                             for spec_1, spec_2 in pairs],
+                                                                            distance, graph):
+            spec_1, spec_2 = specs[id(person_ref_1), id(person_ref_2)]
+
+            if path is not None and labels is None:
+                labels = {graph.node_key(node_id): graph.label(node_id) for node_id in range(len(graph.natural_keys))}
+
+            self.__write(self.PATH_FIELDS, {
+                'person_1': spec_1,
+                'person_2': spec_2,
+                'found': path is not None,
+                'path': None if path is None else [{'key': key, 'label': labels[key]} for key in path]
+            })
+
+    def expand(self, specs, distance, company=False):
+        """
+        Writes relations found around every person or company.
+
+        :param specs: list of person or company specs
+        :param distance: distance measured in 'company' nodes
+        :param company: True if specs are companies
+        """
+
+        for spec in specs:
+            graph = self.__expand(spec, distance, company)
+
+            if graph is None:
+                continue
+
+            if self.output_format == 'csv':
+                for relation in graph.to_json()['relations']:
+                    self.__write(self.EXPAND_FIELDS, dict(relation, query=spec))
+            else:
+                self.__write(None, {'query': spec, 'graph': graph.to_json()})
+
+    def export(self, spec, distance, path, company=False, to=None):
+        """
+        Writes the graph around a person or a company, or the graph of a path search, to a file.
+
+        :param spec: person or company spec
+        :param distance: distance measured in 'company' nodes
+        :param path: .graphml or .gexf file path for graph viewers, or .png, .svg, .pdf image path
+        :param company: True if spec is a company
+        :param to: person spec to find a path to, None to expand spec
+        """
+
+        if to is not None:
+            person_ref_1 = self.__resolve(spec, self.__person_ref)
+            person_ref_2 = self.__resolve(to, self.__person_ref)
+            if person_ref_1 is None or person_ref_2 is None:
+                return
+
+            graph = self.sp_scrapper.find_path(person_ref_1, person_ref_2, distance)
+        else:
+            graph = self.__expand(spec, distance, company)
+            if graph is None:
+                return
+
+        extension = os.path.splitext(path)[1].lower()
+
+        if extension in ['.graphml', '.gexf']:
+            from sp_render import write_gexf, write_graphml
+
+            (write_graphml if extension == '.graphml' else write_gexf)(graph, path)
+        else:
+            graph.draw(path)
+
+        logger.info('Exported %s nodes to %s.', len(graph.natural_keys), path)
+
+    def __expand(self, spec, distance, company):
+        if company:
+            company_ref = self.__resolve(spec, self.__company_ref)
+            graph = None if company_ref is None else self.sp_scrapper.expand_company(company_ref, distance)
+
+            if company_ref is not None and graph is None:
+                self.__error(spec, 'Company cannot be expanded.')
+
+            return graph
+
+        person_ref = self.__resolve(spec, self.__person_ref)
+        return None if person_ref is None else self.sp_scrapper.expand_person(person_ref, distance)
+
+    def __resolve(self, spec, resolve_method):
+        """
+        :param spec: person or company spec
+        :param resolve_method: __person_ref or __company_ref
+        :return: *_ref, None if it cannot be found (the error is reported)
+        """
+
+        try:
+            return resolve_method(spec)
+        except SpCliError as ex:
+            self.__error(spec, str(ex))
+            return None
+
+    def __person_ref(self, spec):
+        id, slug = self.__id_and_slug(spec)
+
+        if id is not None:
+            person_ref = self.sp_scrapper_cache.resolve_person_ref({'id': id, 'slug': slug})
+            if person_ref is None:
+                raise SpCliError('Person not found.')
+
+            return person_ref
+
+        return self.__search_ref(spec, 'person')
+
+    def __company_ref(self, spec):
+        id, slug = self.__id_and_slug(spec)
+
+        if id is not None:
+            return {'id': id, 'slug': slug}
+
+        return self.__search_ref(spec, 'company')
+
+    def __search_ref(self, spec, type):
+        """
+        :param spec: search query optionally followed by '#n'
+        :param type: 'person' or 'company'
+        :return: n-th search result of the type
+        """
+
+        query, _, n = spec.rpartition('#')
+        if query == '' or not n.isdigit():
+            query, n = spec, '0'
+
+        results = [result for result in self.sp_scrapper_cache.search(query, type) if result.get('type') == type]
+
+        if int(n) >= len(results):
+            raise SpCliError('%s search returned %s results.' % (type.capitalize(), len(results)))
+
+        return results[int(n)]
+
+    @staticmethod
+    def __id_and_slug(spec):
+        """
+        :return: Tuple of id and slug of an 'id/slug' spec, (None, None) for search queries.
+        """
+
+        id, _, slug = spec.partition('/')
+
+        if not id.isdigit() or slug == '' or ' ' in slug:
+            return None, None
+
+        return id, slug
+
+    def __write(self, fields, row):
+        """
+        :param fields: csv columns of the command, None if the command writes json only
+        :param row: json object
+        """
+
+        if self.output_format != 'csv' or fields is None:
+            self.out.write(json.dumps(row, ensure_ascii=False) + '\n')
+            return
+
+        if self.csv_writer is None:
+            self.csv_writer = csv.DictWriter(self.out, fields, extrasaction='ignore')
+            self.csv_writer.writeheader()
+
+        self.csv_writer.writerow({field: self.__csv_value(row.get(field)) for field in fields})
+
+    @staticmethod
+    def __csv_value(value):
+        if isinstance(value, list):
+            return ' -> '.join(v['label'] for v in value) if value and isinstance(value[0], dict) else '; '.join(value)
+
+        return value
+
+    def __error(self, spec, message):
+        self.errors += 1
+        logger.error('%s: %s', spec, message)
+
+
+def read_batch(path, columns=1):
+    """
+    :param path: text file with one query per line, columns separated by tabs, '-' for stdin
+    :param columns: number of columns in a line
+    :return: list of queries, or of tuples of columns if there are more of them
+    """
+
+    batch_file = sys.stdin if path == '-' else open(path, encoding='utf-8')
+
+    try:
+        lines = [line.rstrip('\n').split('\t') for line in batch_file if line.strip() != '']
+    finally:
+        if batch_file is not sys.stdin:
+            batch_file.close()
+
+    for i, line in enumerate(lines):
+        if len(line) != columns:
+            raise SpCliError('%s:%s: expected %s tab separated columns.' % (path, i + 1, columns))
+
+    return [line[0] if columns == 1 else tuple(line) for line in lines]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Searches people and companies and finds connections between them.')
+    parser.add_argument('--api-url', default='https://sprawdz.biz/api/')
+    parser.add_argument('--couchdb-url', default=None)
+    parser.add_argument('--couchdb-name', default='sp')
+    parser.add_argument('--sqlite-path', default='sp.sqlite')
+    parser.add_argument('--index-path', default=None, help='local name search index')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent fetches per BFS layer')
+    parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    parser.add_argument('--verbose', action='store_true', help='prints progress to stderr')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    search_parser = commands.add_parser('search', help='searches people and companies')
+    search_parser.add_argument('query', nargs='*')
+    search_parser.add_argument('--type', choices=['person', 'company'], default=None)
+    search_parser.add_argument('--batch', default=None, help='file with a query per line, - for stdin')
+
+    path_parser = commands.add_parser('path', help='finds paths between people')
+    path_parser.add_argument('person', nargs='*', help='2 person specs')
+    path_parser.add_argument('--distance', type=int, default=2)
+    path_parser.add_argument('--batch', default=None, help='file with tab separated person specs, - for stdin')
+
+    expand_parser = commands.add_parser('expand', help='lists relations around people or companies')
+    expand_parser.add_argument('spec', nargs='*')
+    expand_parser.add_argument('--company', action='store_true', help='specs are companies')
+    expand_parser.add_argument('--distance', type=int, default=1)
+    expand_parser.add_argument('--batch', default=None, help='file with a spec per line, - for stdin')
+
+    export_parser = commands.add_parser('export', help='writes graph around a person or a company to a file')
+    export_parser.add_argument('spec')
+    export_parser.add_argument('output', help='.graphml, .gexf, .png, .svg or .pdf file')
+    export_parser.add_argument('--company', action='store_true', help='spec is a company')
+    export_parser.add_argument('--to', default=None, help='person spec, exports graph of a path search')
+    export_parser.add_argument('--distance', type=int, default=1)
+
+    args = parser.parse_args()
+    enable_logging(logging.INFO if args.verbose else logging.WARNING, sys.stderr)
+
+    scrapper_cache = SpScrapperCache(SpRestClient(args.api_url))
+
+    if args.couchdb_url is not None:
+        import couchdb
+        from sp_storage import SpCouchStorage
+
+        scrapper_cache.init_storage(SpCouchStorage(couchdb.Server(args.couchdb_url)[args.couchdb_name]))
+    else:
+        scrapper_cache.init_sqlite(args.sqlite_path)
+
+    if args.index_path is not None:
+        scrapper_cache.init_name_index(args.index_path)
+
+    cli = SpCli(scrapper_cache, args.workers, args.format)
+
+    try:
+        if args.command == 'search':
+            cli.search(read_batch(args.batch) if args.batch is not None else [' '.join(args.query)], args.type)
+
+        elif args.command == 'path':
+            if args.batch is None and len(args.person) != 2:
+                parser.error('path needs 2 person specs or --batch')
+
+            cli.path(read_batch(args.batch, 2) if args.batch is not None else [tuple(args.person)], args.distance)
+
+        elif args.command == 'expand':
+            cli.expand(read_batch(args.batch) if args.batch is not None else args.spec, args.distance, args.company)
+
+        else:
+            cli.export(args.spec, args.distance, args.output, args.company, args.to)
+    except SpCliError as ex:
+        logger.error('%s', ex)
+        cli.errors += 1
+    finally:
+        scrapper_cache.flush()
+
+    sys.exit(1 if cli.errors > 0 else 0)
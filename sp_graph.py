@@ -1,21 +1,90 @@
-import networkx as nx
-import matplotlib.pyplot as plt
 import hashlib
-from time import gmtime, strftime
+from array import array
+from collections import deque
+
+from sp_metrics import metrics
+
+
+class SpRecord:
+    """
+    Base of compact metadata records kept in the graph. Stores only fields listed in __slots__.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, item):
+        """
+        :param item: json object to take the fields from
+        """
+
+        for field in self.__slots__:
+            setattr(self, field, item.get(field))
+
+    def to_dict(self):
+        """
+        :return: json object with fields present in the source object.
+        """
+
+        return {field: getattr(self, field) for field in self.__slots__ if getattr(self, field) is not None}
+
+
+class SpPersonRecord(SpRecord):
+    """
+    Person metadata kept in the graph.
+    """
+
+    __slots__ = ('name', 'birthYear', 'id', 'slug')
+
+
+class SpCompanyRecord(SpRecord):
+    """
+    Company metadata kept in the graph.
+    """
+
+    __slots__ = ('name', 'krs', 'nip', 'regon', 'registerDate', 'id', 'slug')
+
+
+class SpCompanyPersonRecord(SpRecord):
+    """
+    Company-person relation metadata kept in the graph.
+    """
+
+    __slots__ = ('roles',)
 
 
 class SpGraph:
     """
     Class holding scrapping graph result with metadata.
+
+    Every person and company is interned once to an integer node id.
+    Adjacency is kept in integer arrays, metadata in __slots__ records.
+    networkx representation and json-like dictionaries are built on demand.
     """
 
+    PERSON = 0
+    COMPANY = 1
+
     def __init__(self):
-        self.nx_graph = nx.Graph()
-        self.person_dict = {}
-        self.company_dict = {}
-        self.company_person_dict = {}
+        # natural key -> node id
+        self.person_ids = {}
+        self.company_ids = {}
+
+        # node id -> natural key, kind, metadata record, neighbour node ids
+        self.natural_keys = []
+        self.kinds = bytearray()
+        self.records = []
+        self.adjacency = []
+
+        # company node id << 32 | person node id -> SpCompanyPersonRecord or None
+        self.edge_records = {}
+
         self.paths = []
 
+        # False if the search producing the graph was cut by its budget or skipped some companies
+        self.exact = True
+
+        self.__nx_graph = None
+
     def add_person(self, person):
         """
         Tries adding person-like json object to the graph. This can by either person_ref or person_info json object.
@@ -24,13 +93,12 @@ class SpGraph:
         :return: True if the object was added, False if already existed.
         """
 
-        person_key = self.get_person_key(person)
+        person_id = self.__intern(self.person_ids, self.get_person_natural_key(person), self.PERSON)
 
-        if person_key in self.person_dict:
+        if self.records[person_id] is not None:
             return False
 
-        self.nx_graph.add_node(person_key)
-        self.person_dict[person_key] = person
+        self.records[person_id] = SpPersonRecord(person)
         return True
 
     def exist_person(self, person):
@@ -41,7 +109,8 @@ class SpGraph:
         :return: True if the object exists, False otherwise.
         """
 
-        return self.get_person_key(person) in self.person_dict
+        person_id = self.get_person_id(person)
+        return person_id is not None and self.records[person_id] is not None
 
     def add_company(self, company):
         """
@@ -51,13 +120,12 @@ class SpGraph:
         :return: True if the object was added, False if already existed.
         """
 
-        company_key = self.get_company_key(company)
+        company_id = self.__intern(self.company_ids, self.get_company_natural_key(company), self.COMPANY)
 
-        if company_key in self.company_dict:
+        if self.records[company_id] is not None:
             return False
 
-        self.nx_graph.add_node(company_key)
-        self.company_dict[company_key] = company
+        self.records[company_id] = SpCompanyRecord(company)
         return True
 
     def exist_company(self, company):
@@ -68,7 +136,8 @@ class SpGraph:
         :return: True if the object exists, False otherwise.
         """
 
-        return self.get_company_key(company) in self.company_dict
+        company_id = self.get_company_id(company)
+        return company_id is not None and self.records[company_id] is not None
 
     def add_company_person(self, company, person, company_person=None):
         """
@@ -80,17 +149,206 @@ class SpGraph:
         :return: True if the object exists, False otherwise.
         """
 
-        person_key = self.get_person_key(person)
-        company_key = self.get_company_key(company)
-        company_person_key = (company_key, person_key)
+        company_id = self.__intern(self.company_ids, self.get_company_natural_key(company), self.COMPANY)
+        person_id = self.__intern(self.person_ids, self.get_person_natural_key(person), self.PERSON)
+        edge = company_id << 32 | person_id
 
-        if company_person_key in self.company_person_dict:
+        if edge in self.edge_records:
             return False
 
-        self.nx_graph.add_edge(company_key, person_key)
-        self.company_person_dict[company_person_key] = company_person
+        self.adjacency[company_id].append(person_id)
+        self.adjacency[person_id].append(company_id)
+        self.edge_records[edge] = None if company_person is None else SpCompanyPersonRecord(company_person)
+        self.__nx_graph = None
         return True
 
+    def add_node(self, natural_key, kind, record=None):
+        """
+        Adds node by its natural key, e.g. when the graph is copied or restored.
+
+        :param natural_key: person or company natural key
+        :param kind: PERSON or COMPANY
+        :param record: SpPersonRecord or SpCompanyRecord, None to keep the current one
+        :return: Node id.
+        """
+
+        node_id = self.__intern(self.person_ids if kind == self.PERSON else self.company_ids, natural_key, kind)
+
+        if record is not None:
+            self.records[node_id] = record
+
+        return node_id
+
+    def add_edge(self, company_id, person_id, record=None):
+        """
+        Adds company-person relation between existing nodes, e.g. when the graph is copied or restored.
+
+        :param company_id: company node id
+        :param person_id: person node id
+        :param record: SpCompanyPersonRecord or None
+        :return: True if the relation was added, False if already existed.
+        """
+
+        edge = company_id << 32 | person_id
+
+        if edge in self.edge_records:
+            return False
+
+        self.adjacency[company_id].append(person_id)
+        self.adjacency[person_id].append(company_id)
+        self.edge_records[edge] = record
+        self.__nx_graph = None
+        return True
+
+    def get_person_id(self, person):
+        """
+        :param person: person-like json object (person_ref or person_info)
+        :return: Node id of the person or None if it is not in the graph.
+        """
+
+        return self.person_ids.get(self.get_person_natural_key(person))
+
+    def get_company_id(self, company):
+        """
+        :param company: company-like json object (company_ref or company_info)
+        :return: Node id of the company or None if it is not in the graph.
+        """
+
+        return self.company_ids.get(self.get_company_natural_key(company))
+
+    def neighbours(self, node_id):
+        """
+        :param node_id: person or company node id
+        :return: Array of neighbouring node ids.
+        """
+
+        return self.adjacency[node_id]
+
+    def shortest_path(self, source_id, target_id):
+        """
+        Finds shortest path between two nodes with BFS over integer adjacency.
+
+        :param source_id: node id
+        :param target_id: node id
+        :return: List of node ids from source to target or None if there is no path.
+        """
+
+        parents = {source_id: None}
+        queue = deque([source_id])
+
+        while len(queue) > 0:
+            node_id = queue.popleft()
+
+            if node_id == target_id:
+                path = []
+                while node_id is not None:
+                    path.append(node_id)
+                    node_id = parents[node_id]
+                return path[::-1]
+
+            for neighbour_id in self.adjacency[node_id]:
+                if neighbour_id not in parents:
+                    parents[neighbour_id] = node_id
+                    queue.append(neighbour_id)
+
+        return None
+
+    def path_node_ids(self):
+        """
+        :return: List of node id lists of found paths, recomputed with BFS over integer adjacency.
+        """
+
+        key_ids = {self.node_key(node_id): node_id for node_id in range(len(self.natural_keys))}
+        paths = []
+
+        for key_1, key_2 in self.paths:
+            if key_1 in key_ids and key_2 in key_ids:
+                path = self.shortest_path(key_ids[key_1], key_ids[key_2])
+                if path is not None:
+                    paths.append(path)
+
+        return paths
+
+    def path_json(self):
+        """
+        :return: List of found paths, each a list of {'key', 'label', 'type'} json objects of its nodes.
+        """
+
+        return [[{'key': self.node_key(node_id),
+                  'label': self.label(node_id),
+                  'type': 'person' if self.kinds[node_id] == self.PERSON else 'company'}
+                 for node_id in path]
+                for path in self.path_node_ids()]
+
+    def to_json(self):
+        """
+        :return: json object of people and companies by their 'unique' keys, relations with roles and found paths
+        """
+
+        return {
+            'persons': self.person_dict,
+            'companies': self.company_dict,
+            'relations': [{'company': company_key, 'person': person_key,
+                           'roles': None if record is None else record.get('roles')}
+                          for (company_key, person_key), record in self.company_person_dict.items()],
+            'paths': [[self.node_key(node_id) for node_id in path] for path in self.path_node_ids()],
+            'exact': self.exact
+        }
+
+    def neighbourhood(self, node_ids, radius=1):
+        """
+        :param node_ids: node ids, e.g. nodes of found paths
+        :param radius: maximal number of edges between returned nodes and given ones
+        :return: Set of node ids within the radius.
+        """
+
+        reached = set(node_ids)
+        frontier = list(reached)
+
+        for _ in range(radius):
+            next_frontier = []
+            for node_id in frontier:
+                for neighbour_id in self.adjacency[node_id]:
+                    if neighbour_id not in reached:
+                        reached.add(neighbour_id)
+                        next_frontier.append(neighbour_id)
+            frontier = next_frontier
+
+        return reached
+
+    def top_nodes(self, k):
+        """
+        :param k: number of nodes
+        :return: List of k node ids with the most neighbours.
+        """
+
+        return sorted(range(len(self.natural_keys)), key=lambda node_id: -len(self.adjacency[node_id]))[:k]
+
+    def subgraph(self, node_ids):
+        """
+        Copies part of the graph. Keeps relations and found paths between the copied nodes.
+
+        :param node_ids: node ids to copy
+        :return: New SpGraph.
+        """
+
+        graph = SpGraph()
+        new_ids = {node_id: graph.add_node(self.natural_keys[node_id], self.kinds[node_id], self.records[node_id])
+                   for node_id in sorted(set(node_ids))}
+
+        for edge, record in self.edge_records.items():
+            company_id = new_ids.get(edge >> 32)
+            person_id = new_ids.get(edge & 0xffffffff)
+
+            if company_id is not None and person_id is not None:
+                graph.add_edge(company_id, person_id, record)
+
+        keys = {self.node_key(node_id) for node_id in new_ids}
+        graph.paths = [(key_1, key_2) for key_1, key_2 in self.paths if key_1 in keys and key_2 in keys]
+        graph.exact = self.exact
+
+        return graph
+
     def person_person_path(self, person_1, person_2):
         """
         Checks if path between two people in graph exists.
@@ -101,15 +359,260 @@ class SpGraph:
         :return: True if the path exists, False otherwise.
         """
 
-        person_1_key = self.get_person_key(person_1)
-        person_2_key = self.get_person_key(person_2)
+        person_1_id = self.get_person_id(person_1)
+        person_2_id = self.get_person_id(person_2)
 
-        if nx.has_path(self.nx_graph, person_1_key, person_2_key):
-            self.paths.append((person_1_key, person_2_key))
-            return True
-        else:
+        if person_1_id is None or person_2_id is None or self.shortest_path(person_1_id, person_2_id) is None:
             return False
 
+        self.paths.append((self.node_key(person_1_id), self.node_key(person_2_id)))
+        return True
+
+    def person_person_paths(self, person_1, person_2, distance=None, min_distance=1, k=None):
+        """
+        Lazily enumerates simple paths between two people, shortest first.
+        Paths of every length are enumerated with depth-first search pruned by BFS distances to person 2,
+        so memory depends on the path length, not on the number of paths.
+
+        :param person_1: person-like json object (person_ref or person_info)
+        :param person_2: person-like json object (person_ref or person_info)
+        :param distance: Maximal distance measured in 'company' nodes, None for no limit.
+        :param min_distance: Minimal distance measured in 'company' nodes.
+        :param k: Maximal number of paths, None for all of them.
+        :return: Generator of paths. Every path is a list of (node key, roles) tuples,
+        where roles are the roles of the edge leading to the node (None for the first node or no role).
+        """
+
+        person_1_id = self.get_person_id(person_1)
+        person_2_id = self.get_person_id(person_2)
+
+        if person_1_id is None or person_2_id is None:
+            return
+
+        distances = self.__distances(person_2_id)
+        if person_1_id not in distances:
+            return
+
+        max_hops = len(self.natural_keys) if distance is None else distance * 2
+        count = 0
+
+        for hops in range(max(distances[person_1_id], min_distance * 2), max_hops + 1, 2):
+            cut = [False]
+
+            for path in self.__simple_paths(person_1_id, person_2_id, hops, distances, cut):
+                yield self.__labelled_path(path)
+
+                count = count + 1
+                if k is not None and count >= k:
+                    return
+
+            # no branch was cut by the length limit, so there are no longer paths
+            if not cut[0]:
+                return
+
+    def __distances(self, node_id):
+        """
+        :param node_id: node id
+        :return: Dictionary of BFS distances from the node to every node reachable from it.
+        """
+
+        distances = {node_id: 0}
+        queue = deque([node_id])
+
+        while len(queue) > 0:
+            node_id = queue.popleft()
+            for neighbour_id in self.adjacency[node_id]:
+                if neighbour_id not in distances:
+                    distances[neighbour_id] = distances[node_id] + 1
+                    queue.append(neighbour_id)
+
+        return distances
+
+    def __simple_paths(self, source_id, target_id, hops, distances, cut):
+        """
+        Enumerates simple paths of exact length with iterative depth-first search.
+
+        :param source_id: node id
+        :param target_id: node id
+        :param hops: path length in edges
+        :param distances: BFS distances to the target node
+        :param cut: one element list set to True if any branch was pruned by the length
+        :return: Generator of lists of node ids.
+        """
+
+        path = [source_id]
+        on_path = {source_id}
+        stack = [iter(self.adjacency[source_id])]
+
+        while len(stack) > 0:
+            node_id = next(stack[-1], None)
+
+            if node_id is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+
+            remaining = hops - len(path)
+
+            if node_id in on_path:
+                continue
+
+            if distances.get(node_id, remaining + 1) > remaining:
+                cut[0] = cut[0] or node_id in distances
+                continue
+
+            if node_id == target_id:
+                if remaining == 0:
+                    yield path + [node_id]
+                continue
+
+            path.append(node_id)
+            on_path.add(node_id)
+            stack.append(iter(self.adjacency[node_id]))
+
+    def __labelled_path(self, path):
+        """
+        :param path: list of node ids
+        :return: List of (node key, roles) tuples.
+        """
+
+        labelled_path = [(self.node_key(path[0]), None)]
+
+        for node_id_1, node_id_2 in zip(path, path[1:]):
+            edge = node_id_1 << 32 | node_id_2 if self.kinds[node_id_1] == self.COMPANY else node_id_2 << 32 | node_id_1
+            record = self.edge_records.get(edge)
+            labelled_path.append((self.node_key(node_id_2), None if record is None else record.roles))
+
+        return labelled_path
+
+    def node_key(self, node_id):
+        """
+        Returns node 'unique' key, the same as get_person_key or get_company_key would return.
+
+        :param node_id: person or company node id
+        :return: Node 'unique' key.
+        """
+
+        natural_key = self.natural_keys[node_id]
+
+        if self.kinds[node_id] == self.PERSON:
+            return 'p_' + str(hashlib.md5(''.join(natural_key).encode()).hexdigest())
+
+        if natural_key[0] != '':
+            return 'c_' + natural_key[0] + '_' + natural_key[1]
+
+        return 'c_' + str(hashlib.md5(natural_key[1].encode()).hexdigest())
+
+    @property
+    def nx_graph(self):
+        """
+        networkx representation of the graph keyed by node 'unique' keys. Built on demand and cached until the graph changes.
+        """
+
+        import networkx as nx
+
+        if self.__nx_graph is None or self.__nx_graph.number_of_nodes() != len(self.natural_keys):
+            with metrics.timer('sp_graph_seconds', operation='nx_graph'):
+                keys = [self.node_key(node_id) for node_id in range(len(self.natural_keys))]
+
+                nx_graph = nx.Graph()
+                nx_graph.add_nodes_from(keys)
+                nx_graph.add_edges_from((keys[edge >> 32], keys[edge & 0xffffffff]) for edge in self.edge_records)
+
+            self.__nx_graph = nx_graph
+
+        return self.__nx_graph
+
+    @property
+    def person_dict(self):
+        """
+        Dictionary of person json objects by person 'unique' keys. Built on demand.
+        """
+
+        return self.__record_dict(self.person_ids)
+
+    @property
+    def company_dict(self):
+        """
+        Dictionary of company json objects by company 'unique' keys. Built on demand.
+        """
+
+        return self.__record_dict(self.company_ids)
+
+    @property
+    def company_person_dict(self):
+        """
+        Dictionary of company_person json objects by (company key, person key) tuples. Built on demand.
+        """
+
+        return {(self.node_key(edge >> 32), self.node_key(edge & 0xffffffff)): None if record is None else record.to_dict()
+                for edge, record in self.edge_records.items()}
+
+    def __record_dict(self, ids):
+        return {self.node_key(node_id): self.records[node_id].to_dict()
+                for node_id in ids.values()
+                if self.records[node_id] is not None}
+
+    def __intern(self, ids, natural_key, kind):
+        """
+        Returns node id of a natural key. Creates a node without metadata if it does not exist.
+
+        :param ids: person_ids or company_ids
+        :param natural_key: person or company natural key
+        :param kind: PERSON or COMPANY
+        :return: Node id.
+        """
+
+        node_id = ids.get(natural_key)
+
+        if node_id is None:
+            node_id = len(self.natural_keys)
+            ids[natural_key] = node_id
+            self.natural_keys.append(natural_key)
+            self.kinds.append(kind)
+            self.records.append(None)
+            self.adjacency.append(array('i'))
+
+        return node_id
+
+    @staticmethod
+    def get_person_natural_key(item):
+        """
+        Returns person-like json object natural key. This is tuple of person's name and birthYear.
+
+        :param item: person-like json object (person_ref or person_info)
+        :return: Person natural key or None if the object has neither name nor birthYear.
+        """
+
+        natural_key = (item.get('name', ''), item.get('birthYear', ''))
+
+        if natural_key == ('', ''):
+            return None
+
+        return natural_key
+
+    @staticmethod
+    def get_company_natural_key(item):
+        """
+        Returns company-like json object natural key. This is either ('krs' | 'nip' | 'regon', identifier) tuple,
+        or ('', register date and name) tuple.
+
+        :param item: company-like json object (company_ref or company_info)
+        :return: Company natural key.
+        """
+
+        # KRS, NIP and REGON uniquely identifies a company
+        for identifier in ['krs', 'nip', 'regon']:
+            if identifier in item:
+                return identifier, item[identifier]
+
+        key_base = item.get('registerDate', '') + item.get('name', '')
+
+        if key_base == '':
+            raise Exception('Company key must not be empty.')
+
+        return '', key_base
+
     @staticmethod
     def get_person_key(item):
         """
@@ -128,7 +631,7 @@ class SpGraph:
         # key_base = key_base if 'slug' not in item else key_base + item['slug']
         # key_base = key_base if 'id' not in item else key_base + item['id']
 
-        if key_base is '':
+        if key_base == '':
             return None
 
         return 'p_' + str(hashlib.md5(key_base.encode()).hexdigest())
@@ -164,66 +667,49 @@ class SpGraph:
         # key_base = key_base if 'slug' not in item else key_base + item['slug']
         # key_base = key_base if 'id' not in item else key_base + item['id']
 
-        if key_base is '':
+        if key_base == '':
             raise Exception('Company key must not be empty.')
 
         return 'c_' + str(hashlib.md5(key_base.encode()).hexdigest())
 
-    def draw(self):
+    def draw(self, path=None, renderer=None, node_ids=None):
         """
-        Draws cached graph representation.
-        """
-
-        node_labels = {}
-        for k in self.person_dict:
-            v = self.person_dict[k]
-            node_labels[k] = self.__cut_label(v['name'] + ', ' + v['birthYear'])
-        for k in self.company_dict:
-            v = self.company_dict[k]
-            node_labels[k] = self.__cut_label(v['name'] + ', KRS ' + v['krs'])
-
-        edge_labels = {}
-        for k in self.company_person_dict:
-            v = self.company_person_dict[k]
-            edge_labels[k] = 'No role' if v is None else self.__cut_label(', '.join(v['roles']))
-
-        pos = nx.spring_layout(self.nx_graph)
-
-        nx.draw_networkx_nodes(self.nx_graph, pos,
-                               nodelist=self.person_dict.keys(),
-                               node_color='r')
+        Draws graph representation. Shows it with pyplot, or writes it to an image file without any display.
 
-        nx.draw_networkx_nodes(self.nx_graph, pos,
-                               nodelist=self.company_dict.keys(),
-                               node_color='b')
-
-        nx.draw_networkx_labels(self.nx_graph, pos, node_labels)
+        :param path: PNG, SVG or PDF file path, None to show the graph with pyplot
+        :param renderer: SpRenderer with layout and style settings, None for the default one
+        :param node_ids: node ids to draw, None for the whole graph (see neighbourhood and top_nodes)
+        """
 
-        nx.draw_networkx_edges(self.nx_graph, pos)
+        from sp_render import SpRenderer
 
-        for ends in self.paths:
-            path = nx.shortest_path(self.nx_graph,
-                                    source=ends[0],
-                                    target=ends[1])
-            path_edges = list(zip(path, path[1:]))
-            nx.draw_networkx_nodes(self.nx_graph, pos, nodelist=path, node_color='g')
-            nx.draw_networkx_edges(self.nx_graph, pos, edgelist=path_edges, edge_color='g', width=10)
+        renderer = renderer if renderer is not None else SpRenderer()
+        graph = self if node_ids is None else self.subgraph(node_ids)
 
-        nx.draw_networkx_edge_labels(self.nx_graph, pos, edge_labels)
+        if path is not None:
+            renderer.save(graph, path)
+            return
 
-        # TODO scale and save figure
-        # plt.figure(figsize=(100, 50))
-        # plt.savefig('sp_result_' + strftime("%Y-%m-%d_%H:%M:%S", gmtime()) + '.png')
+        import matplotlib.pyplot as plt
 
+        renderer.draw(graph, plt.gca())
         plt.show()
 
-    @staticmethod
-    def __cut_label(label):
+    def label(self, node_id):
         """
-        Trims a string to 40 characters length. Replaces exceeding part with '...'.
+        Returns node label, 'name, birthYear' for people and 'name, KRS krs' for companies.
+        Trims it to 40 characters length. Replaces exceeding part with '...'.
 
-        :param label: any string
+        :param node_id: person or company node id
         :return: Formatted string
         """
 
+        record = self.records[node_id]
+        natural_key = self.natural_keys[node_id]
+
+        if self.kinds[node_id] == self.PERSON:
+            label = '%s, %s' % (record.name, record.birthYear) if record is not None else ', '.join(natural_key)
+        else:
+            label = '%s, KRS %s' % (record.name, record.krs) if record is not None else natural_key[1]
+
         return label if len(label) < 40 else label[:40] + '...'
@@ -0,0 +1,490 @@
+import argparse
+import json
+import math
+import mmap
+import os
+from array import array
+from collections import deque
+
+from sp_graph import SpGraph
+from sp_metrics import enable_logging, get_logger
+from sp_storage import SpStorage
+
+logger = get_logger('index')
+
+
+class SpIndex:
+    """
+    Persistent person-company adjacency index compiled from cached documents.
+    Answers connectivity and shortest path queries without calling the API.
+
+    The index is a directory of memory-mapped CSR arrays:
+    offsets (int64, one per node plus one), targets (int32 node ids) and roles (int32 role ids per edge),
+    and meta.json with node document ids, node labels and role names.
+
+    The index can also hold BFS hop distances from a few landmark nodes, the best connected people and companies.
+    For any two nodes they give a lower bound |d(L, a) - d(L, b)| and an upper bound d(L, a) + d(L, b)
+    of their distance, in a few microseconds. The bounds hold for the graph as it was indexed,
+    which is only the cached part of the real graph.
+    """
+
+    META_FILE = 'meta.json'
+    OFFSETS_FILE = 'offsets.bin'
+    TARGETS_FILE = 'targets.bin'
+    ROLES_FILE = 'roles.bin'
+    LANDMARKS_FILE = 'landmarks.bin'
+
+    # landmark distance of nodes which cannot be reached from the landmark
+    UNREACHABLE = 0xffff
+
+    def __init__(self, path):
+        """
+        Opens an index built with SpIndex.build.
+
+        :param path: index directory path
+        """
+
+        self.path = path
+
+        with open(os.path.join(path, self.META_FILE), encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+
+        self.nodes = meta['nodes']
+        self.labels = meta['labels']
+        self.roles = meta['roles']
+        self.node_ids = {doc_id: node_id for node_id, doc_id in enumerate(self.nodes)}
+
+        self.mmaps = []
+        self.offsets = self.__map(self.OFFSETS_FILE, 'q')
+        self.targets = self.__map(self.TARGETS_FILE, 'i')
+        self.edge_roles = self.__map(self.ROLES_FILE, 'i')
+
+        # node id * number of landmarks + landmark number -> hops between the node and the landmark
+        self.landmarks = meta.get('landmarks', [])
+        self.landmark_distances = self.__map(self.LANDMARKS_FILE, 'H') if len(self.landmarks) > 0 else None
+
+    @staticmethod
+    def build(storage: SpStorage, path, landmarks=16):
+        """
+        Compiles all person and company documents of a storage into an index.
+        Relations are taken both from person 'companies' and company 'representation' and 'directorsBoard'.
+
+        :param storage: level 2 cache storage
+        :param path: index directory path, created if it does not exist
+        :param landmarks: number of landmarks, see build_landmarks, 0 for none
+        :return: Opened SpIndex.
+        """
+
+        node_ids = {}
+        nodes = []
+        labels = []
+        edges = {}
+
+        def node_id(doc_id):
+            if doc_id not in node_ids:
+                node_ids[doc_id] = len(nodes)
+                nodes.append(doc_id)
+                labels.append(None)
+            return node_ids[doc_id]
+
+        def add_edge(person_doc_id, company_doc_id, roles):
+            edge = (node_id(person_doc_id), node_id(company_doc_id))
+            edges.setdefault(edge, set()).update(roles)
+
+        for doc in storage:
+            doc_id = doc.get('_id', '')
+
+            if 'information' in doc:
+                labels[node_id(doc_id)] = SpIndex.__label(doc['information'])
+
+            if doc_id.startswith('p_'):
+                for company_ref in doc.get('companies', []):
+                    add_edge(doc_id, 'c_%s' % company_ref['id'], company_ref.get('roles', []))
+
+            elif doc_id.startswith('c_'):
+                for section in ['representation', 'directorsBoard']:
+                    for person_ref in doc.get(section, []):
+                        add_edge('p_%s' % person_ref['id'], doc_id, [])
+
+        adjacency = [[] for _ in nodes]
+        role_ids = {}
+        roles = []
+
+        for (person_node_id, company_node_id), edge_roles in edges.items():
+            role = ', '.join(sorted(edge_roles))
+            if role not in role_ids:
+                role_ids[role] = len(roles)
+                roles.append(role)
+
+            adjacency[person_node_id].append((company_node_id, role_ids[role]))
+            adjacency[company_node_id].append((person_node_id, role_ids[role]))
+
+        offsets = array('q', [0])
+        targets = array('i')
+        edge_roles = array('i')
+
+        for neighbours in adjacency:
+            for target, role_id in neighbours:
+                targets.append(target)
+                edge_roles.append(role_id)
+            offsets.append(len(targets))
+
+        os.makedirs(path, exist_ok=True)
+
+        for file_name, values in [(SpIndex.OFFSETS_FILE, offsets),
+                                  (SpIndex.TARGETS_FILE, targets),
+                                  (SpIndex.ROLES_FILE, edge_roles)]:
+            with open(os.path.join(path, file_name), 'wb') as data_file:
+                values.tofile(data_file)
+
+        with open(os.path.join(path, SpIndex.META_FILE), 'w', encoding='utf-8') as meta_file:
+            json.dump({'nodes': nodes, 'labels': labels, 'roles': roles}, meta_file, ensure_ascii=False)
+
+        logger.info('Indexed %s nodes and %s relations.', len(nodes), len(edges))
+
+        index = SpIndex(path)
+        if landmarks > 0:
+            index.build_landmarks(landmarks)
+
+        return index
+
+    def build_landmarks(self, count=16):
+        """
+        Selects landmarks and stores BFS hop distances from each of them to every node.
+        Landmarks are the nodes of the highest degree, skipping neighbours of the ones already selected,
+        so that they are spread over different parts of the graph.
+
+        :param count: maximal number of landmarks
+        """
+
+        n = len(self.nodes)
+        by_degree = sorted(range(n), key=lambda node_id: self.offsets[node_id] - self.offsets[node_id + 1])
+        landmarks = []
+        covered = set()
+
+        for node_id in by_degree:
+            if len(landmarks) == count or self.offsets[node_id + 1] == self.offsets[node_id]:
+                break
+
+            if node_id in covered:
+                continue
+
+            landmarks.append(node_id)
+            covered.add(node_id)
+            covered.update(self.targets[self.offsets[node_id]:self.offsets[node_id + 1]])
+
+        distances = array('H', [self.UNREACHABLE]) * (n * len(landmarks))
+
+        for i, landmark in enumerate(landmarks):
+            for node_id, hops in self.__bfs(landmark):
+                distances[node_id * len(landmarks) + i] = min(hops, self.UNREACHABLE - 1)
+
+        if isinstance(self.landmark_distances, memoryview):
+            self.landmark_distances.release()
+            self.mmaps.pop().close()
+
+        with open(os.path.join(self.path, self.LANDMARKS_FILE), 'wb') as data_file:
+            distances.tofile(data_file)
+
+        meta_path = os.path.join(self.path, self.META_FILE)
+        with open(meta_path, encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+
+        meta['landmarks'] = landmarks
+        with open(meta_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file, ensure_ascii=False)
+
+        self.landmarks = landmarks
+        self.landmark_distances = self.__map(self.LANDMARKS_FILE, 'H') if len(landmarks) > 0 else None
+
+        logger.info('Indexed distances from %s landmarks.', len(landmarks))
+
+    def cached(self, node_id):
+        """
+        :param node_id: index node id
+        :return: True if the node's document was cached, so all its relations are indexed, False otherwise.
+        """
+
+        return self.labels[node_id] is not None
+
+    def hop_bounds(self, node_id_1, node_id_2):
+        """
+        Returns bounds of the number of edges on the shortest path between two nodes, from landmark distances.
+
+        :param node_id_1: index node id
+        :param node_id_2: index node id
+        :return: Tuple of lower and upper bound. Both are math.inf if the nodes are not connected,
+        the upper one is math.inf if no landmark reaches them.
+        """
+
+        if node_id_1 == node_id_2:
+            return 0, 0
+
+        if self.landmark_distances is None:
+            return 0, math.inf
+
+        k = len(self.landmarks)
+        distances_1 = self.landmark_distances[node_id_1 * k:node_id_1 * k + k].tolist()
+        distances_2 = self.landmark_distances[node_id_2 * k:node_id_2 * k + k].tolist()
+
+        if self.UNREACHABLE not in distances_1 and self.UNREACHABLE not in distances_2:
+            return max(map(abs, map(int.__sub__, distances_1, distances_2))), \
+                   min(map(int.__add__, distances_1, distances_2))
+
+        lower = 0
+        upper = math.inf
+
+        for hops_1, hops_2 in zip(distances_1, distances_2):
+            if hops_1 == self.UNREACHABLE or hops_2 == self.UNREACHABLE:
+                # a landmark reaching only one of the nodes proves they are in different components
+                if hops_1 != hops_2:
+                    return math.inf, math.inf
+                continue
+
+            lower = max(lower, abs(hops_1 - hops_2))
+            upper = min(upper, hops_1 + hops_2)
+
+        return lower, upper
+
+    def distance_bounds(self, person_ref_1, person_ref_2):
+        """
+        Returns bounds of the distance between two people, from landmark distances.
+
+        :param person_ref_1: Some person ref
+        :param person_ref_2: Some other person ref
+        :return: Tuple of lower and upper bound of the distance measured in 'company' nodes.
+        (0, math.inf) if any of the people is not indexed, (math.inf, math.inf) if they are not connected.
+        """
+
+        node_id_1 = self.node_id(person_ref_1)
+        node_id_2 = self.node_id(person_ref_2)
+
+        if node_id_1 is None or node_id_2 is None:
+            return 0, math.inf
+
+        lower, upper = self.hop_bounds(node_id_1, node_id_2)
+
+        if lower == math.inf:
+            return lower, upper
+
+        # paths between people have an even number of edges, two per company
+        return (lower + 1) // 2, upper if upper == math.inf else upper // 2
+
+    def close(self):
+        """
+        Releases memory-mapped files.
+        """
+
+        for view in [self.offsets, self.targets, self.edge_roles, self.landmark_distances]:
+            if isinstance(view, memoryview):
+                view.release()
+
+        self.offsets = self.targets = self.edge_roles = self.landmark_distances = None
+
+        for mm in self.mmaps:
+            mm.close()
+
+        self.mmaps = []
+
+    def node_id(self, item_ref, prefix='p_'):
+        """
+        Returns index node id of a person_ref or company_ref.
+
+        :param item_ref: *_ref json object or document id string
+        :param prefix: 'p_' for people, 'c_' for companies, used for *_ref objects
+        :return: Node id or None if the entity is not indexed.
+        """
+
+        doc_id = item_ref if isinstance(item_ref, str) else prefix + str(item_ref['id'])
+        return self.node_ids.get(doc_id)
+
+    def neighbours(self, node_id):
+        """
+        :param node_id: index node id
+        :return: List of (neighbour node id, role name) tuples.
+        """
+
+        return [(self.targets[i], self.roles[self.edge_roles[i]])
+                for i in range(self.offsets[node_id], self.offsets[node_id + 1])]
+
+    def connected(self, person_ref_1, person_ref_2, distance=None):
+        """
+        Checks if two people are connected in the index.
+
+        :param person_ref_1: Some person ref
+        :param person_ref_2: Some other person ref
+        :param distance: Maximal distance measured in 'company' nodes, None for no limit.
+        :return: True if the people are connected, False otherwise.
+        """
+
+        return self.shortest_path(person_ref_1, person_ref_2, distance) is not None
+
+    def shortest_path(self, person_ref_1, person_ref_2, distance=None):
+        """
+        Finds shortest path between two people with bidirectional BFS over the index.
+
+        :param person_ref_1: Some person ref
+        :param person_ref_2: Some other person ref
+        :param distance: Maximal distance measured in 'company' nodes, None for no limit.
+        :return: List of document ids from person 1 to person 2 or None if there is no such path.
+        """
+
+        source = self.node_id(person_ref_1)
+        target = self.node_id(person_ref_2)
+
+        if source is None or target is None:
+            return None
+
+        if source == target:
+            return [self.nodes[source]]
+
+        max_hops = None if distance is None else distance * 2
+        parents = [{source: None}, {target: None}]
+        frontiers = [deque([source]), deque([target])]
+        hops = [0, 0]
+
+        while len(frontiers[0]) > 0 and len(frontiers[1]) > 0:
+            if max_hops is not None and hops[0] + hops[1] >= max_hops:
+                return None
+
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            hops[side] += 1
+            meet = None
+            next_frontier = deque()
+
+            for node_id in frontiers[side]:
+                for i in range(self.offsets[node_id], self.offsets[node_id + 1]):
+                    neighbour_id = self.targets[i]
+
+                    if neighbour_id in parents[side]:
+                        continue
+
+                    parents[side][neighbour_id] = node_id
+                    next_frontier.append(neighbour_id)
+
+                    if meet is None and neighbour_id in parents[1 - side]:
+                        meet = neighbour_id
+
+            if meet is not None:
+                return [self.nodes[node_id] for node_id in self.__unwind(parents[0], meet)[::-1]] + \
+                       [self.nodes[node_id] for node_id in self.__unwind(parents[1], meet)[1:]]
+
+            frontiers[side] = next_frontier
+
+        return None
+
+    def path_graph(self, path):
+        """
+        Builds SpGraph of a path, so that it can be drawn.
+
+        :param path: list of document ids returned by shortest_path
+        :return: SpGraph with the path.
+        """
+
+        graph = SpGraph()
+
+        for doc_id in path:
+            label = self.labels[self.node_ids[doc_id]] or {'id': doc_id[2:], 'name': doc_id}
+            if doc_id.startswith('p_'):
+                graph.add_person(label)
+            else:
+                graph.add_company(label)
+
+        for doc_id_1, doc_id_2 in zip(path, path[1:]):
+            person_doc_id, company_doc_id = (doc_id_1, doc_id_2) if doc_id_1.startswith('p_') else (doc_id_2, doc_id_1)
+            person_node_id = self.node_ids[person_doc_id]
+            company_node_id = self.node_ids[company_doc_id]
+            person = self.labels[person_node_id] or {'id': person_doc_id[2:], 'name': person_doc_id}
+            company = self.labels[company_node_id] or {'id': company_doc_id[2:], 'name': company_doc_id}
+
+            roles = [role for neighbour_id, role in self.neighbours(person_node_id) if neighbour_id == company_node_id]
+            graph.add_company_person(company, person, company_person={'roles': roles})
+
+        if len(path) > 1:
+            graph.person_person_path(self.labels[self.node_ids[path[0]]] or {'name': path[0]},
+                                     self.labels[self.node_ids[path[-1]]] or {'name': path[-1]})
+
+        return graph
+
+    def __bfs(self, source):
+        """
+        :param source: index node id
+        :return: Generator of (node id, hops) tuples of nodes reachable from the source.
+        """
+
+        visited = {source}
+        frontier = [source]
+        hops = 0
+
+        while len(frontier) > 0:
+            next_frontier = []
+
+            for node_id in frontier:
+                yield node_id, hops
+
+                for neighbour_id in self.targets[self.offsets[node_id]:self.offsets[node_id + 1]]:
+                    if neighbour_id not in visited:
+                        visited.add(neighbour_id)
+                        next_frontier.append(neighbour_id)
+
+            frontier = next_frontier
+            hops += 1
+
+    @staticmethod
+    def __unwind(parents, node_id):
+        path = []
+        while node_id is not None:
+            path.append(node_id)
+            node_id = parents[node_id]
+        return path
+
+    @staticmethod
+    def __label(info):
+        """
+        :param info: person_info or company_info json object
+        :return: Fields of the object needed to identify and display it.
+        """
+
+        return {k: v for k, v in info.items() if k in ['id', 'slug', 'name', 'birthYear', 'krs', 'nip', 'regon', 'registerDate']}
+
+    def __map(self, file_name, type_code):
+        """
+        Memory-maps a binary array file.
+
+        :param file_name: file name in the index directory
+        :param type_code: array type code
+        :return: memoryview of the file cast to the type.
+        """
+
+        with open(os.path.join(self.path, file_name), 'rb') as data_file:
+            if os.fstat(data_file.fileno()).st_size == 0:
+                return array(type_code)
+
+            mm = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.mmaps.append(mm)
+        return memoryview(mm).cast(type_code)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds offline adjacency index from level 2 cache.')
+    parser.add_argument('--couchdb-url', default=None)
+    parser.add_argument('--couchdb-name', default='sp')
+    parser.add_argument('--sqlite-path', default='sp.sqlite')
+    parser.add_argument('--index-path', default='sp_index')
+    parser.add_argument('--landmarks', type=int, default=16, help='number of landmarks, 0 for none')
+    args = parser.parse_args()
+    enable_logging()
+
+    if args.couchdb_url is not None:
+        import couchdb
+        from sp_storage import SpCouchStorage
+
+        source_storage = SpCouchStorage(couchdb.Server(args.couchdb_url)[args.couchdb_name])
+    else:
+        from sp_storage import SpSqliteStorage
+
+        source_storage = SpSqliteStorage(args.sqlite_path)
+
+    SpIndex.build(source_storage, args.index_path, args.landmarks).close()
+    source_storage.close()
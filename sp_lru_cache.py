@@ -0,0 +1,154 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+class SpLruCache:
+    """
+    Thread safe, size bounded LRU dictionary. Used as SpScrapperCache level 1 cache.
+    Items can be bounded by their number and by their approximate memory cost.
+    """
+
+    def __init__(self, max_items=None, max_bytes=None, cost_method=None):
+        """
+        :param max_items: maximal number of items, None for no limit
+        :param max_bytes: maximal approximate memory cost of all items, None for no limit
+        :param cost_method: lambda returning item cost in bytes, defaults to estimate_size
+        """
+
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.cost_method = cost_method if cost_method is not None else estimate_size
+
+        self.items = OrderedDict()
+        self.costs = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Returns an item and marks it as recently used.
+
+        :param key: item key
+        :param default: value returned if key is missing
+        :return: cached item or default
+        """
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Returns an item without marking it as recently used or counting a hit.
+
+        :param key: item key
+        :param default: value returned if key is missing
+        :return: cached item or default
+        """
+
+        with self.lock:
+            return self.items.get(key, default)
+
+    def __getitem__(self, key):
+        item = self.get(key, self)
+        if item is self:
+            raise KeyError(key)
+        return item
+
+    def __setitem__(self, key, item):
+        cost = self.cost_method(item) if self.max_bytes is not None else 0
+
+        with self.lock:
+            if key in self.items:
+                self.bytes -= self.costs[key]
+
+            self.items[key] = item
+            self.items.move_to_end(key)
+            self.costs[key] = cost
+            self.bytes += cost
+
+            while len(self.items) > 1 and self.__overflows():
+                evicted_key, _ = self.items.popitem(last=False)
+                self.bytes -= self.costs.pop(evicted_key)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def pop(self, key, default=None):
+        """
+        Removes an item.
+
+        :param key: item key
+        :param default: value returned if key is missing
+        :return: removed item or default
+        """
+
+        with self.lock:
+            if key not in self.items:
+                return default
+
+            self.bytes -= self.costs.pop(key)
+            return self.items.pop(key)
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.costs.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Returns cache statistics.
+
+        :return: dictionary with hits, misses, evictions, items and bytes counters
+        """
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'items': len(self.items),
+            'bytes': self.bytes
+        }
+
+    def __overflows(self):
+        return (self.max_items is not None and len(self.items) > self.max_items) or \
+               (self.max_bytes is not None and self.bytes > self.max_bytes)
+
+
+def estimate_size(item):
+    """
+    Approximates memory used by a json-like object.
+
+    :param item: json-like object (dicts, lists, tuples and scalars)
+    :return: approximate size in bytes
+    """
+
+    size = sys.getsizeof(item)
+
+    if isinstance(item, dict):
+        for k, v in item.items():
+            size += sys.getsizeof(k) + estimate_size(v)
+    elif isinstance(item, (list, tuple)):
+        for v in item:
+            size += estimate_size(v)
+
+    return size
@@ -0,0 +1,316 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# application logger, configure its handlers to redirect progress messages
+logger = logging.getLogger('sp')
+
+
+def get_logger(name):
+    """
+    :param name: module name, e.g. 'scrapper'
+    :return: Child of the application logger.
+    """
+
+    return logger.getChild(name)
+
+
+def enable_logging(level=logging.INFO, stream=None):
+    """
+    Prints application log messages to a stream, the way progress used to be printed.
+
+    :param level: minimal level of printed messages, DEBUG prints every visited person and company
+    :param stream: output stream, defaults to stdout
+    :return: Added logging handler.
+    """
+
+    handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return handler
+
+
+class SpHistogram:
+    """
+    Cumulative histogram with fixed bucket upper bounds.
+    """
+
+    def __init__(self, buckets):
+        """
+        :param buckets: sorted bucket upper bounds
+        """
+
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        :return: List of (bucket upper bound, number of values not greater than the bound) tuples.
+        """
+
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class SpMetrics:
+    """
+    Thread safe registry of counters, gauges and histograms, identified by name and labels.
+    Exported as json or Prometheus text format.
+
+    Instrumented calls can additionally be profiled with cProfile and reported to trace hooks.
+    """
+
+    # seconds
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    # number of items
+    SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+        self.profile_dir = None
+        self.trace_hooks = []
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increases a counter.
+
+        :param name: counter name
+        :param value: increment
+        :param labels: counter labels
+        """
+
+        key = self.__key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Sets a gauge.
+
+        :param name: gauge name
+        :param value: current value
+        :param labels: gauge labels
+        """
+
+        with self.lock:
+            self.gauges[self.__key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Records a value in a histogram.
+
+        :param name: histogram name
+        :param value: observed value
+        :param buckets: bucket upper bounds used when the histogram is created
+        :param labels: histogram labels
+        """
+
+        key = self.__key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = SpHistogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Measures duration of a with block in a latency histogram.
+
+        :param name: histogram name
+        :param labels: histogram labels
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def enable_profiling(self, profile_dir):
+        """
+        Runs instrumented calls under cProfile and dumps their stats to <name>-<nanoseconds>.prof files.
+
+        :param profile_dir: directory for profile files, None to disable profiling
+        """
+
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        self.profile_dir = profile_dir
+
+    def add_trace_hook(self, hook):
+        """
+        Registers a callback invoked after every instrumented call.
+
+        :param hook: lambda taking call name, duration in seconds and exception or None
+        """
+
+        self.trace_hooks.append(hook)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def to_dict(self):
+        """
+        :return: Dictionary of counters, gauges and histograms, each a list of json objects with name and labels.
+        """
+
+        with self.lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+                'histograms': [{'name': name,
+                                'labels': dict(labels),
+                                'buckets': [[bound, count] for bound, count in histogram.cumulative_counts()],
+                                'sum': histogram.sum,
+                                'count': histogram.count}
+                               for (name, labels), histogram in sorted(self.histograms.items())]
+            }
+
+    def to_json(self, indent=None):
+        """
+        :param indent: json indentation, None for a single line
+        :return: Metrics json string.
+        """
+
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self):
+        """
+        :return: Metrics in Prometheus text exposition format.
+        """
+
+        metrics = self.to_dict()
+        lines = []
+        typed = set()
+
+        def type_line(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s %s' % (name, metric_type))
+
+        for counter in metrics['counters']:
+            type_line(counter['name'], 'counter')
+            lines.append('%s%s %s' % (counter['name'], self.__labels(counter['labels']), counter['value']))
+
+        for gauge in metrics['gauges']:
+            type_line(gauge['name'], 'gauge')
+            lines.append('%s%s %s' % (gauge['name'], self.__labels(gauge['labels']), gauge['value']))
+
+        for histogram in metrics['histograms']:
+            name = histogram['name']
+            type_line(name, 'histogram')
+
+            for bound, count in histogram['buckets'] + [['+Inf', histogram['count']]]:
+                lines.append('%s_bucket%s %s' % (name, self.__labels(dict(histogram['labels'], le=bound)), count))
+
+            lines.append('%s_sum%s %s' % (name, self.__labels(histogram['labels']), histogram['sum']))
+            lines.append('%s_count%s %s' % (name, self.__labels(histogram['labels']), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Writes metrics to a file. Files with .prom or .txt extension get Prometheus text format, others json.
+
+        :param path: output file path
+        """
+
+        with open(path, 'w', encoding='utf-8') as metrics_file:
+            if path.endswith('.prom') or path.endswith('.txt'):
+                metrics_file.write(self.to_prometheus())
+            else:
+                metrics_file.write(self.to_json(indent=2))
+
+    @staticmethod
+    def __key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    @staticmethod
+    def __labels(labels):
+        if len(labels) == 0:
+            return ''
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in sorted(labels.items()))
+
+
+# default registry shared by all modules
+metrics = SpMetrics()
+
+
+def instrumented(name):
+    """
+    Decorator measuring duration of a call in 'sp_call_seconds' histogram.
+    The call is profiled if profiling is enabled, and reported to trace hooks.
+
+    :param name: call name used as label, profile file name and trace hook argument
+    :return: Decorator.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            profiler = cProfile.Profile() if metrics.profile_dir is not None else None
+            error = None
+            start = time.perf_counter()
+
+            if profiler is not None:
+                profiler.enable()
+
+            try:
+                return method(*args, **kwargs)
+            except Exception as ex:
+                error = ex
+                raise
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+
+                seconds = time.perf_counter() - start
+                metrics.observe('sp_call_seconds', seconds, call=name)
+
+                if profiler is not None:
+                    profiler.dump_stats(os.path.join(metrics.profile_dir,
+                                                     '%s-%d.prof' % (name, time.time_ns())))
+
+                for hook in metrics.trace_hooks:
+                    hook(name, seconds, error)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,270 @@
+import argparse
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+
+from sp_metrics import enable_logging, get_logger
+from sp_storage import SpStorage
+
+logger = get_logger('name_index')
+
+
+class SpNameIndex:
+    """
+    Local full text index of people and companies known from cached documents and previous searches.
+    Answers name, birth year, KRS, NIP and REGON searches without calling the API.
+    Matching is prefix and diacritic insensitive, so 'lukasz zol' finds 'Łukasz Żółć'.
+
+    Entities are kept in a SQLite table of ref json objects with an FTS5 table of their folded search text.
+    Refs taken from full documents replace refs mentioned in other documents or search results.
+    """
+
+    # SQLite limits number of bound parameters in a single statement
+    MAX_PARAMS = 900
+
+    SEARCH_FIELDS = ['name', 'birthYear', 'krs', 'nip', 'regon']
+    REF_FIELDS = ['id', 'slug', 'name', 'birthYear', 'krs', 'nip', 'regon']
+
+    def __init__(self, path='sp_names.sqlite'):
+        """
+        :param path: database file path, created if it does not exist
+        """
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS entities ('
+                                'rowid INTEGER PRIMARY KEY, '
+                                'doc_id TEXT NOT NULL UNIQUE, '
+                                'type TEXT NOT NULL, '
+                                'ref TEXT NOT NULL, '
+                                'complete INTEGER NOT NULL)')
+        self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5("
+                                "text, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        self.connection.commit()
+
+    @staticmethod
+    def build(storage: SpStorage, path='sp_names.sqlite', batch_size=1000):
+        """
+        Indexes all documents of a storage.
+
+        :param storage: level 2 cache storage
+        :param path: database file path
+        :param batch_size: number of documents indexed in a single transaction
+        :return: Opened SpNameIndex.
+        """
+
+        index = SpNameIndex(path)
+        count = 0
+        batch = []
+
+        for doc in storage:
+            batch.append(doc)
+
+            if len(batch) >= batch_size:
+                index.add_docs(batch)
+                count += len(batch)
+                batch = []
+
+        index.add_docs(batch)
+        count += len(batch)
+
+        logger.info('Indexed names of %s documents, %s entities known.', count, len(index))
+        return index
+
+    def add_docs(self, docs):
+        """
+        Indexes person and company documents together with people and companies they refer to.
+
+        :param docs: list of json objects with '_id' set
+        """
+
+        entities = []
+
+        for doc in docs:
+            doc_id = doc.get('_id', '')
+
+            if doc_id.startswith('p_'):
+                if 'information' in doc:
+                    entities.append((doc_id, 'person', doc['information'], True))
+                for company_ref in doc.get('companies', []):
+                    entities.append(('c_%s' % company_ref['id'], 'company', company_ref, False))
+
+            elif doc_id.startswith('c_'):
+                if 'information' in doc:
+                    entities.append((doc_id, 'company', doc['information'], True))
+                for section in ['representation', 'directorsBoard']:
+                    for person_ref in doc.get(section, []):
+                        entities.append(('p_%s' % person_ref['id'], 'person', person_ref, False))
+
+        self.__add(entities)
+
+    def add_search_results(self, results):
+        """
+        Indexes people and companies returned by the API search.
+
+        :param results: SpRestClient.search json result
+        """
+
+        prefixes = {'person': 'p_%s', 'company': 'c_%s'}
+
+        self.__add([(prefixes[result['type']] % result['id'], result['type'], result, False)
+                    for result in results
+                    if isinstance(result, dict) and result.get('type') in prefixes and result.get('id') is not None])
+
+    def search(self, query, type=None, limit=20):
+        """
+        Searches people and companies. Every word of the query has to prefix some word of the entity.
+
+        :param query: query string, e.g. name optionally followed by birth year, or KRS, NIP, REGON number
+        :param type: 'person' or 'company' to limit results to one type, None for both
+        :param limit: maximal number of results
+        :return: list of ref json objects with 'type' set
+        """
+
+        with self.lock:
+            return self.__search(query, type, limit)
+
+    def search_many(self, queries, type=None, limit=20):
+        """
+        Resolves many queries at once, e.g. for bulk screening.
+
+        :param queries: list of query strings
+        :param type: 'person' or 'company' to limit results to one type, None for both
+        :param limit: maximal number of results per query
+        :return: list of search results, one per query
+        """
+
+        with self.lock:
+            return [self.__search(query, type, limit) for query in queries]
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM entities').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __search(self, query, type, limit):
+        words = self.words(query)
+        if len(words) == 0:
+            return []
+
+        match = ' AND '.join('"%s"*' % word for word in words)
+        sql = 'SELECT e.type, e.ref FROM names JOIN entities e ON e.rowid = names.rowid WHERE names MATCH ?'
+        params = [match]
+
+        if type is not None:
+            sql += ' AND e.type = ?'
+            params.append(type)
+
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+        return [dict(json.loads(ref), type=entity_type)
+                for entity_type, ref in self.connection.execute(sql, params)]
+
+    def __add(self, entities):
+        """
+        Inserts or replaces entities. Refs of complete documents are not replaced by partial ones.
+
+        :param entities: list of (doc_id, type, ref json object, complete) tuples
+        """
+
+        if len(entities) == 0:
+            return
+
+        # the last and the most complete ref of an entity wins
+        latest = {}
+        for doc_id, entity_type, ref, complete in entities:
+            if complete or doc_id not in latest or not latest[doc_id][2]:
+                latest[doc_id] = (entity_type, ref, complete)
+
+        doc_ids = list(latest)
+
+        with self.lock:
+            with self.connection:
+                existing = {}
+                for i in range(0, len(doc_ids), self.MAX_PARAMS):
+                    chunk = doc_ids[i:i + self.MAX_PARAMS]
+                    rows = self.connection.execute('SELECT doc_id, rowid, complete FROM entities WHERE doc_id IN (%s)'
+                                                   % ','.join('?' * len(chunk)), chunk)
+                    for doc_id, rowid, complete in rows:
+                        existing[doc_id] = (rowid, complete)
+
+                for doc_id, (entity_type, ref, complete) in latest.items():
+                    ref = {k: ref[k] for k in self.REF_FIELDS if ref.get(k) is not None}
+                    text = self.fold(' '.join(str(ref[k]) for k in self.SEARCH_FIELDS if k in ref))
+
+                    if doc_id in existing:
+                        rowid, was_complete = existing[doc_id]
+                        if was_complete and not complete:
+                            continue
+
+                        self.connection.execute('UPDATE entities SET ref = ?, complete = ? WHERE rowid = ?',
+                                                (json.dumps(ref, ensure_ascii=False), int(complete), rowid))
+                        self.connection.execute('DELETE FROM names WHERE rowid = ?', (rowid,))
+                    else:
+                        rowid = self.connection.execute('INSERT INTO entities (doc_id, type, ref, complete) '
+                                                        'VALUES (?, ?, ?, ?)',
+                                                        (doc_id, entity_type, json.dumps(ref, ensure_ascii=False),
+                                                         int(complete))).lastrowid
+
+                    self.connection.execute('INSERT INTO names (rowid, text) VALUES (?, ?)', (rowid, text))
+
+    @staticmethod
+    def fold(text):
+        """
+        Lowercases text and strips diacritics, including Polish 'ł' which has no Unicode decomposition.
+
+        :param text: any string
+        :return: folded string
+        """
+
+        text = unicodedata.normalize('NFKD', text.replace('ł', 'l').replace('Ł', 'L'))
+        return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+    @staticmethod
+    def words(query):
+        """
+        :param query: query string
+        :return: list of folded query words
+        """
+
+        return re.findall(r'\w+', SpNameIndex.fold(query))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds local name search index from level 2 cache.')
+    parser.add_argument('--couchdb-url', default=None)
+    parser.add_argument('--couchdb-name', default='sp')
+    parser.add_argument('--sqlite-path', default='sp.sqlite')
+    parser.add_argument('--index-path', default='sp_names.sqlite')
+    parser.add_argument('query', nargs='*', help='names to look up after building the index')
+    args = parser.parse_args()
+    enable_logging()
+
+    if args.couchdb_url is not None:
+        import couchdb
+        from sp_storage import SpCouchStorage
+
+        source_storage = SpCouchStorage(couchdb.Server(args.couchdb_url)[args.couchdb_name])
+    else:
+        from sp_storage import SpSqliteStorage
+
+        source_storage = SpSqliteStorage(args.sqlite_path)
+
+    name_index = SpNameIndex.build(source_storage, args.index_path)
+
+    for query, results in zip(args.query, name_index.search_many(args.query)):
+        print('%s:' % query)
+        for result in results:
+            print('  %s' % json.dumps(result, ensure_ascii=False))
+
+    name_index.close()
+    source_storage.close()
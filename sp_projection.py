@@ -0,0 +1,150 @@
+import base64
+import json
+import os
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """
+    Decodes json. Uses orjson if it is installed.
+
+    :param data: json bytes or string
+    :return: json object
+    """
+
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps(item):
+    """
+    Encodes json. Uses orjson if it is installed. Tuples, including time.struct_time, are encoded as lists.
+
+    :param item: json object
+    :return: json string
+    """
+
+    if orjson is not None:
+        return orjson.dumps(item, default=list).decode('utf-8')
+
+    return json.dumps(item)
+
+
+class SpProjection:
+    """
+    Projects person and company API payloads onto the fields read by graph traversal and the name index.
+    Other fields (summaryText, buttons, proxies, professions, ...) are dropped before the payload is cached.
+
+    Company fields are projected recursively onto their shape in sp_rest_company_schema.json.
+    Person payloads have no schema, so their fields are kept whole.
+    The raw payload can be kept zlib compressed in the 'raw' field of stored documents.
+
+    Projected items stay plain dicts rather than __slots__ records like those of SpGraph. They are stored,
+    encoded, pickled to shard workers and read by the refresher and the indexes as json objects, and most
+    of their memory is in nested refs, so a record would save only its top level dict, a few percent.
+    """
+
+    COMPANY_FIELDS = ['information', 'representation', 'directorsBoard', 'shareholders']
+    PERSON_FIELDS = ['information', 'companies']
+
+    # cache bookkeeping fields kept in every document
+    META_FIELDS = ['_id', '_rev', 'timestamp']
+
+    # fields of stored documents left out of lean ones, 'checked' was written by earlier refreshers
+    STORED_FIELDS = ['raw', 'checked']
+
+    def __init__(self, schema_path=None, keep_raw=False):
+        """
+        :param schema_path: company json schema path, None for sp_rest_company_schema.json next to this module
+        :param keep_raw: True to keep compressed raw payload in 'raw' field
+        """
+
+        if schema_path is None:
+            schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sp_rest_company_schema.json')
+
+        with open(schema_path, encoding='utf-8') as schema_file:
+            schema = json.load(schema_file)
+
+        self.keep_raw = keep_raw
+        self.company_schema = {field: schema['properties'][field] for field in self.COMPANY_FIELDS}
+        self.company_fields = set(self.COMPANY_FIELDS + self.META_FIELDS)
+        self.person_fields = set(self.PERSON_FIELDS + self.META_FIELDS)
+
+    def project(self, kind, payload):
+        """
+        Projects a fetched API payload.
+
+        :param kind: 'person' or 'company'
+        :param payload: person or company json result
+        :return: lean json object, with 'raw' field if keep_raw is set
+        """
+
+        item = self.__select(kind, payload)
+
+        if self.keep_raw:
+            item['raw'] = base64.b64encode(zlib.compress(dumps(payload).encode('utf-8'))).decode('ascii')
+
+        return item
+
+    def lean(self, kind, item):
+        """
+        Projects a payload or a stored document. Documents which are lean already are returned as they are,
+        and documents written with projection only lose their stored fields, so this is cheap for both.
+
+        :param kind: 'person' or 'company'
+        :param item: person or company json object
+        :return: lean json object without 'raw' field
+        """
+
+        fields = self.person_fields if kind == 'person' else self.company_fields
+        extra = [field for field in item if field not in fields]
+
+        if len(extra) == 0:
+            return item
+
+        if all(field in self.STORED_FIELDS for field in extra):
+            return {field: value for field, value in item.items() if field in fields}
+
+        return self.__select(kind, item)
+
+    def __select(self, kind, item):
+        fields = self.person_fields if kind == 'person' else self.company_fields
+
+        if kind == 'person':
+            return {field: value for field, value in item.items() if field in fields}
+
+        return {field: value if field in self.META_FIELDS else self.__project(value, self.company_schema[field])
+                for field, value in item.items() if field in fields}
+
+    @staticmethod
+    def raw(item):
+        """
+        :param item: stored document
+        :return: raw API payload kept with the document, None if it was not kept
+        """
+
+        if 'raw' not in item:
+            return None
+
+        return loads(zlib.decompress(base64.b64decode(item['raw'])))
+
+    @staticmethod
+    def __project(value, schema):
+        """
+        :param value: json value
+        :param schema: json schema of the value
+        :return: value without object properties missing from the schema
+        """
+
+        if isinstance(value, dict) and 'properties' in schema:
+            properties = schema['properties']
+            return {k: SpProjection.__project(v, properties[k]) for k, v in value.items() if k in properties}
+
+        if isinstance(value, list) and 'items' in schema:
+            return [SpProjection.__project(v, schema['items']) for v in value]
+
+        return value
@@ -0,0 +1,262 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sp_metrics import enable_logging, get_logger, metrics
+from sp_rest_scheduler import SpRestError
+from sp_scrapper_cache import SpScrapperCache
+
+logger = get_logger('refresher')
+
+
+class SpCacheRefresher:
+    """
+    Background refresher of level 2 cache. Fetches the stalest people and companies again, by their 'timestamp',
+    and writes documents whose information or board membership changed.
+    Processes sharing the storage learn about the writes from its changes feed, see SpScrapperCache.watch_changes.
+
+    Check times are recorded by the storage apart from the documents, see SpStorage.mark_checked.
+    Unchanged documents and documents which cannot be fetched are not written, so they do not show up
+    in the changes feed, but they are not checked again before max_age and every sweep moves on.
+    """
+
+    BOARD_SECTIONS = ['representation', 'directorsBoard', 'shareholders']
+
+    def __init__(self, sp_scrapper_cache: SpScrapperCache, max_age=7 * 24 * 3600.0, batch_size=100, workers=4,
+                 interval=60.0):
+        """
+        :param sp_scrapper_cache: cache whose storage and API client are used
+        :param max_age: age in seconds after which a document is fetched again
+        :param batch_size: number of documents read and written at once
+        :param workers: number of concurrent API requests
+        :param interval: seconds between sweeps of the background thread
+        """
+
+        self.sp_scrapper_cache = sp_scrapper_cache
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.workers = workers
+        self.interval = interval
+
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        self.checked = 0
+        self.changed = 0
+        self.failed = 0
+        self.counters_lock = threading.Lock()
+
+    def sweep(self, limit=None):
+        """
+        Checks documents older than max_age, the stalest first.
+
+        :param limit: maximal number of documents to check, None for all stale ones
+        :return: dictionary of numbers of checked, changed and failed documents
+        """
+
+        storage = self.sp_scrapper_cache.storage
+
+        with metrics.timer('sp_storage_seconds', operation='stale_ids'):
+            doc_ids = storage.stale_ids(time.time() - self.max_age)
+
+        doc_ids = doc_ids if limit is None else doc_ids[:limit]
+        checked, changed, failed = self.checked, self.changed, self.failed
+
+        logger.info('Refreshing %s stale documents.', len(doc_ids))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for i in range(0, len(doc_ids), self.batch_size):
+                if self.stop_event.is_set():
+                    break
+
+                docs = list(storage.get_many(doc_ids[i:i + self.batch_size]).values())
+                self.__write([item for item in executor.map(self.__refresh, docs) if item is not None])
+
+                with metrics.timer('sp_storage_seconds', operation='mark_checked'):
+                    storage.mark_checked([doc['_id'] for doc in docs])
+
+                logger.info('Checked %s of %s stale documents.', min(i + self.batch_size, len(doc_ids)), len(doc_ids))
+
+        return {
+            'checked': self.checked - checked,
+            'changed': self.changed - changed,
+            'failed': self.failed - failed
+        }
+
+    def start(self):
+        """
+        Starts sweeping in a background thread every interval seconds.
+        """
+
+        if self.thread is not None:
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread after the current batch.
+        """
+
+        if self.thread is None:
+            return
+
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'changed': self.changed,
+            'failed': self.failed
+        }
+
+    @staticmethod
+    def membership(doc):
+        """
+        :param doc: person or company json object
+        :return: Comparable board membership of a person or a company.
+        """
+
+        if doc['_id'].startswith('p_'):
+            return sorted((ref.get('id') or '', tuple(ref.get('roles') or ()))
+                          for ref in doc.get('companies', []))
+
+        return sorted((section, ref.get('id') or '')
+                      for section in SpCacheRefresher.BOARD_SECTIONS
+                      for ref in doc.get(section, []))
+
+    def __run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.sweep()
+            except Exception as ex:
+                logger.warning('Refresh sweep failed: %s', ex)
+
+            self.stop_event.wait(self.interval)
+
+    def __refresh(self, doc):
+        """
+        Fetches a document again.
+
+        :param doc: stored person or company json object
+        :return: Fetched document if its content changed, None if it did not or it could not be fetched.
+        """
+
+        doc_id = doc['_id']
+        information = doc.get('information', {})
+        id = information.get('id', doc_id[2:])
+        slug = information.get('slug')
+
+        rest_client = self.sp_scrapper_cache.sp_rest_client
+        fetch_method = rest_client.person if doc_id.startswith('p_') else rest_client.company
+
+        self.sp_scrapper_cache.count('api_calls')
+        self.__count('checked')
+
+        try:
+            item = fetch_method(id, slug)
+        except SpRestError as ex:
+            logger.warning('%s: %s', doc_id, ex)
+            item = None
+
+        if not isinstance(item, dict) or 'information' not in item:
+            self.__count('failed')
+            metrics.inc('sp_refresh_total', result='failed')
+            return None
+
+        if self.sp_scrapper_cache.projection is not None:
+            item = self.sp_scrapper_cache.projection.project('person' if doc_id.startswith('p_') else 'company', item)
+
+        item['_id'] = doc_id
+        if item['information'] == information and self.membership(item) == self.membership(doc):
+            metrics.inc('sp_refresh_total', result='unchanged')
+            return None
+
+        item['timestamp'] = time.gmtime()
+        if '_rev' in doc:
+            item['_rev'] = doc['_rev']
+
+        self.__count('changed')
+        metrics.inc('sp_refresh_total', result='changed')
+        return item
+
+    def __count(self, counter):
+        """
+        Increments a statistics counter. Documents are refreshed by executor threads.
+
+        :param counter: 'checked', 'changed' or 'failed'
+        """
+
+        with self.counters_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def __write(self, items):
+        """
+        Writes changed documents to level 2 cache, name index and level 1 cache if they are cached there.
+
+        :param items: documents returned by __refresh
+        """
+
+        if len(items) == 0:
+            return
+
+        cache = self.sp_scrapper_cache
+
+        with metrics.timer('sp_storage_seconds', operation='put_many'):
+            failures = cache.storage.put_many(items)
+
+        for doc_id, ex in failures:
+            logger.warning('%s: %s', doc_id, ex)
+
+        if cache.name_index is not None:
+            cache.name_index.add_docs(items)
+
+        for item in items:
+            kind = 'person' if item['_id'].startswith('p_') else 'company'
+            item_cache = cache.person_cache if kind == 'person' else cache.company_cache
+
+            if item['_id'][2:] in item_cache:
+                item_cache[item['_id'][2:]] = item if cache.projection is None else cache.projection.lean(kind, item)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetches stale level 2 cache documents again.')
+    parser.add_argument('--api-url', default='https://sprawdz.biz/api/')
+    parser.add_argument('--couchdb-url', default=None)
+    parser.add_argument('--couchdb-name', default='sp')
+    parser.add_argument('--sqlite-path', default='sp.sqlite')
+    parser.add_argument('--max-age', type=float, default=7 * 24 * 3600.0, help='seconds')
+    parser.add_argument('--limit', type=int, default=None, help='documents checked per sweep')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=None, help='seconds between sweeps, a single sweep if not set')
+    args = parser.parse_args()
+    enable_logging()
+
+    from sp_rest_client import SpRestClient
+
+    scrapper_cache = SpScrapperCache(SpRestClient(args.api_url))
+
+    if args.couchdb_url is not None:
+        import couchdb
+        from sp_storage import SpCouchStorage
+
+        scrapper_cache.init_storage(SpCouchStorage(couchdb.Server(args.couchdb_url)[args.couchdb_name]))
+    else:
+        scrapper_cache.init_sqlite(args.sqlite_path)
+
+    refresher = SpCacheRefresher(scrapper_cache, args.max_age, workers=args.workers)
+
+    while True:
+        logger.info('Sweep finished: %s', refresher.sweep(args.limit))
+
+        if args.interval is None:
+            break
+
+        time.sleep(args.interval)
+
+    scrapper_cache.storage.close()
@@ -0,0 +1,408 @@
+import json
+import math
+import os
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+from sp_graph import SpCompanyRecord, SpGraph, SpPersonRecord
+from sp_metrics import metrics
+
+
+class SpRenderer:
+    """
+    Renders SpGraph without a display and exports it for external viewers.
+
+    Small graphs are laid out with networkx spring layout. Large graphs are laid out with a force-directed
+    layout in numpy, in which repulsion is approximated by a coarse grid of node clusters (Barnes-Hut style),
+    so an iteration costs O(n * cells) instead of O(n^2).
+    Layouts can be cached in a json file and reused, so that nodes keep their positions between renders.
+    """
+
+    PERSON_COLOR = 'r'
+    COMPANY_COLOR = 'b'
+    PATH_COLOR = 'g'
+
+    def __init__(self,
+                 layout='auto',
+                 iterations=50,
+                 seed=0,
+                 layout_cache=None,
+                 label_limit=200,
+                 spring_limit=1000,
+                 figsize=(25, 15),
+                 dpi=100):
+        """
+        :param layout: 'spring', 'fast' or 'auto' to use spring layout only for small graphs
+        :param iterations: number of layout iterations
+        :param seed: layout random seed
+        :param layout_cache: json file with node positions by node 'unique' key, None for no cache.
+        Cached nodes keep their positions, only new nodes are laid out.
+        :param label_limit: maximal number of labelled nodes. Edge roles are drawn only if all nodes are labelled.
+        :param spring_limit: maximal number of nodes laid out with spring layout in 'auto' mode
+        :param figsize: figure size in inches
+        :param dpi: image resolution
+        """
+
+        self.layout_method = layout
+        self.iterations = iterations
+        self.seed = seed
+        self.layout_cache = layout_cache
+        self.label_limit = label_limit
+        self.spring_limit = spring_limit
+        self.figsize = figsize
+        self.dpi = dpi
+
+    def layout(self, graph: SpGraph):
+        """
+        Computes node positions.
+
+        :param graph: graph to lay out
+        :return: numpy array of (x, y) positions indexed by node id
+        """
+
+        n = len(graph.natural_keys)
+        keys = [graph.node_key(node_id) for node_id in range(n)]
+        cached = self.__load_cache()
+        fixed = np.array([key in cached for key in keys], dtype=bool)
+
+        with metrics.timer('sp_graph_seconds', operation='layout'):
+            if n == 0:
+                pos = np.zeros((0, 2))
+
+            elif fixed.all():
+                pos = np.array([cached[key] for key in keys], dtype=float)
+
+            elif self.layout_method == 'spring' or (self.layout_method == 'auto' and n <= self.spring_limit):
+                import networkx as nx
+
+                known = {key: tuple(cached[key]) for key in keys if key in cached}
+                positions = nx.spring_layout(graph.nx_graph,
+                                             pos=known or None,
+                                             fixed=list(known) or None,
+                                             iterations=self.iterations,
+                                             seed=self.seed)
+                pos = np.array([positions[key] for key in keys], dtype=float)
+
+            else:
+                pos = self.__initial_positions(graph, keys, cached)
+                pos = fast_layout(pos, *self.__edges(graph), self.iterations, fixed if fixed.any() else None)
+
+        if self.layout_cache is not None:
+            cached.update({key: [float(x), float(y)] for key, (x, y) in zip(keys, pos)})
+            with open(self.layout_cache, 'w', encoding='utf-8') as cache_file:
+                json.dump(cached, cache_file)
+
+        return pos
+
+    def draw(self, graph: SpGraph, ax, pos=None):
+        """
+        Draws graph on matplotlib axes. Found paths are highlighted.
+        Labels are drawn for path nodes and for the best connected nodes, up to label_limit.
+
+        :param graph: graph to draw
+        :param ax: matplotlib axes
+        :param pos: node positions returned by layout, None to compute them
+        """
+
+        from matplotlib.collections import LineCollection
+
+        pos = pos if pos is not None else self.layout(graph)
+        n = len(graph.natural_keys)
+        src, dst = self.__edges(graph)
+        paths = graph.path_node_ids()
+        path_nodes = {node_id for path in paths for node_id in path}
+
+        ax.set_axis_off()
+        ax.add_collection(LineCollection(np.stack([pos[src], pos[dst]], axis=1) if len(src) > 0 else [],
+                                         colors='k', linewidths=0.5 if n > self.label_limit else 1.0, zorder=1))
+
+        for path in paths:
+            ax.add_collection(LineCollection([pos[path]], colors=self.PATH_COLOR, linewidths=10, zorder=2))
+
+        node_size = 300 if n <= self.label_limit else max(2, 3000 / math.sqrt(n))
+        kinds = np.frombuffer(bytes(graph.kinds), dtype=np.uint8) if n > 0 else np.zeros(0, dtype=np.uint8)
+        colors = np.where(kinds == SpGraph.PERSON, self.PERSON_COLOR, self.COMPANY_COLOR).astype(object)
+        colors[list(path_nodes)] = self.PATH_COLOR
+        ax.scatter(pos[:, 0], pos[:, 1], s=node_size, c=list(colors), zorder=3)
+
+        labelled = list(path_nodes) + [node_id for node_id in graph.top_nodes(self.label_limit)
+                                       if node_id not in path_nodes]
+        for node_id in labelled[:self.label_limit]:
+            ax.text(pos[node_id, 0], pos[node_id, 1], graph.label(node_id),
+                    fontsize=10 if n <= self.label_limit else 6, ha='center', va='center', zorder=4)
+
+        if n <= self.label_limit:
+            for edge, record in graph.edge_records.items():
+                company_id, person_id = edge >> 32, edge & 0xffffffff
+                role = 'No role' if record is None or record.roles is None else ', '.join(record.roles)
+                x, y = (pos[company_id] + pos[person_id]) / 2
+                ax.text(x, y, role if len(role) < 40 else role[:40] + '...', fontsize=8, ha='center', va='center',
+                        zorder=4, bbox={'facecolor': 'white', 'edgecolor': 'none', 'alpha': 0.7})
+
+        ax.autoscale_view()
+
+    def save(self, graph: SpGraph, path, pos=None):
+        """
+        Draws graph to an image file. Does not need a display.
+
+        :param graph: graph to draw
+        :param path: file path, format is taken from the extension (png, svg, pdf)
+        :param pos: node positions returned by layout, None to compute them
+        """
+
+        from matplotlib.figure import Figure
+
+        figure = Figure(figsize=self.figsize, dpi=self.dpi)
+        self.draw(graph, figure.add_subplot(), pos)
+
+        with metrics.timer('sp_graph_seconds', operation='render'):
+            figure.savefig(path, bbox_inches='tight')
+
+    def save_paths(self, graph: SpGraph, path, radius=1):
+        """
+        Draws found paths with their neighbourhood only.
+
+        :param graph: graph with found paths
+        :param path: image file path
+        :param radius: number of edges around path nodes to include
+        """
+
+        path_nodes = {node_id for node_path in graph.path_node_ids() for node_id in node_path}
+        self.save(graph.subgraph(graph.neighbourhood(path_nodes, radius)), path)
+
+    def save_top(self, graph: SpGraph, path, k=500):
+        """
+        Draws the best connected nodes and found paths only.
+
+        :param graph: graph to draw
+        :param path: image file path
+        :param k: number of nodes with the most neighbours to include
+        """
+
+        path_nodes = {node_id for node_path in graph.path_node_ids() for node_id in node_path}
+        self.save(graph.subgraph(path_nodes.union(graph.top_nodes(k))), path)
+
+    def __load_cache(self):
+        if self.layout_cache is None or not os.path.exists(self.layout_cache):
+            return {}
+
+        with open(self.layout_cache, encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+
+    def __initial_positions(self, graph: SpGraph, keys, cached):
+        """
+        Places cached nodes at their positions, new nodes next to their cached neighbours or randomly.
+        """
+
+        rng = np.random.default_rng(self.seed)
+        pos = rng.random((len(keys), 2))
+
+        if len(cached) == 0:
+            return pos
+
+        for node_id, key in enumerate(keys):
+            if key in cached:
+                pos[node_id] = cached[key]
+
+        for node_id, key in enumerate(keys):
+            if key not in cached:
+                neighbours = [pos[neighbour_id] for neighbour_id in graph.adjacency[node_id]
+                              if keys[neighbour_id] in cached]
+                if len(neighbours) > 0:
+                    pos[node_id] = np.mean(neighbours, axis=0) + rng.normal(0, 0.01, 2)
+
+        return pos
+
+    @staticmethod
+    def __edges(graph: SpGraph):
+        """
+        :return: Tuple of numpy arrays of edge company node ids and person node ids.
+        """
+
+        edges = np.fromiter(graph.edge_records.keys(), dtype=np.int64, count=len(graph.edge_records))
+        return (edges >> 32).astype(np.intp), (edges & 0xffffffff).astype(np.intp)
+
+
+def fast_layout(pos, src, dst, iterations=50, fixed=None, chunk_size=1024):
+    """
+    Fruchterman-Reingold layout with grid approximated repulsion.
+    Every node is repelled by centroids of grid cells weighted by their node counts, instead of by every other node.
+
+    :param pos: numpy array of initial (x, y) positions
+    :param src: numpy array of edge start node ids
+    :param dst: numpy array of edge end node ids
+    :param iterations: number of iterations
+    :param fixed: numpy bool array of nodes which keep their positions, None for no such nodes
+    :param chunk_size: number of nodes processed at once, bounds memory of the repulsion step
+    :return: numpy array of (x, y) positions
+    """
+
+    pos = np.array(pos, dtype=float)
+    n = len(pos)
+
+    if n <= 1:
+        return pos
+
+    k = 1 / math.sqrt(n)
+    grid = max(1, int(round(n ** (1 / 3))))
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        displacement = np.zeros((n, 2))
+
+        # repulsion from grid cell centroids
+        low = pos.min(axis=0)
+        span = max(float((pos.max(axis=0) - low).max()), 1e-9)
+        cells = np.minimum(((pos - low) / span * grid).astype(np.intp), grid - 1)
+        cell_ids = cells[:, 0] * grid + cells[:, 1]
+
+        counts = np.bincount(cell_ids, minlength=grid * grid)
+        occupied = counts > 0
+        masses = counts[occupied]
+        centroids = np.stack([np.bincount(cell_ids, weights=pos[:, 0], minlength=grid * grid)[occupied],
+                              np.bincount(cell_ids, weights=pos[:, 1], minlength=grid * grid)[occupied]],
+                             axis=1) / masses[:, None]
+
+        for i in range(0, n, chunk_size):
+            chunk = pos[i:i + chunk_size]
+            distance2 = np.maximum((chunk[:, 0, None] - centroids[None, :, 0]) ** 2 +
+                                   (chunk[:, 1, None] - centroids[None, :, 1]) ** 2, 0.01 * k * k)
+            weights = masses / distance2
+            # sum of (node - centroid) * weight over cells
+            displacement[i:i + chunk_size] += k * k * (chunk * weights.sum(axis=1)[:, None] - weights @ centroids)
+
+        # attraction along edges
+        if len(src) > 0:
+            delta = pos[src] - pos[dst]
+            force = delta * (np.sqrt((delta ** 2).sum(axis=1)) / k)[:, None]
+            np.add.at(displacement, src, -force)
+            np.add.at(displacement, dst, force)
+
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 1e-9)
+        step = displacement * (np.minimum(length, temperature) / length)[:, None]
+
+        if fixed is not None:
+            step[fixed] = 0
+
+        pos += step
+        temperature -= cooling
+
+    return pos
+
+
+def write_graphml(graph: SpGraph, path, node_ids=None):
+    """
+    Streams graph to a GraphML file, e.g. for yEd or Cytoscape. Does not build networkx graph.
+
+    :param graph: graph to export
+    :param path: output file path
+    :param node_ids: node ids to export, None for the whole graph
+    """
+
+    node_ids = range(len(graph.natural_keys)) if node_ids is None else sorted(set(node_ids))
+    exported = set(node_ids)
+    fields = ['label', 'kind'] + _record_fields()
+
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        for field in fields:
+            out.write('  <key id=%s for="node" attr.name=%s attr.type="string"/>\n' % (quoteattr(field), quoteattr(field)))
+        out.write('  <key id="roles" for="edge" attr.name="roles" attr.type="string"/>\n'
+                  '  <graph edgedefault="undirected">\n')
+
+        for node_id in node_ids:
+            out.write('    <node id=%s>' % quoteattr(graph.node_key(node_id)))
+            for field, value in _node_attributes(graph, node_id):
+                out.write('<data key=%s>%s</data>' % (quoteattr(field), escape(str(value))))
+            out.write('</node>\n')
+
+        for edge, record in graph.edge_records.items():
+            company_id, person_id = edge >> 32, edge & 0xffffffff
+            if company_id in exported and person_id in exported:
+                out.write('    <edge source=%s target=%s>' % (quoteattr(graph.node_key(person_id)),
+                                                              quoteattr(graph.node_key(company_id))))
+                if record is not None and record.roles is not None:
+                    out.write('<data key="roles">%s</data>' % escape(', '.join(record.roles)))
+                out.write('</edge>\n')
+
+        out.write('  </graph>\n</graphml>\n')
+
+
+def write_gexf(graph: SpGraph, path, node_ids=None, pos=None):
+    """
+    Streams graph to a GEXF file, e.g. for Gephi. Does not build networkx graph.
+
+    :param graph: graph to export
+    :param path: output file path
+    :param node_ids: node ids to export, None for the whole graph
+    :param pos: node positions returned by SpRenderer.layout, None to let the viewer lay the graph out
+    """
+
+    node_ids = range(len(graph.natural_keys)) if node_ids is None else sorted(set(node_ids))
+    exported = set(node_ids)
+    fields = ['kind'] + _record_fields()
+
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<gexf xmlns="http://gexf.net/1.3" xmlns:viz="http://gexf.net/1.3/viz" version="1.3">\n'
+                  '  <graph defaultedgetype="undirected">\n'
+                  '    <attributes class="node">\n')
+        for field in fields:
+            out.write('      <attribute id=%s title=%s type="string"/>\n' % (quoteattr(field), quoteattr(field)))
+        out.write('    </attributes>\n'
+                  '    <attributes class="edge">\n'
+                  '      <attribute id="roles" title="roles" type="string"/>\n'
+                  '    </attributes>\n'
+                  '    <nodes>\n')
+
+        for node_id in node_ids:
+            attributes = _node_attributes(graph, node_id)
+            out.write('      <node id=%s label=%s><attvalues>' % (quoteattr(graph.node_key(node_id)),
+                                                                  quoteattr(attributes[0][1])))
+            for field, value in attributes[1:]:
+                out.write('<attvalue for=%s value=%s/>' % (quoteattr(field), quoteattr(str(value))))
+            out.write('</attvalues>')
+            if pos is not None:
+                out.write('<viz:position x="%f" y="%f" z="0.0"/>' % (pos[node_id][0] * 1000, pos[node_id][1] * 1000))
+            out.write('</node>\n')
+
+        out.write('    </nodes>\n'
+                  '    <edges>\n')
+
+        for i, (edge, record) in enumerate(graph.edge_records.items()):
+            company_id, person_id = edge >> 32, edge & 0xffffffff
+            if company_id in exported and person_id in exported:
+                out.write('      <edge id="%s" source=%s target=%s>' % (i, quoteattr(graph.node_key(person_id)),
+                                                                        quoteattr(graph.node_key(company_id))))
+                if record is not None and record.roles is not None:
+                    out.write('<attvalues><attvalue for="roles" value=%s/></attvalues>'
+                              % quoteattr(', '.join(record.roles)))
+                out.write('</edge>\n')
+
+        out.write('    </edges>\n  </graph>\n</gexf>\n')
+
+
+def _record_fields():
+    """
+    :return: List of person and company record fields.
+    """
+
+    return list(dict.fromkeys(SpPersonRecord.__slots__ + SpCompanyRecord.__slots__))
+
+
+def _node_attributes(graph: SpGraph, node_id):
+    """
+    :return: List of (field, value) tuples of a node, starting with label and kind.
+    """
+
+    record = graph.records[node_id]
+    attributes = [('label', graph.label(node_id)),
+                  ('kind', 'person' if graph.kinds[node_id] == SpGraph.PERSON else 'company')]
+
+    if record is not None:
+        attributes.extend((field, value) for field, value in record.to_dict().items())
+
+    return attributes
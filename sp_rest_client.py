@@ -1,8 +1,11 @@
-from urllib3 import disable_warnings
+from urllib3 import disable_warnings, Timeout
 from urllib3.exceptions import InsecureRequestWarning
 from urllib3.connection import UnverifiedHTTPSConnection
 from urllib3.connectionpool import connection_from_url
-import json
+
+from sp_metrics import metrics
+from sp_projection import loads
+from sp_rest_scheduler import SpRestScheduler, SpRestError
 
 
 class SpRestClient:
@@ -10,14 +13,28 @@ class SpRestClient:
     Provides access to scrapped website rest API.
     """
 
-    def __init__(self, base_url):
+    def __init__(self, base_url, pool_maxsize=None, scheduler: SpRestScheduler = None, connect_timeout=5.0, read_timeout=30.0):
+        """
+        :param base_url: API's base url string
+        :param pool_maxsize: Number of kept-alive connections. Defaults to scheduler's maximal concurrency.
+        :param scheduler: SpRestScheduler limiting and retrying requests, None for default one
+        :param connect_timeout: Seconds allowed for establishing connection.
+        :param read_timeout: Seconds allowed for receiving response.
+        """
+
         self.base_url = base_url
+        self.scheduler = scheduler if scheduler is not None else SpRestScheduler()
+        self.timeout = Timeout(connect=connect_timeout, read=read_timeout)
 
         # Get a ConnectionPool object, same as what you're doing in your question
-        self.http = connection_from_url(self.base_url)
+        # Blocking pool makes excess threads wait for a kept-alive connection instead of opening throwaway ones
+        self.http = connection_from_url(self.base_url,
+                                        maxsize=pool_maxsize if pool_maxsize is not None else self.scheduler.max_concurrency,
+                                        block=True)
 
         # Override the connection class to force the unverified HTTPSConnection class
-        self.http.ConnectionCls = UnverifiedHTTPSConnection
+        if self.base_url.startswith('https'):
+            self.http.ConnectionCls = UnverifiedHTTPSConnection
 
         disable_warnings(InsecureRequestWarning)
 
@@ -56,19 +73,30 @@ class SpRestClient:
     def __request(self, relative_url, fields):
         """
         Performs POST request on given API relative url with provided fields.
+        Request is scheduled, so it can wait for rate and concurrency limits and be retried.
 
         :param relative_url: API's relative url string
         :param fields: dictionary of request fields
         :return: request json result
         """
 
-        response = self.http.request(
-            'POST',
-            self.base_url + relative_url,
-            headers=self.__headers(),
-            fields=fields)
-
-        return json.loads(response.data.decode('utf-8'))
+        try:
+            with metrics.timer('sp_rest_request_seconds', endpoint=relative_url):
+                response = self.scheduler.run(lambda: self.http.request(
+                    'POST',
+                    self.base_url + relative_url,
+                    headers=self.__headers(),
+                    fields=fields,
+                    timeout=self.timeout,
+                    retries=False))
+
+            try:
+                return loads(response.data)
+            except ValueError as ex:
+                raise SpRestError('Invalid %s response (HTTP %s): %s' % (relative_url, response.status, ex))
+        except SpRestError:
+            metrics.inc('sp_rest_errors_total', endpoint=relative_url)
+            raise
 
     @staticmethod
     def __headers():
@@ -0,0 +1,255 @@
+import random
+import threading
+import time
+
+from urllib3.exceptions import HTTPError
+
+from sp_metrics import metrics
+
+
+class SpRestError(Exception):
+    """
+    Raised when API request fails after all retries.
+    """
+
+    pass
+
+
+class SpTokenBucket:
+    """
+    Thread safe token bucket limiting requests rate.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: tokens added per second, None for no limit
+        :param burst: maximal number of tokens
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token. Blocks until a token is available.
+        """
+
+        if self.rate is None and self.paused_until == 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+
+                elif self.rate is None:
+                    return
+
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stops handing out tokens for some time, e.g. after the server asked to retry later.
+
+        :param seconds: pause length
+        """
+
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class SpRestScheduler:
+    """
+    Schedules API requests. Limits their rate with a token bucket and their concurrency with an adaptive limit,
+    which grows additively on fast successes and is halved on errors, throttling and latency spikes.
+    The limit is halved at most once per latency window: failures of requests sent before the last decrease
+    do not decrease it again, so a burst of concurrent errors halves it once.
+    Failed requests are retried with exponential backoff and full jitter.
+
+    Counters, the limit and the average latency are updated by many fetch threads, always under condition.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self,
+                 rate=None,
+                 burst=10,
+                 max_concurrency=10,
+                 initial_concurrency=4,
+                 max_retries=3,
+                 backoff=0.5,
+                 max_backoff=30.0,
+                 spike_factor=3.0):
+        """
+        :param rate: Requests per second, None for no limit.
+        :param burst: Requests which may be sent at once after an idle period.
+        :param max_concurrency: Upper bound of the adaptive concurrency limit.
+        :param initial_concurrency: Starting concurrency limit.
+        :param max_retries: Number of retries of a failed request.
+        :param backoff: Base of exponential backoff in seconds.
+        :param max_backoff: Maximal backoff in seconds.
+        :param spike_factor: Latency above this multiple of the average latency is treated as a spike.
+        """
+
+        self.bucket = SpTokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.spike_factor = spike_factor
+
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.latency = None
+        self.decreased = float('-inf')
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled = 0
+
+    def run(self, request):
+        """
+        Executes request within rate and concurrency limits, retrying it on failures.
+
+        :param request: lambda performing a single request and returning urllib3 response
+        :return: successful or not retryable urllib3 response
+        """
+
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                with self.condition:
+                    self.retries += 1
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+            self.bucket.acquire()
+            self.__enter()
+            start = time.monotonic()
+
+            try:
+                response = request()
+            except HTTPError as ex:
+                error = ex
+                self.__decrease(start)
+                metrics.inc('sp_rest_attempts_total', outcome='transport_error')
+                continue
+            finally:
+                self.__leave()
+
+            metrics.observe('sp_rest_attempt_seconds', time.monotonic() - start)
+
+            if response.status in self.RETRY_STATUSES:
+                error = 'HTTP %s' % response.status
+                self.__decrease(start)
+                metrics.inc('sp_rest_attempts_total', outcome=str(response.status))
+
+                if response.status == 429:
+                    with self.condition:
+                        self.throttled += 1
+                    self.bucket.pause(self.__retry_after(response))
+
+                continue
+
+            self.__observe(start, time.monotonic() - start)
+            metrics.inc('sp_rest_attempts_total', outcome='ok')
+            return response
+
+        with self.condition:
+            self.failures += 1
+        raise SpRestError('Request failed after %s attempts: %s' % (self.max_retries + 1, error))
+
+    def stats(self):
+        """
+        :return: Dictionary of request counters, current concurrency limit and average latency.
+        """
+
+        with self.condition:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'throttled': self.throttled,
+                'concurrency_limit': self.limit,
+                'latency': self.latency
+            }
+
+    def __enter(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def __leave(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            self.condition.notify()
+
+    def __observe(self, start, latency):
+        """
+        Updates average latency. Increases concurrency limit unless the latency is a spike.
+
+        :param start: monotonic time the request was sent
+        :param latency: request latency in seconds
+        """
+
+        with self.condition:
+            spike = self.latency is not None and latency > self.spike_factor * self.latency
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+
+            if not spike:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+        if spike:
+            self.__decrease(start)
+            return
+
+        metrics.set('sp_rest_concurrency_limit', self.limit)
+
+    def __decrease(self, start):
+        """
+        Halves concurrency limit, unless it was halved after the request was sent.
+
+        :param start: monotonic time the failed or slow request was sent
+        """
+
+        with self.condition:
+            if start < self.decreased:
+                return
+
+            self.limit = max(1.0, self.limit / 2)
+            self.decreased = time.monotonic()
+
+        metrics.set('sp_rest_concurrency_limit', self.limit)
+
+    def __retry_after(self, response):
+        """
+        :param response: urllib3 response
+        :return: Seconds from Retry-After header, or the base backoff if the header is missing or not a number.
+        """
+
+        try:
+            return min(self.max_backoff, float(response.headers.get('Retry-After')))
+        except (TypeError, ValueError):
+            return self.backoff
@@ -1,5 +1,14 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sp_checkpoint import SpCheckpoint
 from sp_graph import *
+from sp_metrics import get_logger, instrumented, metrics
 from sp_scrapper_cache import SpScrapperCache
+from sp_search import SpBatchPair, SpBatchSource, SpBidirectionalSearch, SpSearchPolicy, SpSearchSide
+from sp_shard_pool import SpShardPool
+
+logger = get_logger('scrapper')
 
 
 class SpScrapper:
@@ -7,60 +16,226 @@ class SpScrapper:
     Scraps client website and builds person-company connections graph.
     """
 
-    def __init__(self, sp_scrapper_cache: SpScrapperCache):
+    def __init__(self, sp_scrapper_cache: SpScrapperCache, max_workers=1, shard_pool: SpShardPool = None):
+        """
+        :param sp_scrapper_cache: SpScrapperCache used for fetching people and companies
+        :param max_workers: Number of concurrent fetches per BFS layer. 1 keeps the expansion sequential.
+        :param shard_pool: SpShardPool fetching each BFS layer in worker processes instead, None to fetch in this process.
+        The pool workers have to share level 2 cache with sp_scrapper_cache.
+        """
+
         self.sp_scrapper_cache = sp_scrapper_cache
+        self.max_workers = max_workers
+        self.shard_pool = shard_pool
 
-    def find_path(self, person_ref_1, person_ref_2, distance: int):
+    @instrumented('find_path')
+    def find_path(self, person_ref_1, person_ref_2, distance: int, policy: SpSearchPolicy = None):
         """
         Finds path between 2 people in provided distance.
+        Uses bidirectional BFS. The side with the smaller frontier is always expanded,
+        and the search stops after the first layer in which both sides meet.
 
         :param person_ref_1: Some person ref
         :param person_ref_2: Some other person ref
         :param distance: Distance measured in 'company' nodes.
-        :return: Result SpGraph.
+        :param policy: SpSearchPolicy with budget and hub handling, None for an exact unlimited search.
+        :return: Result SpGraph. Its 'exact' flag is False if the search was truncated by the policy.
         """
 
         graph = SpGraph()
-        generator_1 = self.__expand_person(person_ref_1, None, graph)
-        generator_2 = self.__expand_person(person_ref_2, None, graph)
+        search = SpBidirectionalSearch(person_ref_1, person_ref_2, distance)
+        policy = policy if policy is not None else SpSearchPolicy()
+        policy.start(self.sp_scrapper_cache)
+
+        if policy.too_far(search):
+            logger.info('People are too far apart.')
+            graph.exact = search.exact()
+            return graph
 
-        generator_1.__next__()
-        generator_2.__next__()
+        for side in search.sides:
+            self.__prefetch_persons([side.person_ref], graph)
+            side.set_frontier(self.__expand_persons([(side.person_ref, None)], graph, 0, side), policy)
+            self.sp_scrapper_cache.flush()
 
         for i in range(distance):
-            if graph.person_person_path(person_ref_1, person_ref_2):
-                print('Path found!')
+            if search.found() or search.exhausted():
                 break
 
-            print('Exploring distance %s.' % i)
-            generator = generator_1 if distance % 2 == 0 else generator_2
-            generator.__next__()
+            if not policy.within_budget():
+                logger.info('Search budget exhausted.')
+                search.truncated = True
+                break
+
+            logger.info('Exploring distance %s.', i)
+            side = search.next_side()
+            side.depth = side.depth + 1
+            side.set_frontier(self.__expand_companies(side.companies, graph, side.depth, side, policy), policy)
+
+        if search.found() and graph.person_person_path(person_ref_1, person_ref_2):
+            logger.info('Path found!')
 
+        graph.exact = search.exact()
         return graph
 
-    def expand_person(self, person_ref, distance):
+    def find_paths(self, pairs, distance: int, sp_graph: SpGraph = None):
+        """
+        Finds paths between many pairs of people in provided distance, sharing one expansion graph.
+        Every person and company is fetched and expanded at most once for the whole batch.
+        All people are expanded by one layer per round, and each pair is yielded as soon as it is decided.
+        Like find_path, a search of a distance can find one more company. Both sides of every pair move in each round,
+        so the paths are found in half as many rounds.
+
+        :param pairs: iterable of (person_ref_1, person_ref_2) tuples
+        :param distance: Distance measured in 'company' nodes.
+        :param sp_graph: graph to build into, None for a new one
+        :return: Generator of (person_ref_1, person_ref_2, path) tuples, where path is a list of node 'unique' keys,
+        or None if there is no path in provided distance.
+        """
+
+        graph = sp_graph if sp_graph is not None else SpGraph()
+        pairs = list(pairs)
+
+        sources, company_docs = self.__batch_start([person_ref for pair in pairs for person_ref in pair], graph)
+        batch_pairs = []
+
+        for person_ref_1, person_ref_2 in pairs:
+            batch_pair_sources = [sources[SpGraph.get_person_natural_key(person_ref)]
+                                  for person_ref in [person_ref_1, person_ref_2]]
+
+            batch_pair = SpBatchPair(person_ref_1, person_ref_2, *batch_pair_sources)
+            for source in batch_pair_sources:
+                source.pairs.append(batch_pair)
+            batch_pairs.append(batch_pair)
+
+        # visit people only after pairs are known, so that meetings at the very start are detected
+        for source in sources.values():
+            self.__advance_source(source, graph)
+
+        expanded_companies = set()
+
+        # the same bound as SpBidirectionalSearch, reached when both sides moved by half of the distance
+        max_hops = (distance + 1) * 2
+        rounds = (distance + 1) // 2
+
+        for i in range(rounds + 1):
+            for batch_pair in batch_pairs:
+                if batch_pair.decided:
+                    continue
+
+                if batch_pair.meet_id is not None and batch_pair.meet_hops <= max_hops:
+                    batch_pair.decided = True
+                    path = [graph.node_key(node_id) for node_id in batch_pair.path()]
+                    graph.paths.append((path[0], path[-1]))
+                    yield batch_pair.person_ref_1, batch_pair.person_ref_2, path
+
+                elif i == rounds or any(len(source.companies) == 0 for source in batch_pair.sources):
+                    batch_pair.decided = True
+                    yield batch_pair.person_ref_1, batch_pair.person_ref_2, None
+
+            active_sources = [source for source in sources.values()
+                              if any(not batch_pair.decided for batch_pair in source.pairs)]
+
+            if i == rounds or len(active_sources) == 0:
+                break
+
+            logger.info('Exploring distance %s.', i)
+            self.__batch_round(active_sources, graph, company_docs, expanded_companies, i + 1)
+
+    def find_all_paths(self, person_ref_1, person_ref_2, distance: int, k=None, sp_graph: SpGraph = None):
+        """
+        Lazily enumerates connections between 2 people, shortest first, with roles on every edge.
+        Both people are expanded by one layer per round. After r rounds every path with at most 2r + 1 companies
+        is fully known, so paths are yielded as soon as their length is proven complete.
+
+        :param person_ref_1: Some person ref
+        :param person_ref_2: Some other person ref
+        :param distance: Maximal distance measured in 'company' nodes.
+        :param k: Maximal number of paths, None for all of them.
+        :param sp_graph: graph to build into, None for a new one
+        :return: Generator of paths, see SpGraph.person_person_paths.
+        """
+
+        graph = sp_graph if sp_graph is not None else SpGraph()
+        sources, company_docs = self.__batch_start([person_ref_1, person_ref_2], graph)
+        sources = list(sources.values())
+        expanded_companies = set()
+
+        for source in sources:
+            self.__advance_source(source, graph)
+
+        count = 0
+        min_distance = 1
+
+        for i in range(distance + 1):
+            # a side without frontier is explored completely, so are all paths
+            complete = any(len(source.companies) == 0 for source in sources)
+            max_distance = distance if complete else min(distance, 2 * i + 1)
+
+            for path in graph.person_person_paths(person_ref_1, person_ref_2, max_distance, min_distance):
+                yield path
+
+                count = count + 1
+                if k is not None and count >= k:
+                    return
+
+            min_distance = max_distance + 1
+            if complete or min_distance > distance:
+                return
+
+            logger.info('Exploring distance %s.', i)
+            self.__batch_round(sources, graph, company_docs, expanded_companies, i + 1)
+
+    def find_paths_one_to_many(self, person_ref, person_refs, distance: int, sp_graph: SpGraph = None):
+        """
+        Finds paths between one person and many other people. See find_paths.
+
+        :param person_ref: Some person ref
+        :param person_refs: list of other person refs
+        :param distance: Distance measured in 'company' nodes.
+        :param sp_graph: graph to build into, None for a new one
+        :return: Generator of (person_ref, other_person_ref, path) tuples.
+        """
+
+        return self.find_paths([(person_ref, other_person_ref) for other_person_ref in person_refs], distance, sp_graph)
+
+    @instrumented('expand_person')
+    def expand_person(self, person_ref, distance, checkpoint: SpCheckpoint = None):
         """
         Searches some person's neighbourhood.
 
         :param person_ref: Some person ref
         :param distance: Distance measured in 'company' nodes.
+        :param checkpoint: SpCheckpoint written after every layer, None for no checkpoint. See resume.
         :return: Result SpGraph.
         """
 
         graph = SpGraph()
-        generator = self.__expand_person(person_ref, None, graph)
-        for i in range(distance):
-            print('Exploring distance %s.' % i)
-            generator.__next__()
 
+        if checkpoint is not None:
+            checkpoint.start('person', person_ref)
+
+        if distance <= 0:
+            return graph
+
+        logger.info('Exploring distance %s.', 0)
+        self.__prefetch_persons([person_ref], graph)
+        companies = self.__expand_persons([(person_ref, None)], graph, 0)
+        self.sp_scrapper_cache.flush()
+
+        if checkpoint is not None:
+            checkpoint.save(graph, companies, 1, 0)
+
+        self.__expand_layers(companies, graph, 1, 0, distance, checkpoint)
         return graph
 
-    def expand_company(self, company_ref, distance):
+    @instrumented('expand_company')
+    def expand_company(self, company_ref, distance, checkpoint: SpCheckpoint = None):
         """
         Searches some company's neighbourhood.
 
         :param company_ref: Some company ref
         :param distance: Distance measured in 'company' nodes.
+        :param checkpoint: SpCheckpoint written after every layer, None for no checkpoint. See resume.
         :return: Result SpGraph.
         """
 
@@ -68,34 +243,290 @@ class SpScrapper:
         company = self.sp_scrapper_cache.get_company_by_ref(company_ref)
 
         if company is None:
-            print('Nothing found.')
+            logger.info('Nothing found.')
             return
 
-        generator = self.__expand_company(company, graph)
-        for i in range(distance):
-            print('Exploring distance %s.' % i)
-            generator.__next__()
+        if checkpoint is not None:
+            checkpoint.start('company', company_ref)
 
+        self.__expand_layers([company], graph, 0, 0, distance, checkpoint)
         return graph
 
-    def __expand_person(self, person_ref, in_company_info, sp_graph: SpGraph, d=0):
-        person = self.sp_scrapper_cache.get_person_by_ref(person_ref)
+    @instrumented('resume')
+    def resume(self, checkpoint: SpCheckpoint, distance):
+        """
+        Continues neighbourhood search of expand_person or expand_company from its checkpoint,
+        e.g. after the crawl was interrupted or to explore a larger distance.
+        Layers completed before are restored from the checkpoint instead of being expanded again.
 
-        generators = []
-        generators_rem = []
+        :param checkpoint: SpCheckpoint written by expand_person or expand_company
+        :param distance: Distance measured in 'company' nodes.
+        :return: Result SpGraph.
+        """
+
+        kind, ref, graph, frontier, explored, depth = checkpoint.load()
+
+        # interrupted before the first layer was completed
+        if depth is None:
+            if kind == 'person':
+                return self.expand_person(ref, distance, checkpoint)
+            return self.expand_company(ref, distance, checkpoint)
+
+        logger.info('Resuming %s search at distance %s.', kind, explored)
+
+        self.sp_scrapper_cache.preload_companies(frontier)
+        companies = [company for company in map(self.sp_scrapper_cache.get_company_by_ref, frontier)
+                     if company is not None and 'information' in company]
+
+        self.__expand_layers(companies, graph, explored, depth, distance, checkpoint)
+        return graph
+
+    def __batch_start(self, person_refs, sp_graph: SpGraph):
+        """
+        Fetches people of a batch query and creates their BFS states.
 
-        if person is None:
-            sp_graph.add_person(person_ref)
-            if in_company_info is not None:
-                sp_graph.add_company_person(in_company_info, person_ref)
+        :param person_refs: person refs, possibly repeated
+        :param sp_graph: shared graph
+        :return: Tuple of dictionary of SpBatchSource by person natural key, and dictionary of company json objects by node id.
+        """
+
+        roots = list({SpGraph.get_person_natural_key(person_ref): person_ref
+                      for person_ref in person_refs}.values())
+
+        self.__prefetch_persons(roots, sp_graph)
+        company_docs = {}
+        self.__register_companies(self.__expand_persons([(person_ref, None)
+                                                         for person_ref in roots
+                                                         if not sp_graph.exist_person(person_ref)], sp_graph, 0),
+                                  company_docs, sp_graph)
+        self.sp_scrapper_cache.flush()
+
+        sources = {SpGraph.get_person_natural_key(person_ref): SpBatchSource(sp_graph.get_person_id(person_ref))
+                   for person_ref in roots}
+
+        return sources, company_docs
+
+    def __batch_round(self, sources, sp_graph: SpGraph, company_docs, expanded_companies, d):
+        """
+        Expands frontier companies of all given sources at once, then moves every source by one layer.
+
+        :param sources: list of SpBatchSource to be moved
+        :param sp_graph: shared graph
+        :param company_docs: dictionary of company json objects by node id
+        :param expanded_companies: set of node ids of companies expanded so far
+        :param d: depth of the people being visited
+        """
 
-        else:
-            if 'information' in person:
+        company_ids = list({company_id: None
+                            for source in sources
+                            for company_id in source.companies
+                            if company_id not in expanded_companies})
+        expanded_companies.update(company_ids)
+
+        companies = [self.__company_doc(company_id, company_docs, sp_graph) for company_id in company_ids]
+
+        self.__register_companies(self.__expand_companies([company
+                                                           for company in companies
+                                                           if company is not None and 'information' in company],
+                                                          sp_graph, d, link_existing=True),
+                                  company_docs, sp_graph)
+
+        for source in sources:
+            self.__advance_source(source, sp_graph)
+
+    @staticmethod
+    def __advance_source(source: SpBatchSource, sp_graph: SpGraph):
+        """
+        Moves batch source by one layer over already expanded graph. Visits the person itself on the first move.
+
+        :param source: batch BFS state
+        :param sp_graph: shared graph
+        """
+
+        if source.person_id is not None and len(source.hops) == 0:
+            source.visit(source.person_id, 0, None)
+            for company_id in sp_graph.neighbours(source.person_id):
+                if source.visit(company_id, 1, source.person_id):
+                    source.companies.append(company_id)
+            return
+
+        out_companies = []
+
+        for company_id in source.companies:
+            person_hops = source.hops[company_id] + 1
+
+            for person_id in sp_graph.neighbours(company_id):
+                if source.visit(person_id, person_hops, company_id):
+                    for out_company_id in sp_graph.neighbours(person_id):
+                        if source.visit(out_company_id, person_hops + 1, person_id):
+                            out_companies.append(out_company_id)
+
+        source.companies = out_companies
+
+    @staticmethod
+    def __register_companies(companies, company_docs, sp_graph: SpGraph):
+        """
+        Remembers company json objects of the shared graph, so that they can be expanded later.
+
+        :param companies: company json objects
+        :param company_docs: dictionary of company json objects by node id
+        :param sp_graph: shared graph
+        """
+
+        for company in companies:
+            company_docs[sp_graph.get_company_id(company['information'])] = company
+
+    def __company_doc(self, company_id, company_docs, sp_graph: SpGraph):
+        """
+        Returns company json object of a graph node. Companies which were already in the graph
+        before the batch started are taken from the cache.
+
+        :param company_id: company node id
+        :param company_docs: dictionary of company json objects by node id
+        :param sp_graph: shared graph
+        :return: company json object or None if it cannot be fetched
+        """
+
+        if company_id not in company_docs:
+            record = sp_graph.records[company_id]
+            company_docs[company_id] = None if record is None or record.id is None else \
+                self.sp_scrapper_cache.get_company_by_ref({'id': record.id, 'slug': record.slug})
+
+        return company_docs[company_id]
+
+    def __expand_layers(self, companies, sp_graph: SpGraph, explored, d, distance, checkpoint: SpCheckpoint = None):
+        """
+        Expands BFS layers until the distance is explored or the frontier is empty.
+
+        :param companies: company json objects forming the current frontier
+        :param sp_graph: graph being built
+        :param explored: distance explored so far
+        :param d: depth of the people visited by the last layer
+        :param distance: distance to explore
+        :param checkpoint: SpCheckpoint written after every layer, None for no checkpoint
+        """
+
+        while explored < distance and len(companies) > 0:
+            logger.info('Exploring distance %s.', explored)
+            d = d + 1
+            explored = explored + 1
+            companies = self.__expand_companies(companies, sp_graph, d)
+
+            if checkpoint is not None:
+                checkpoint.save(sp_graph, companies, explored, d)
+
+    def __expand_companies(self, companies, sp_graph: SpGraph, d,
+                           side: SpSearchSide = None, policy: SpSearchPolicy = None, link_existing=False):
+        """
+        Expands one BFS layer. Visits people of given companies and collects their companies.
+        Companies are visited in the frontier order, so the result does not depend on max_workers.
+        If the policy has a budget, the layer is expanded in chunks of max_workers companies
+        and expansion stops as soon as the budget is exhausted.
+
+        :param companies: company json objects forming the current frontier
+        :param sp_graph: graph being built
+        :param d: depth of the people being visited
+        :param side: search side to report visited nodes to, None outside of path search
+        :param policy: search policy with budget, None for no budget
+        :param link_existing: True to connect companies with their people already present in the graph
+        :return: company json objects forming the next frontier
+        """
+
+        start = time.perf_counter()
+        chunk_size = max(self.max_workers, 1) if policy is not None and policy.limited() else max(len(companies), 1)
+        out_companies = []
+
+        for i in range(0, len(companies), chunk_size):
+            if policy is not None and not policy.within_budget():
+                side.search.truncated = True
+                break
+
+            out_companies.extend(self.__expand_companies_chunk(companies[i:i + chunk_size], sp_graph, d,
+                                                               side, link_existing))
+
+        self.sp_scrapper_cache.flush()
+
+        seconds = time.perf_counter() - start
+        metrics.observe('sp_bfs_layer_seconds', seconds, depth=d)
+        metrics.observe('sp_bfs_frontier_companies', len(companies), buckets=metrics.SIZE_BUCKETS, depth=d)
+        logger.info('Layer %s: %s companies expanded into %s companies in %.3fs.',
+                    d, len(companies), len(out_companies), seconds)
+
+        return out_companies
+
+    def __expand_companies_chunk(self, companies, sp_graph: SpGraph, d,
+                                 side: SpSearchSide = None, link_existing=False):
+        """
+        Visits people of given companies and collects their companies.
+
+        :param companies: company json objects
+        :param sp_graph: graph being built
+        :param d: depth of the people being visited
+        :param side: search side to report visited nodes to, None outside of path search
+        :param link_existing: True to connect companies with their people already present in the graph
+        :return: company json objects reached through the visited people
+        """
+
+        companies_person_refs = [self.__company_person_refs(company) for company in companies]
+
+        self.__prefetch_persons([person_ref
+                                 for person_refs in companies_person_refs
+                                 for person_ref in person_refs
+                                 if not sp_graph.exist_person(person_ref)], sp_graph)
+
+        out_companies = []
+
+        for company, person_refs in zip(companies, companies_person_refs):
+            company_info = company['information']
+            persons = []
+
+            for person_ref in person_refs:
+                if not sp_graph.exist_person(person_ref):
+                    persons.append((person_ref, company_info))
+
+                # person reached by the other side, connect it even if its own companies list is incomplete
+                elif (side is not None and side.visit(sp_graph.get_person_id(person_ref), d * 2)) or link_existing:
+                    sp_graph.add_company_person(company_info, person_ref)
+
+            out_companies.extend(self.__expand_persons(persons, sp_graph, d, side))
+
+        return out_companies
+
+    def __expand_persons(self, persons, sp_graph: SpGraph, d, side: SpSearchSide = None):
+        """
+        Visits people and adds them with their companies to the graph.
+
+        :param persons: list of (person_ref, in_company_info) tuples
+        :param sp_graph: graph being built
+        :param d: depth of the people being visited
+        :param side: search side to report visited nodes to, None outside of path search
+        :return: company json objects reached through the visited people
+        """
+
+        out_companies = []
+
+        for person_ref, in_company_info in persons:
+            person = self.sp_scrapper_cache.get_person_by_ref(person_ref)
+
+            if person is None:
+                sp_graph.add_person(person_ref)
+                if in_company_info is not None:
+                    sp_graph.add_company_person(in_company_info, person_ref)
+
+                if side is not None:
+                    side.visit(sp_graph.get_person_id(person_ref), d * 2)
+
+            elif 'information' in person:
                 person_info = person['information']
 
                 # check if person was not added already
-                if sp_graph.add_person(person_info):
-                    print('-' * (d * 2) + person_info['name'] + ', ' + person_info['birthYear'] + ', ' + person_info['id'])
+                added = sp_graph.add_person(person_info)
+
+                if side is not None:
+                    side.visit(sp_graph.get_person_id(person_info), d * 2)
+
+                if added:
+                    logger.debug('%s%s, %s, %s', '-' * (d * 2), person_info['name'], person_info['birthYear'], person_info['id'])
 
                     if 'companies' in person:
                         for out_company_ref in person['companies']:
@@ -105,76 +536,102 @@ class SpScrapper:
                                 sp_graph.add_company(out_company_ref)
                                 sp_graph.add_company_person(out_company_ref, person_info, company_person=out_company_ref)
 
-                            else:
-                                if 'information' in out_company:
-                                    out_company_info = out_company['information']
-                                    print('-' * (d * 2 + 1) + out_company_info['name'] + ', ' + out_company_info['krs'] + ', ' + out_company_info['id'])
-
-                                    sp_graph.add_company(out_company_info)
-                                    sp_graph.add_company_person(out_company_info, person_info, company_person=out_company_ref)
+                                if side is not None:
+                                    side.visit(sp_graph.get_company_id(out_company_ref), d * 2 + 1)
 
-                                    generators.append(self.__expand_company(out_company, sp_graph, d))
+                            elif 'information' in out_company:
+                                out_company_info = out_company['information']
+                                logger.debug('%s%s, %s, %s', '-' * (d * 2 + 1), out_company_info['name'], out_company_info['krs'], out_company_info['id'])
 
-        yield d
+                                sp_graph.add_company(out_company_info)
+                                sp_graph.add_company_person(out_company_info, person_info, company_person=out_company_ref)
 
-        while len(generators) > 0:
-            d = d + 1
-
-            for generator in generators:
-                if generator.__next__() == d:
-                    generators_rem.append(generator)
+                                if side is not None:
+                                    side.visit(sp_graph.get_company_id(out_company_info), d * 2 + 1)
 
-            generators = generators_rem
-            generators_rem = []
+                                out_companies.append(out_company)
 
-            yield d
+        return out_companies
 
-        yield -1
+    @staticmethod
+    def __company_person_refs(company):
+        """
+        Returns valid person refs of company's representation and directors board.
 
-    def __expand_company(self, company, sp_graph: SpGraph, d=0):
-        generators = []
-        generators_rem = []
+        :param company: company json object
+        :return: list of person refs
+        """
 
-        company_info = company['information']
+        person_refs = []
 
         # Needs testing
         # if 'shareholders' in company:
         #     for shareholders_person_ref in company['shareholders']:
-        #         if sp_graph.get_person_key(shareholders_person_ref) is None:
-        #             print('Invalid shareholders_person_ref found! %s' % str(shareholders_person_ref))
+        #         if SpGraph.get_person_natural_key(shareholders_person_ref) is None:
+        #             logger.warning('Invalid shareholders_person_ref found! %s', shareholders_person_ref)
         #             continue
 
-        #         if not sp_graph.exist_person(shareholders_person_ref):
-        #             generators.append(self.__expand_person(shareholders_person_ref, company_info, sp_graph, d + 1))
-                    
+        #         person_refs.append(shareholders_person_ref)
+
         if 'representation' in company:
             for representation_person_ref in company['representation']:
-                if sp_graph.get_person_key(representation_person_ref) is None:
-                    print('Invalid representation_person_ref found! %s' % str(representation_person_ref))
+                if SpGraph.get_person_natural_key(representation_person_ref) is None:
+                    logger.warning('Invalid representation_person_ref found! %s', representation_person_ref)
                     continue
 
-                if not sp_graph.exist_person(representation_person_ref):
-                    generators.append(self.__expand_person(representation_person_ref, company_info, sp_graph, d + 1))
-                    
+                person_refs.append(representation_person_ref)
+
         if 'directorsBoard' in company:
             for directors_board_person_ref in company['directorsBoard']:
-                if sp_graph.get_person_key(directors_board_person_ref) is None:
-                    print('Invalid directors_board_person_ref found! %s' % str(directors_board_person_ref))
+                if SpGraph.get_person_natural_key(directors_board_person_ref) is None:
+                    logger.warning('Invalid directors_board_person_ref found! %s', directors_board_person_ref)
                     continue
 
-                if not sp_graph.exist_person(directors_board_person_ref):
-                    generators.append(self.__expand_person(directors_board_person_ref, company_info, sp_graph, d + 1))
+                person_refs.append(directors_board_person_ref)
 
-        while len(generators) > 0:
-            d = d + 1
+        return person_refs
 
-            for generator in generators:
-                if generator.__next__() == d:
-                    generators_rem.append(generator)
+    def __prefetch_persons(self, person_refs, sp_graph: SpGraph):
+        """
+        Warms the cache with given people and companies of the people not yet in the graph.
+        Cached entities are always loaded in bulk. Missing ones are fetched by the shard pool if there is one,
+        concurrently if max_workers > 1, otherwise they are fetched lazily while the graph is built.
+
+        :param person_refs: person refs to be fetched
+        :param sp_graph: graph being built
+        """
+
+        persons = self.sp_scrapper_cache.preload_persons(person_refs)
+        if self.shard_pool is not None:
+            persons = self.shard_pool.fetch_missing(self.sp_scrapper_cache, person_refs, persons, 'person')
+        elif self.max_workers > 1:
+            persons = self.__fetch_all(person_refs, self.sp_scrapper_cache.get_person_by_ref)
+
+        company_refs = [out_company_ref
+                        for person in persons
+                        if person is not None and 'information' in person
+                        and not sp_graph.exist_person(person['information'])
+                        for out_company_ref in person.get('companies', [])]
+
+        companies = self.sp_scrapper_cache.preload_companies(company_refs)
+        if self.shard_pool is not None:
+            self.shard_pool.fetch_missing(self.sp_scrapper_cache, company_refs, companies, 'company')
+        elif self.max_workers > 1:
+            self.__fetch_all(company_refs, self.sp_scrapper_cache.get_company_by_ref)
+
+    def __fetch_all(self, refs, fetch_method):
+        """
+        Fetches refs using at most max_workers concurrent requests. Refs with the same id are fetched once.
+
+        :param refs: list of *_refs
+        :param fetch_method: cache method expanding a single *_ref
+        :return: list of fetched json objects (None for refs that cannot be expanded)
+        """
 
-            generators = generators_rem
-            generators_rem = []
+        unique_refs = list({ref.get('id'): ref for ref in refs}.values())
 
-            yield d
+        if len(unique_refs) == 0:
+            return []
 
-        yield -1
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique_refs))) as executor:
+            return list(executor.map(fetch_method, unique_refs))
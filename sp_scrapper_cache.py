@@ -1,7 +1,17 @@
-import couchdb
+import calendar
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
+from sp_lru_cache import SpLruCache
+from sp_metrics import get_logger, metrics
+from sp_name_index import SpNameIndex
+from sp_projection import SpProjection
 from sp_rest_client import SpRestClient
+from sp_rest_scheduler import SpRestError
+from sp_storage import SpStorage, SpCouchStorage, SpSqliteStorage
+
+logger = get_logger('cache')
 
 
 class SpScrapperCache:
@@ -9,14 +19,79 @@ class SpScrapperCache:
     SpScrapper cache for API requests. Uses local dictionaries and local DB.
     """
 
-    def __init__(self, sp_rest_client: SpRestClient):
+    def __init__(self,
+                 sp_rest_client: SpRestClient,
+                 storage_batch_size=100,
+                 storage_batch_interval=5.0,
+                 cache_max_items=None,
+                 cache_max_bytes=None,
+                 refresh_ttl=None,
+                 expire_ttl=None,
+                 refresh_workers=2,
+                 negative_ttl=300.0,
+                 lean=True,
+                 keep_raw=False):
+        """
+        :param sp_rest_client: SpRestClient used on cache misses
+        :param storage_batch_size: Number of buffered documents that triggers a bulk write. Also bulk read chunk size.
+        :param storage_batch_interval: Seconds after which buffered documents are written regardless of their number,
+                                       also when no more documents are fetched.
+        :param cache_max_items: Level 1 cache limit of items per entity type. None for no limit.
+        :param cache_max_bytes: Level 1 cache limit of approximate memory per entity type. None for no limit.
+        :param refresh_ttl: Age in seconds after which a cached item is served and refreshed in the background.
+        :param expire_ttl: Age in seconds after which a cached item is not served and is fetched again.
+        :param refresh_workers: Number of threads refreshing stale items in the background.
+        :param negative_ttl: Seconds during which a failed fetch is not repeated. None to disable negative caching.
+        :param lean: True to cache only the fields read by graph traversal, see SpProjection.
+        :param keep_raw: True to keep compressed raw API payload in level 2 cache documents of lean cache.
+        """
+
+        # projection of API payloads and stored documents
+        self.projection = SpProjection(keep_raw=keep_raw) if lean else None
+
         # level 1 cache
-        self.person_cache = {}
-        self.company_cache = {}
+        self.person_cache = SpLruCache(cache_max_items, cache_max_bytes)
+        self.company_cache = SpLruCache(cache_max_items, cache_max_bytes)
+
+        # staleness of cached items
+        self.refresh_ttl = refresh_ttl
+        self.expire_ttl = expire_ttl
+        self.refresh_executor = ThreadPoolExecutor(max_workers=refresh_workers)
+        self.refresh_pending = set()
+        self.refresh_lock = threading.Lock()
+        self.refreshed = 0
+        self.expired = 0
+        self.api_calls = 0
+
+        # coalescing of concurrent fetches and negative cache of failed ones
+        self.negative_ttl = negative_ttl
+        self.negative_cache = SpLruCache(cache_max_items)
+        self.fetches_in_flight = {}
+        self.fetch_lock = threading.Lock()
+        self.coalesced = 0
+        self.negative_hits = 0
+
+        # eviction of items changed in level 2 cache by other processes
+        self.changes_thread = None
+        self.changes_stop = threading.Event()
+        self.invalidated = 0
+
+        # counters above are incremented by caller, executor, refresh and changes feed threads
+        self.counters_lock = threading.Lock()
 
         # level 2 cache
         self.couch_server = None
         self.couch_db = None
+        self.storage = None
+        self.storage_batch_size = storage_batch_size
+        self.storage_batch_interval = storage_batch_interval
+        self.storage_write_buffer = []
+        self.storage_write_time = time.time()
+        self.storage_write_lock = threading.Lock()
+        self.storage_flush_timer = None
+
+        # local name search index
+        self.name_index = None
 
         # level 3 cache ;)
         self.sp_rest_client = sp_rest_client
@@ -27,11 +102,119 @@ class SpScrapperCache:
         Optionally creates an application db (if was not created already).
         """
 
+        import couchdb
+
         server = couchdb.Server()
         db = server['sp'] if 'sp' in server else server.create('sp')
 
         self.couch_server = server
         self.couch_db = db
+        self.storage = SpCouchStorage(db)
+
+    def init_sqlite(self, path='sp.sqlite'):
+        """
+        Initializes embedded SQLite database as level 2 cache.
+        Creates the database file if it does not exist.
+
+        :param path: database file path
+        """
+
+        self.init_storage(SpSqliteStorage(path))
+
+    def init_storage(self, storage: SpStorage):
+        """
+        Initializes any level 2 cache storage.
+
+        :param storage: SpStorage implementation
+        """
+
+        self.storage = storage
+
+    def init_name_index(self, path='sp_names.sqlite'):
+        """
+        Initializes local name search index. Documents written to level 2 cache are indexed as well.
+        Build the index of already cached documents with SpNameIndex.build.
+
+        :param path: index database file path
+        """
+
+        self.name_index = SpNameIndex(path)
+
+    def watch_changes(self, timeout=10.0):
+        """
+        Starts a background thread following level 2 cache changes feed. Items changed by other processes sharing
+        the storage, e.g. SpCacheRefresher or other crawlers, are evicted from level 1 cache.
+
+        :param timeout: seconds a single changes feed request waits for changes
+        """
+
+        if self.changes_thread is not None:
+            return
+
+        since = self.storage.changes()[1]
+        self.changes_stop.clear()
+        self.changes_thread = threading.Thread(target=self.__watch_changes, args=(since, timeout), daemon=True)
+        self.changes_thread.start()
+
+    def stop_watching(self):
+        """
+        Stops following level 2 cache changes feed. Waits for the pending changes feed request.
+        """
+
+        if self.changes_thread is None:
+            return
+
+        self.changes_stop.set()
+        self.changes_thread.join()
+        self.changes_thread = None
+
+    def invalidate(self, changes):
+        """
+        Evicts changed documents from level 1 cache, unless the cached item has the changed revision already.
+        Forgets their failed fetches as well.
+
+        :param changes: list of (doc_id, revision or None) tuples, see SpStorage.changes
+        """
+
+        for doc_id, rev in changes:
+            if doc_id.startswith('p_'):
+                item_cache = self.person_cache
+            elif doc_id.startswith('c_'):
+                item_cache = self.company_cache
+            else:
+                continue
+
+            self.negative_cache.pop(doc_id)
+
+            id = doc_id[2:]
+            item = item_cache.peek(id)
+
+            if item is not None and (rev is None or item.get('_rev') != rev):
+                item_cache.pop(id)
+                self.count('invalidated')
+                metrics.inc('sp_cache_invalidations_total', kind=self.__kind(item_cache))
+
+    def search(self, query, type=None):
+        """
+        Searches people and companies in the local name index. Calls the API search only if nothing was found.
+
+        :param query: query string
+        :param type: 'person' or 'company' to limit local results to one type, None for both
+        :return: list of search result json objects
+        """
+
+        if self.name_index is not None:
+            found = self.name_index.search(query, type)
+            if len(found) > 0:
+                return found
+
+        self.count('api_calls')
+        results = self.sp_rest_client.search(query)
+
+        if self.name_index is not None:
+            self.name_index.add_search_results(results)
+
+        return results
 
     def get_person_by_ref(self, person_ref):
         """
@@ -46,6 +229,22 @@ class SpScrapperCache:
                                     lambda id: 'p_%s' % id,
                                     lambda id, slug: self.sp_rest_client.person(id, slug))
 
+    def resolve_person_ref(self, person_ref):
+        """
+        Completes a person_ref known only by id and slug with name and birthYear, which identify people in SpGraph.
+
+        :param person_ref: person_ref with id and slug
+        :return: person_ref with name and birthYear, None if the person does not exist
+        """
+
+        person = self.get_person_by_ref(person_ref)
+
+        if person is None or 'information' not in person:
+            return None
+
+        information = person['information']
+        return dict(person_ref, name=information.get('name'), birthYear=information.get('birthYear'))
+
     def get_company_by_ref(self, company_ref):
         """
         Returns company's json based on a company_ref.
@@ -59,6 +258,128 @@ class SpScrapperCache:
                                     lambda id: 'c_%s' % id,
                                     lambda id, slug: self.sp_rest_client.company(id, slug))
 
+    def preload_persons(self, person_refs):
+        """
+        Loads people into level 1 cache using a single bulk level 2 cache read.
+        Does not call the API.
+
+        :param person_refs: list of person_refs
+        :return: list of person json objects, None for refs not found in cache
+        """
+
+        return self.preload_items_by_refs(person_refs,
+                                          self.person_cache,
+                                          lambda id: 'p_%s' % id)
+
+    def preload_companies(self, company_refs):
+        """
+        Loads companies into level 1 cache using a single bulk level 2 cache read.
+        Does not call the API.
+
+        :param company_refs: list of company_refs
+        :return: list of company json objects, None for refs not found in cache
+        """
+
+        return self.preload_items_by_refs(company_refs,
+                                          self.company_cache,
+                                          lambda id: 'c_%s' % id)
+
+    def preload_items_by_refs(self,
+                              item_refs,
+                              item_cache,
+                              item_couch_id_method):
+        """
+        Generic *_ref bulk preloading method. Reads missing items with _all_docs?include_docs=true.
+
+        :param item_refs: list of *_refs
+        :param item_cache: cache of * type
+        :param item_couch_id_method: lambda for converting * to level 2 cache key
+        :return: list of * json objects, None for refs not found in cache
+        """
+
+        ids = [self.__extract_id_and_slug(item_ref)[0] if self.__validate_id_and_slug(item_ref) else None
+               for item_ref in item_refs]
+
+        missing_ids = {item_couch_id_method(id): id
+                       for id in ids
+                       if id is not None and id not in item_cache}
+        missing_couch_ids = list(missing_ids)
+        found_count = 0
+
+        for i in range(0, len(missing_couch_ids), self.storage_batch_size):
+            with metrics.timer('sp_storage_seconds', operation='get_many'):
+                found = self.storage.get_many(missing_couch_ids[i:i + self.storage_batch_size])
+
+            for couch_id, item in found.items():
+                item_cache[missing_ids[couch_id]] = self.__lean(item_cache, item)
+            found_count += len(found)
+
+        kind = self.__kind(item_cache)
+        metrics.inc('sp_cache_preloads_total', len({id for id in ids if id is not None}) - len(missing_ids), layer='l1', kind=kind, result='hit')
+        metrics.inc('sp_cache_preloads_total', found_count, layer='l2', kind=kind, result='hit')
+        metrics.inc('sp_cache_preloads_total', len(missing_ids) - found_count, layer='l2', kind=kind, result='miss')
+
+        return [None if id is None else item_cache.get(id) for id in ids]
+
+    def warm(self, kind, items, api_calls=0):
+        """
+        Puts items fetched elsewhere, e.g. by SpShardPool worker processes, into level 1 cache.
+        The items are expected to be written to level 2 cache by whoever fetched them.
+        Items which could not be fetched are remembered in the negative cache.
+
+        :param kind: 'person' or 'company'
+        :param items: dictionary of * json objects, or None for failed fetches, by * internal id
+        :param api_calls: number of API calls made to fetch the items
+        """
+
+        item_cache = self.person_cache if kind == 'person' else self.company_cache
+        prefix = 'p_%s' if kind == 'person' else 'c_%s'
+
+        for id, item in items.items():
+            if item is not None:
+                item_cache[id] = self.__lean(item_cache, item)
+            elif self.negative_ttl is not None:
+                self.negative_cache[prefix % id] = time.monotonic() + self.negative_ttl
+
+        self.count('api_calls', api_calls)
+
+    def flush(self):
+        """
+        Writes buffered documents to level 2 cache with a single bulk request.
+        """
+
+        with self.storage_write_lock:
+            docs = self.storage_write_buffer
+            self.storage_write_buffer = []
+            self.storage_write_time = time.time()
+            flush_timer = self.storage_flush_timer
+            self.storage_flush_timer = None
+
+        if flush_timer is not None:
+            flush_timer.cancel()
+
+        if len(docs) == 0:
+            return
+
+        try:
+            with metrics.timer('sp_storage_seconds', operation='put_many'):
+                failures = self.storage.put_many(docs)
+
+            for doc_id, ex in failures:
+                logger.warning('%s: %s', doc_id, ex)
+
+            metrics.inc('sp_storage_writes_total', len(docs) - len(failures), result='written')
+            metrics.inc('sp_storage_writes_total', len(failures), result='failed')
+        except Exception as ex:
+            logger.warning('Level 2 cache write failed: %s', ex)
+            metrics.inc('sp_storage_writes_total', len(docs), result='failed')
+
+        if self.name_index is not None:
+            try:
+                self.name_index.add_docs(docs)
+            except Exception as ex:
+                logger.warning('Name index update failed: %s', ex)
+
     def get_item_by_ref(self,
                         item_ref,
                         item_cache,
@@ -69,7 +390,7 @@ class SpScrapperCache:
 
         :param item_ref: some *_ref
         :param item_cache: cache of * type
-        :param item_couch_id_method: lambda for converting * to couchdb key
+        :param item_couch_id_method: lambda for converting * to level 2 cache key
         :param item_rest_client_method: lambda for executing API method providing * json objects
         :return: * json object or None if *_ref cannot be expanded
         """
@@ -79,26 +400,265 @@ class SpScrapperCache:
 
         id, slug = self.__extract_id_and_slug(item_ref)
 
-        if id in item_cache:
-            return item_cache[id]
-
         couch_id = item_couch_id_method(id)
-        if couch_id in self.couch_db:
-            item = self.couch_db[couch_id]
-            item_cache[id] = item
-            return item
+        kind = self.__kind(item_cache)
+
+        cached_item = item_cache.get(id)
+        metrics.inc('sp_cache_lookups_total', layer='l1', kind=kind, result='miss' if cached_item is None else 'hit')
+
+        if cached_item is None:
+            with metrics.timer('sp_storage_seconds', operation='get'):
+                cached_item = self.storage.get(couch_id)
+                cached_item = None if cached_item is None else self.__lean(item_cache, cached_item)
+            metrics.inc('sp_cache_lookups_total', layer='l2', kind=kind, result='miss' if cached_item is None else 'hit')
+
+            if cached_item is not None:
+                item_cache[id] = cached_item
 
-        item = item_rest_client_method(id, slug)
-        
+        if cached_item is not None:
+            age = self.__item_age(cached_item)
+
+            if self.expire_ttl is None or age < self.expire_ttl:
+                if self.refresh_ttl is not None and age >= self.refresh_ttl:
+                    self.__refresh_async(item_ref, item_cache, item_couch_id_method, item_rest_client_method)
+                return cached_item
+
+            self.count('expired')
+            metrics.inc('sp_cache_expired_total', kind=kind)
+
+        return self.__fetch_item(id, slug, couch_id, cached_item, item_cache, item_rest_client_method)
+
+    def count(self, counter, n=1):
+        """
+        Adds to a statistics counter. Safe to call from any thread.
+
+        :param counter: counter attribute name, e.g. 'api_calls', see stats
+        :param n: number added to the counter
+        """
+
+        with self.counters_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def stats(self):
+        """
+        Returns level 1 cache statistics.
+
+        :return: dictionary of person and company cache statistics with refresh, expiry and fetch counters
+        """
+
+        return {
+            'person': self.person_cache.stats(),
+            'company': self.company_cache.stats(),
+            'negative': self.negative_cache.stats(),
+            'refreshed': self.refreshed,
+            'expired': self.expired,
+            'coalesced': self.coalesced,
+            'negative_hits': self.negative_hits,
+            'invalidated': self.invalidated,
+            'api_calls': self.api_calls
+        }
+
+    def __fetch_item(self, id, slug, couch_id, cached_item, item_cache, item_rest_client_method):
+        """
+        Fetches an item from the API, unless it recently failed.
+        Concurrent fetches of the same item are coalesced into a single API call. The leader stores the item in
+        level 1 cache before it stops being in flight, so late callers find it there instead of fetching it again.
+
+        :param id: * internal id
+        :param slug: * internal slug
+        :param couch_id: level 2 cache key
+        :param cached_item: previously cached version of the item or None
+        :param item_cache: cache of * type
+        :param item_rest_client_method: lambda for executing API method providing * json objects
+        :return: * json object, or the previously cached version if the API request failed
+        """
+
+        kind = self.__kind(item_cache)
+
+        failed_until = self.negative_cache.get(couch_id)
+        if failed_until is not None:
+            if time.monotonic() < failed_until:
+                self.count('negative_hits')
+                metrics.inc('sp_cache_lookups_total', layer='negative', kind=kind, result='hit')
+                return cached_item
+            self.negative_cache.pop(couch_id)
+
+        with self.fetch_lock:
+            # a leader which finished after the caller missed level 1 cache left its result there, or failed
+            fetched_item = item_cache.peek(id)
+            fetched = fetched_item is not None and fetched_item is not cached_item
+            failed = time.monotonic() < self.negative_cache.peek(couch_id, 0.0)
+
+            future = self.fetches_in_flight.get(couch_id)
+            leader = future is None and not fetched and not failed
+            if leader:
+                future = Future()
+                self.fetches_in_flight[couch_id] = future
+
+        if fetched or failed:
+            self.count('coalesced')
+            metrics.inc('sp_cache_lookups_total', layer='api', kind=kind, result='coalesced')
+            return fetched_item if fetched else cached_item
+
+        if not leader:
+            self.count('coalesced')
+            metrics.inc('sp_cache_lookups_total', layer='api', kind=kind, result='coalesced')
+            item = future.result()
+            return item if item is not None else cached_item
+
+        item = None
         try:
+            item = self.__fetch_item_once(id, slug, couch_id, cached_item, item_cache, item_rest_client_method)
+            metrics.inc('sp_cache_lookups_total', layer='api', kind=kind, result='failed' if item is None else 'fetched')
+        finally:
+            with self.fetch_lock:
+                del self.fetches_in_flight[couch_id]
+            future.set_result(item)
+
+        return item if item is not None else cached_item
+
+    def __fetch_item_once(self, id, slug, couch_id, cached_item, item_cache, item_rest_client_method):
+        """
+        Calls the API and stores fetched item in level 1 and level 2 caches.
+        Failed requests and error bodies are remembered in the negative cache.
+
+        :param id: * internal id
+        :param slug: * internal slug
+        :param couch_id: level 2 cache key
+        :param cached_item: previously cached version of the item or None
+        :param item_cache: cache of * type
+        :param item_rest_client_method: lambda for executing API method providing * json objects
+        :return: * json object or None if the API request failed
+        """
+
+        self.count('api_calls')
+
+        try:
+            item = item_rest_client_method(id, slug)
+        except SpRestError as ex:
+            logger.warning('%s: %s', couch_id, ex)
+            item = None
+
+        if not isinstance(item, dict) or 'information' not in item:
+            if item is not None:
+                logger.warning('%s: unexpected API response %s', couch_id, str(item)[:200])
+            if self.negative_ttl is not None:
+                self.negative_cache[couch_id] = time.monotonic() + self.negative_ttl
+            return None
+
+        try:
+            if self.projection is not None:
+                item = self.projection.project(self.__kind(item_cache), item)
+
+            item['_id'] = couch_id
             item['timestamp'] = time.gmtime()
-            self.couch_db[couch_id] = item
+            if cached_item is not None and '_rev' in cached_item:
+                item['_rev'] = cached_item['_rev']
+
+            # level 2 cache keeps the raw payload of keep_raw, level 1 cache only the lean item
+            doc, item = item, self.__lean(item_cache, item)
             item_cache[id] = item
+            self.__buffer_write(doc)
         except Exception as ex:
-            print(ex)
+            logger.warning('%s: %s', couch_id, ex)
 
         return item
 
+    def __refresh_async(self, item_ref, item_cache, item_couch_id_method, item_rest_client_method):
+        """
+        Schedules a background refresh of a stale item. The item is refreshed at most once at a time.
+
+        :param item_ref: some *_ref
+        :param item_cache: cache of * type
+        :param item_couch_id_method: lambda for converting * to level 2 cache key
+        :param item_rest_client_method: lambda for executing API method providing * json objects
+        """
+
+        id, slug = self.__extract_id_and_slug(item_ref)
+        couch_id = item_couch_id_method(id)
+
+        with self.refresh_lock:
+            if couch_id in self.refresh_pending:
+                return
+            self.refresh_pending.add(couch_id)
+
+        def refresh():
+            try:
+                self.__fetch_item(id, slug, couch_id, item_cache.get(id), item_cache, item_rest_client_method)
+                self.count('refreshed')
+                metrics.inc('sp_cache_refreshed_total', kind=self.__kind(item_cache))
+            except Exception as ex:
+                logger.warning('%s: refresh failed: %s', couch_id, ex)
+            finally:
+                with self.refresh_lock:
+                    self.refresh_pending.discard(couch_id)
+
+        self.refresh_executor.submit(refresh)
+
+    def __watch_changes(self, since, timeout):
+        while not self.changes_stop.is_set():
+            try:
+                changes, since = self.storage.changes(since, timeout)
+            except Exception as ex:
+                logger.warning('Level 2 cache changes feed failed: %s', ex)
+                self.changes_stop.wait(timeout)
+                continue
+
+            self.invalidate(changes)
+
+    @staticmethod
+    def __item_age(item):
+        """
+        Returns number of seconds since the item was fetched from the API.
+
+        :param item: cached * json object
+        :return: age in seconds, infinity if the item has no timestamp
+        """
+
+        timestamp = item.get('timestamp')
+        if timestamp is None:
+            return float('inf')
+
+        return time.time() - calendar.timegm(tuple(timestamp[:6]))
+
+    def __buffer_write(self, item):
+        """
+        Buffers document for a bulk write. Flushes the buffer if it is full or old enough.
+        Otherwise the buffer is flushed by a timer after storage_batch_interval, in case no more documents come.
+
+        :param item: json object with _id set
+        """
+
+        with self.storage_write_lock:
+            self.storage_write_buffer.append(item)
+            flush = len(self.storage_write_buffer) >= self.storage_batch_size or \
+                time.time() - self.storage_write_time >= self.storage_batch_interval
+
+            if not flush and self.storage_flush_timer is None:
+                self.storage_flush_timer = threading.Timer(self.storage_batch_interval, self.flush)
+                self.storage_flush_timer.daemon = True
+                self.storage_flush_timer.start()
+
+        if flush:
+            self.flush()
+
+    def __lean(self, item_cache, item):
+        """
+        :param item_cache: cache of * type
+        :param item: * json object read from level 2 cache
+        :return: Projected json object, or the object itself if projection is disabled.
+        """
+
+        return item if self.projection is None else self.projection.lean(self.__kind(item_cache), item)
+
+    def __kind(self, item_cache):
+        """
+        :param item_cache: cache of * type
+        :return: 'person' or 'company', used as metrics label
+        """
+
+        return 'person' if item_cache is self.person_cache else 'company'
+
     @staticmethod
     def __validate_id_and_slug(item):
         id = item['id']
@@ -0,0 +1,406 @@
+import math
+import time
+
+from sp_metrics import metrics
+
+
+class SpSearchSide:
+    """
+    One side of bidirectional search. Holds company frontier and hop distances of visited nodes.
+    """
+
+    def __init__(self, search, person_ref):
+        """
+        :param search: SpBidirectionalSearch this side belongs to
+        :param person_ref: person_ref the side starts from
+        """
+
+        self.search = search
+        self.person_ref = person_ref
+        self.companies = []
+        self.deferred = []
+        self.depth = 0
+        self.hops = {}
+
+    def other(self):
+        """
+        :return: The opposite side of the search.
+        """
+
+        return self.search.sides[1] if self.search.sides[0] is self else self.search.sides[0]
+
+    def visit(self, key, hops):
+        """
+        Marks graph node as reached by this side. Detects meeting with the other side in O(1).
+
+        :param key: person or company node id
+        :param hops: number of edges between the node and the side's person
+        :return: True if the node was reached by the other side as well, False otherwise.
+        """
+
+        if key not in self.hops:
+            self.hops[key] = hops
+
+        other_hops = self.other().hops.get(key)
+        if other_hops is None:
+            return False
+
+        self.search.meet(key, self.hops[key] + other_hops)
+        return True
+
+    def frontier_size(self):
+        """
+        :return: Number of companies left to expand, including deferred ones.
+        """
+
+        return len(self.companies) if len(self.companies) > 0 else len(self.deferred)
+
+    def set_frontier(self, companies, policy):
+        """
+        Sets next frontier. Hub companies are deferred until the regular frontier runs out, or dropped.
+
+        :param companies: company json objects forming the next frontier
+        :param policy: SpSearchPolicy ordering and filtering the frontier
+        """
+
+        self.companies, hubs = policy.split(policy.prune(self, companies))
+
+        if len(hubs) > 0:
+            self.search.truncated = True
+            if policy.defer_hubs:
+                self.deferred.extend(hubs)
+
+        if len(self.companies) == 0:
+            self.companies, self.deferred = self.deferred, []
+
+
+class SpBidirectionalSearch:
+    """
+    State of bidirectional BFS between two people.
+    """
+
+    def __init__(self, person_ref_1, person_ref_2, distance=None):
+        """
+        :param person_ref_1: Some person ref
+        :param person_ref_2: Some other person ref
+        :param distance: Distance of the search measured in 'company' nodes, None if unknown
+        """
+
+        self.sides = [SpSearchSide(self, person_ref_1), SpSearchSide(self, person_ref_2)]
+
+        # the sides meet on a company reached by both of them, so a search of a distance can find one more company
+        self.max_hops = None if distance is None else (distance + 1) * 2
+
+        self.meet_key = None
+        self.meet_hops = None
+        self.truncated = False
+
+    def meet(self, key, hops):
+        """
+        Records a meeting node. Keeps the one on the shortest connection.
+
+        :param key: person or company node id
+        :param hops: length of the connection going through the node
+        """
+
+        if self.meet_hops is None or hops < self.meet_hops:
+            self.meet_key = key
+            self.meet_hops = hops
+
+    def found(self):
+        """
+        :return: True if the sides met, False otherwise.
+        """
+
+        return self.meet_key is not None
+
+    def exhausted(self):
+        """
+        Checks if there is nothing more to explore. Empty frontier of any side proves there is no connection.
+
+        :return: True if any side has no companies left to expand, False otherwise.
+        """
+
+        return any(side.frontier_size() == 0 for side in self.sides)
+
+    def exact(self):
+        """
+        Checks if the result is proven. Deferred or dropped hubs and exhausted budget make the result approximate.
+
+        :return: True if the result is exact, False if it was truncated.
+        """
+
+        return not self.truncated
+
+    def next_side(self):
+        """
+        :return: Side with the smaller frontier.
+        """
+
+        return min(self.sides, key=lambda side: side.frontier_size())
+
+
+class SpSearchPolicy:
+    """
+    Decides how find_path expands frontiers. Can be subclassed to plug in different strategies.
+    Default instance expands whole layers in discovery order without any limits, so the result is exact.
+
+    With a landmark index, pairs of people which are too far apart are answered without any expansion,
+    and frontier companies too far from the other person are not expanded. The index is built from the cache,
+    which holds only the crawled part of the graph, so its distances are estimates: searches pruned with them
+    are reported as not exact.
+    """
+
+    def __init__(self, max_api_calls=None, max_seconds=None, hub_degree=None, defer_hubs=True, order_by_degree=False,
+                 landmarks=None):
+        """
+        :param max_api_calls: API calls allowed per query, None for no limit
+        :param max_seconds: Time allowed per query, None for no limit
+        :param hub_degree: Number of company people above which company is treated as a hub, None for no hubs
+        :param defer_hubs: True to expand hubs after all other companies, False to never expand them
+        :param order_by_degree: True to expand companies with fewer people first
+        :param landmarks: SpIndex with landmark distances, None for no pruning
+        """
+
+        self.max_api_calls = max_api_calls
+        self.max_seconds = max_seconds
+        self.hub_degree = hub_degree
+        self.defer_hubs = defer_hubs
+        self.order_by_degree = order_by_degree
+        self.landmarks = landmarks
+
+        self.sp_scrapper_cache = None
+        self.start_api_calls = 0
+        self.start_time = 0
+
+    def start(self, sp_scrapper_cache):
+        """
+        Starts measuring query budget.
+
+        :param sp_scrapper_cache: SpScrapperCache counting API calls
+        """
+
+        self.sp_scrapper_cache = sp_scrapper_cache
+        self.start_api_calls = sp_scrapper_cache.api_calls
+        self.start_time = time.time()
+
+    def limited(self):
+        """
+        :return: True if policy has any budget, False otherwise.
+        """
+
+        return self.max_api_calls is not None or self.max_seconds is not None
+
+    def within_budget(self):
+        """
+        :return: True if query may continue fetching, False otherwise.
+        """
+
+        if self.max_api_calls is not None and \
+                self.sp_scrapper_cache.api_calls - self.start_api_calls >= self.max_api_calls:
+            return False
+
+        if self.max_seconds is not None and time.time() - self.start_time >= self.max_seconds:
+            return False
+
+        return True
+
+    def too_far(self, search: SpBidirectionalSearch):
+        """
+        Checks if landmark distances show that the people of a search are too far apart to be connected
+        within its distance. If so, the search is marked as truncated, because the index is built from the cache,
+        which holds only part of the graph.
+
+        :param search: search to be started
+        :return: True if the search should not be started, False otherwise.
+        """
+
+        if self.landmarks is None or search.max_hops is None:
+            return False
+
+        node_id_1 = self.landmarks.node_id(search.sides[0].person_ref)
+        node_id_2 = self.landmarks.node_id(search.sides[1].person_ref)
+
+        if not self.__beyond(node_id_1, node_id_2, search.max_hops):
+            return False
+
+        search.truncated = True
+        metrics.inc('sp_landmark_pruned_total', kind='pair')
+        return True
+
+    def prune(self, side: SpSearchSide, companies):
+        """
+        Drops frontier companies which landmark distances show to be too far from the other person of the search.
+        The search is marked as truncated if any company is dropped, see too_far.
+
+        :param side: search side the frontier belongs to
+        :param companies: company json objects forming the next frontier
+        :return: Companies which may lie on a path.
+        """
+
+        if self.landmarks is None or side.search.max_hops is None or len(companies) == 0:
+            return companies
+
+        target = self.landmarks.node_id(side.other().person_ref)
+
+        # frontier companies are reached by people of the side's depth
+        max_hops = side.search.max_hops - (side.depth * 2 + 1)
+        kept = [company for company in companies
+                if not self.__beyond(self.landmarks.node_id(company.get('_id', '')), target, max_hops)]
+
+        if len(kept) < len(companies):
+            side.search.truncated = True
+            metrics.inc('sp_landmark_pruned_total', len(companies) - len(kept), kind='company')
+
+        return kept
+
+    def __beyond(self, node_id_1, node_id_2, max_hops):
+        """
+        Only nodes whose documents are cached, and so whose relations are indexed, are compared.
+        Infinite bounds are ignored, as missing documents can connect components of the index.
+
+        :param node_id_1: index node id or None
+        :param node_id_2: index node id or None
+        :param max_hops: number of edges allowed between the nodes
+        :return: True if the lower bound of the distance between the nodes exceeds max_hops, False otherwise.
+        """
+
+        if node_id_1 is None or node_id_2 is None or \
+                not self.landmarks.cached(node_id_1) or not self.landmarks.cached(node_id_2):
+            return False
+
+        lower = self.landmarks.hop_bounds(node_id_1, node_id_2)[0]
+        return max_hops < lower < math.inf
+
+    def split(self, companies):
+        """
+        Orders next frontier and separates hub companies from it.
+
+        :param companies: company json objects forming the next frontier
+        :return: Tuple of companies to be expanded next and hub companies to be deferred or dropped.
+        """
+
+        if self.order_by_degree:
+            companies = sorted(companies, key=self.degree)
+
+        if self.hub_degree is None:
+            return companies, []
+
+        return [company for company in companies if self.degree(company) <= self.hub_degree], \
+               [company for company in companies if self.degree(company) > self.hub_degree]
+
+    @staticmethod
+    def degree(company):
+        """
+        :param company: company json object
+        :return: Number of people listed by the company.
+        """
+
+        return len(company.get('representation', [])) + len(company.get('directorsBoard', []))
+
+
+class SpBatchSource:
+    """
+    BFS state of one person of a batch path query. Traverses the shared graph, which is expanded once for all people.
+    """
+
+    def __init__(self, person_id):
+        """
+        :param person_id: graph node id of the person, None if the person could not be added to the graph
+        """
+
+        self.person_id = person_id
+        self.parents = {}
+        self.hops = {}
+        self.companies = []
+        self.pairs = []
+
+    def visit(self, node_id, hops, parent_id):
+        """
+        Marks graph node as reached. Checks every undecided pair of the source for a meeting in O(1).
+
+        :param node_id: person or company node id
+        :param hops: number of edges between the node and the source person
+        :param parent_id: node id the node was reached from
+        :return: True if the node was reached for the first time, False otherwise.
+        """
+
+        if node_id in self.hops:
+            return False
+
+        self.hops[node_id] = hops
+        self.parents[node_id] = parent_id
+
+        for pair in self.pairs:
+            if not pair.decided:
+                pair.check(self, node_id)
+
+        return True
+
+    def path(self, node_id):
+        """
+        :param node_id: reached node id
+        :return: List of node ids from the node back to the source person.
+        """
+
+        path = []
+        while node_id is not None:
+            path.append(node_id)
+            node_id = self.parents[node_id]
+        return path
+
+
+class SpBatchPair:
+    """
+    Single pair of a batch path query with the shortest meeting found so far.
+    """
+
+    def __init__(self, person_ref_1, person_ref_2, source_1: SpBatchSource, source_2: SpBatchSource):
+        """
+        :param person_ref_1: Some person ref
+        :param person_ref_2: Some other person ref
+        :param source_1: BFS state of person 1
+        :param source_2: BFS state of person 2
+        """
+
+        self.person_ref_1 = person_ref_1
+        self.person_ref_2 = person_ref_2
+        self.sources = [source_1, source_2]
+        self.meet_id = None
+        self.meet_hops = None
+        self.decided = False
+
+    def other(self, source):
+        """
+        :param source: one of the pair sources
+        :return: The other source of the pair.
+        """
+
+        return self.sources[1] if self.sources[0] is source else self.sources[0]
+
+    def check(self, source, node_id):
+        """
+        Checks if a node newly reached by a source was reached by the other source of the pair.
+
+        :param source: source which reached the node
+        :param node_id: reached node id
+        """
+
+        other = self.other(source)
+        if node_id not in other.hops:
+            return
+
+        hops = source.hops[node_id] + other.hops[node_id]
+        if self.meet_hops is None or hops < self.meet_hops:
+            self.meet_id = node_id
+            self.meet_hops = hops
+
+    def path(self):
+        """
+        :return: List of node ids from person 1 to person 2, None if the people did not meet.
+        """
+
+        if self.meet_id is None:
+            return None
+
+        return self.sources[0].path(self.meet_id)[::-1] + self.sources[1].path(self.meet_id)[1:]
@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from sp_lru_cache import SpLruCache
+from sp_metrics import enable_logging, get_logger, metrics
+from sp_scrapper import SpScrapper
+from sp_scrapper_cache import SpScrapperCache
+from sp_search import SpSearchPolicy
+
+logger = get_logger('service')
+
+
+class SpQueryError(Exception):
+    """
+    Raised for invalid query parameters. Answered with HTTP 400.
+    """
+
+    pass
+
+
+class SpUnknownEndpoint(Exception):
+    """
+    Raised for paths which are not served. Answered with HTTP 404.
+    """
+
+    pass
+
+
+class SpQueryService:
+    """
+    Long-running asyncio HTTP service answering search, expansion and path queries with json.
+
+    All requests share one SpScrapperCache, so level 1 and level 2 caches stay warm between queries.
+    Crawls run in a thread pool. Identical queries running at the same time are answered by a single crawl,
+    and results are remembered for result_ttl seconds.
+
+    The cache is the graph store shared by concurrent queries: overlapping crawls read the people and companies
+    fetched by each other from level 1 cache, and concurrent fetches of the same item are coalesced there.
+    Every query still builds its own SpGraph of the result from it, as SpGraph is not safe to grow from
+    many threads and its found paths and 'exact' flag belong to a single query.
+
+    Endpoints (GET, query string parameters):
+        /search?q=<query>[&type=person|company]
+        /person?id=<id>&slug=<slug>[&distance=<n>]
+        /company?id=<id>&slug=<slug>[&distance=<n>]
+        /path?id1=<id>&slug1=<slug>&id2=<id>&slug2=<slug>[&distance=<n>][&max_api_calls=<n>][&graph=1]
+        /stats
+        /metrics (Prometheus text format)
+    """
+
+    MAX_REQUEST_LINE = 8192
+
+    def __init__(self, sp_scrapper_cache: SpScrapperCache, workers=8, scrapper_workers=1, max_distance=4,
+                 result_cache_items=1000, result_ttl=300.0):
+        """
+        :param sp_scrapper_cache: cache shared by all queries
+        :param workers: number of queries crawling at the same time
+        :param scrapper_workers: number of concurrent fetches per BFS layer of a single query, see SpScrapper
+        :param max_distance: maximal distance a query can ask for
+        :param result_cache_items: number of remembered query results
+        :param result_ttl: seconds a query result is served without crawling again, None to disable result caching
+        """
+
+        self.sp_scrapper_cache = sp_scrapper_cache
+        self.sp_scrapper = SpScrapper(sp_scrapper_cache, scrapper_workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_distance = max_distance
+        self.result_ttl = result_ttl
+
+        # query key -> (expiry, json result); query key -> asyncio.Future of a running query
+        self.results = SpLruCache(result_cache_items)
+        self.queries_in_flight = {}
+
+        self.routes = {
+            '/search': self.__search,
+            '/person': self.__person,
+            '/company': self.__company,
+            '/path': self.__path
+        }
+
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """
+        Starts listening.
+
+        :param host: interface to listen on
+        :param port: port to listen on, 0 for any free port
+        :return: (host, port) tuple the service listens on
+        """
+
+        self.server = await asyncio.start_server(self.__handle_connection, host, port)
+        address = self.server.sockets[0].getsockname()[:2]
+        logger.info('Listening on http://%s:%s/', *address)
+        return address
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        """
+        Listens until cancelled.
+
+        :param host: interface to listen on
+        :param port: port to listen on
+        """
+
+        await self.start(host, port)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+        self.executor.shutdown(wait=False)
+
+    async def query(self, path, params):
+        """
+        Answers a query. Runs the crawl in the thread pool unless the result is remembered or already running.
+
+        :param path: endpoint path, e.g. '/person'
+        :param params: dictionary of query string parameters
+        :return: json result
+        :raise SpUnknownEndpoint: if the path is not served
+        :raise SpQueryError: if the parameters are invalid
+        """
+
+        if path == '/stats':
+            return self.__stats()
+
+        route = self.routes.get(path)
+        if route is None:
+            raise SpUnknownEndpoint('Unknown endpoint %s.' % path)
+
+        key = (path, tuple(sorted(params.items())))
+
+        remembered = self.results.get(key)
+        if remembered is not None and time.monotonic() < remembered[0]:
+            metrics.inc('sp_service_results_total', endpoint=path, result='remembered')
+            return remembered[1]
+
+        future = self.queries_in_flight.get(key)
+        if future is not None:
+            metrics.inc('sp_service_results_total', endpoint=path, result='coalesced')
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.queries_in_flight[key] = future
+
+        try:
+            with metrics.timer('sp_service_query_seconds', endpoint=path):
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, route, params)
+
+            if self.result_ttl is not None:
+                self.results[key] = (time.monotonic() + self.result_ttl, result)
+
+            metrics.inc('sp_service_results_total', endpoint=path, result='computed')
+            future.set_result(result)
+            return result
+        except Exception as ex:
+            future.set_exception(ex)
+            # the exception is raised below, followers retrieve it from the future
+            future.exception()
+            raise
+        finally:
+            del self.queries_in_flight[key]
+
+    async def __handle_connection(self, reader, writer):
+        """
+        Serves HTTP/1.1 requests of a single connection until the client closes it.
+        """
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                if 'content-length' in headers:
+                    await reader.readexactly(int(headers['content-length']))
+
+                status, content_type, body = await self.__respond(request_line)
+                keep_alive = headers.get('connection', '').lower() != 'close' and request_line.rstrip().endswith(b'1.1')
+
+                writer.write(('HTTP/1.1 %s\r\n'
+                              'Content-Type: %s\r\n'
+                              'Content-Length: %s\r\n'
+                              'Connection: %s\r\n\r\n' % (status, content_type, len(body),
+                                                          'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+                writer.write(body)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def __respond(self, request_line):
+        """
+        :param request_line: HTTP request line bytes
+        :return: Tuple of HTTP status, content type and body bytes.
+        """
+
+        parts = request_line.decode('latin-1').split()
+
+        if len(request_line) > self.MAX_REQUEST_LINE or len(parts) != 3:
+            return '400 Bad Request', 'application/json', self.__error('Malformed request.')
+
+        method, target, _ = parts
+        if method != 'GET':
+            return '405 Method Not Allowed', 'application/json', self.__error('Only GET is supported.')
+
+        url = urlsplit(target)
+
+        if url.path == '/metrics':
+            return '200 OK', 'text/plain; version=0.0.4', metrics.to_prometheus().encode('utf-8')
+
+        try:
+            result = await self.query(url.path, dict(parse_qsl(url.query)))
+        except SpUnknownEndpoint as ex:
+            return '404 Not Found', 'application/json', self.__error(str(ex))
+        except SpQueryError as ex:
+            return '400 Bad Request', 'application/json', self.__error(str(ex))
+        except Exception as ex:
+            logger.exception('%s failed.', target)
+            return '500 Internal Server Error', 'application/json', self.__error(str(ex))
+
+        return '200 OK', 'application/json', json.dumps(result, ensure_ascii=False).encode('utf-8')
+
+    def __search(self, params):
+        query = self.__param(params, 'q')
+        return {'results': self.sp_scrapper_cache.search(query, params.get('type'))}
+
+    def __person(self, params):
+        person_ref = self.__person_ref(params, 'id', 'slug')
+        return self.sp_scrapper.expand_person(person_ref, self.__distance(params, 1)).to_json()
+
+    def __company(self, params):
+        company_ref = {'id': self.__param(params, 'id'), 'slug': self.__param(params, 'slug')}
+        graph = self.sp_scrapper.expand_company(company_ref, self.__distance(params, 1))
+
+        if graph is None:
+            raise SpQueryError('Company %s not found.' % company_ref['id'])
+
+        return graph.to_json()
+
+    def __path(self, params):
+        person_ref_1 = self.__person_ref(params, 'id1', 'slug1')
+        person_ref_2 = self.__person_ref(params, 'id2', 'slug2')
+        policy = None
+        if 'max_api_calls' in params:
+            policy = SpSearchPolicy(max_api_calls=self.__param(params, 'max_api_calls', number=True))
+
+        graph = self.sp_scrapper.find_path(person_ref_1, person_ref_2, self.__distance(params, 3), policy)
+        paths = graph.path_json()
+
+        result = {'found': len(paths) > 0, 'paths': paths, 'exact': graph.exact}
+        if params.get('graph') == '1':
+            result['graph'] = graph.to_json()
+
+        return result
+
+    def __stats(self):
+        return {
+            'cache': self.sp_scrapper_cache.stats(),
+            'results': self.results.stats(),
+            'queries_in_flight': len(self.queries_in_flight)
+        }
+
+    def __person_ref(self, params, id_param, slug_param):
+        """
+        :return: person_ref with name and birth year, which identify people in the graph
+        """
+
+        person_ref = {'id': self.__param(params, id_param), 'slug': self.__param(params, slug_param)}
+        resolved = self.sp_scrapper_cache.resolve_person_ref(person_ref)
+
+        if resolved is None:
+            raise SpQueryError('Person %s not found.' % person_ref['id'])
+
+        return resolved
+
+    def __distance(self, params, default):
+        distance = self.__param(params, 'distance', str(default), number=True)
+
+        if distance > self.max_distance:
+            raise SpQueryError('Distance has to be between 0 and %s.' % self.max_distance)
+
+        return distance
+
+    @staticmethod
+    def __param(params, name, default=None, number=False):
+        """
+        :param params: dictionary of query string parameters
+        :param name: parameter name
+        :param default: value of a missing parameter, None if it is required
+        :param number: True to parse a non-negative integer
+        :return: Parameter value.
+        """
+
+        value = params.get(name, default)
+
+        if value is None or value == '':
+            raise SpQueryError('Missing parameter %s.' % name)
+
+        if number:
+            if not value.isdigit():
+                raise SpQueryError('Parameter %s has to be a number.' % name)
+
+            return int(value)
+
+        return value
+
+    @staticmethod
+    def __error(message):
+        return json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves search, expansion and path queries over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--api-url', default='https://sprawdz.biz/api/')
+    parser.add_argument('--couchdb-url', default=None)
+    parser.add_argument('--couchdb-name', default='sp')
+    parser.add_argument('--sqlite-path', default='sp.sqlite')
+    parser.add_argument('--index-path', default=None, help='local name search index')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--scrapper-workers', type=int, default=4)
+    parser.add_argument('--cache-max-items', type=int, default=None)
+    parser.add_argument('--result-ttl', type=float, default=300.0)
+    parser.add_argument('--watch-changes', action='store_true', help='evict entries changed by other processes')
+    args = parser.parse_args()
+    enable_logging()
+
+    from sp_rest_client import SpRestClient
+
+    scrapper_cache = SpScrapperCache(SpRestClient(args.api_url), cache_max_items=args.cache_max_items)
+
+    if args.couchdb_url is not None:
+        import couchdb
+        from sp_storage import SpCouchStorage
+
+        scrapper_cache.init_storage(SpCouchStorage(couchdb.Server(args.couchdb_url)[args.couchdb_name]))
+    else:
+        scrapper_cache.init_sqlite(args.sqlite_path)
+
+    if args.index_path is not None:
+        scrapper_cache.init_name_index(args.index_path)
+
+    if args.watch_changes:
+        scrapper_cache.watch_changes()
+
+    service = SpQueryService(scrapper_cache, args.workers, args.scrapper_workers, result_ttl=args.result_ttl)
+
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scrapper_cache.flush()
@@ -0,0 +1,133 @@
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from sp_metrics import get_logger, metrics
+from sp_scrapper_cache import SpScrapperCache
+
+logger = get_logger('shard_pool')
+
+# SpScrapperCache of a worker process, created by SpShardPool cache_factory
+_worker_cache = None
+_worker_threads = 1
+
+
+def _init_worker(cache_factory, threads):
+    global _worker_cache, _worker_threads
+
+    _worker_cache = cache_factory()
+    _worker_threads = threads
+
+
+def _fetch(kind, refs):
+    """
+    Fetches refs in a worker process and writes them to the shared level 2 cache.
+
+    :param kind: 'person' or 'company'
+    :param refs: list of *_refs of a single shard
+    :return: Tuple of list of * json objects or None, and number of API calls made.
+    """
+
+    api_calls = _worker_cache.api_calls
+
+    if kind == 'person':
+        fetch_method = _worker_cache.get_person_by_ref
+        _worker_cache.preload_persons(refs)
+    else:
+        fetch_method = _worker_cache.get_company_by_ref
+        _worker_cache.preload_companies(refs)
+
+    if _worker_threads > 1 and len(refs) > 1:
+        with ThreadPoolExecutor(max_workers=min(_worker_threads, len(refs))) as executor:
+            items = list(executor.map(fetch_method, refs))
+    else:
+        items = [fetch_method(ref) for ref in refs]
+
+    _worker_cache.flush()
+    return items, _worker_cache.api_calls - api_calls
+
+
+class SpShardPool:
+    """
+    Pool of worker processes fetching people and companies for SpScrapper, so that a crawl uses many cores
+    and connection pools. The crawl itself and its graph stay in the coordinating process.
+
+    Every worker has its own SpScrapperCache sharing one level 2 cache backend, e.g. CouchDB or SQLite file.
+    Entities are sharded by id, so an entity is always fetched by the same worker and no two workers fetch it twice.
+    Fetched documents are written to level 2 cache by the workers and handed back to the coordinator's level 1 cache.
+    """
+
+    def __init__(self, cache_factory, processes=4, threads=4, batch_size=50):
+        """
+        :param cache_factory: picklable callable creating worker SpScrapperCache with level 2 cache initialized,
+        e.g. a module level function
+        :param processes: number of worker processes (shards)
+        :param threads: number of concurrent fetches within a worker
+        :param batch_size: number of refs sent to a worker at once
+        """
+
+        self.batch_size = batch_size
+        self.shards = [ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(cache_factory, threads))
+                       for _ in range(processes)]
+
+    def fetch_missing(self, sp_scrapper_cache: SpScrapperCache, refs, items, kind):
+        """
+        Fetches refs not found in the coordinator's cache and puts them into its level 1 cache.
+
+        :param sp_scrapper_cache: coordinator's cache
+        :param refs: list of *_refs
+        :param items: list of * json objects already cached, None for missing ones, e.g. preload_* result
+        :param kind: 'person' or 'company'
+        :return: list of * json objects, None for refs that cannot be expanded
+        """
+
+        missing = {}
+        for ref, item in zip(refs, items):
+            if item is None and ref.get('id') is not None:
+                missing.setdefault(ref['id'], ref)
+
+        if len(missing) == 0:
+            return items
+
+        with metrics.timer('sp_shard_fetch_seconds', kind=kind):
+            fetched, api_calls = self.__fetch(list(missing.values()), kind)
+
+        sp_scrapper_cache.warm(kind, fetched, api_calls)
+        metrics.inc('sp_shard_fetches_total', len(fetched), kind=kind)
+        logger.debug('Fetched %s %s refs in %s shards with %s API calls.', len(fetched), kind, len(self.shards), api_calls)
+
+        return [fetched.get(ref.get('id')) if item is None else item for ref, item in zip(refs, items)]
+
+    def close(self):
+        for shard in self.shards:
+            shard.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __fetch(self, refs, kind):
+        """
+        :param refs: list of *_refs with unique ids
+        :param kind: 'person' or 'company'
+        :return: Tuple of dictionary of * json objects or None by id, and number of API calls made.
+        """
+
+        shard_refs = [[] for _ in self.shards]
+        for ref in refs:
+            shard_refs[zlib.crc32(str(ref['id']).encode()) % len(self.shards)].append(ref)
+
+        futures = [(batch, shard.submit(_fetch, kind, batch))
+                   for shard, refs in zip(self.shards, shard_refs)
+                   for batch in (refs[i:i + self.batch_size] for i in range(0, len(refs), self.batch_size))]
+
+        fetched = {}
+        api_calls = 0
+
+        for batch, future in futures:
+            items, batch_api_calls = future.result()
+            api_calls += batch_api_calls
+            fetched.update((ref['id'], item) for ref, item in zip(batch, items))
+
+        return fetched, api_calls
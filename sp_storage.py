@@ -0,0 +1,393 @@
+import argparse
+import calendar
+import sqlite3
+import threading
+import time
+
+from sp_metrics import enable_logging, get_logger
+from sp_projection import dumps, loads
+
+logger = get_logger('storage')
+
+
+class SpStorage:
+    """
+    Level 2 cache storage interface. Stores json documents keyed by their '_id' (p_<id> or c_<id>).
+    """
+
+    def get(self, doc_id):
+        """
+        Returns single document.
+
+        :param doc_id: document '_id'
+        :return: document json object or None if it does not exist
+        """
+
+        found = self.get_many([doc_id])
+        return found.get(doc_id)
+
+    def get_many(self, doc_ids):
+        """
+        Returns many documents at once.
+
+        :param doc_ids: list of document '_id's
+        :return: dictionary of found documents by their '_id'
+        """
+
+        raise NotImplementedError()
+
+    def put_many(self, docs):
+        """
+        Creates or replaces many documents at once.
+
+        :param docs: list of json objects with '_id' set
+        :return: list of (doc_id, error) tuples for documents which could not be written
+        """
+
+        raise NotImplementedError()
+
+    def __iter__(self):
+        """
+        Iterates over all stored documents.
+
+        :return: generator of document json objects
+        """
+
+        raise NotImplementedError()
+
+    def stale_ids(self, before):
+        """
+        Returns documents fetched from the API, or checked by SpCacheRefresher, before some time.
+        Uses the later of their 'timestamp' and their check time, see mark_checked.
+
+        :param before: UNIX time
+        :return: list of document '_id's, the stalest first, documents without timestamp before all others
+        """
+
+        raise NotImplementedError()
+
+    def mark_checked(self, doc_ids, checked=None):
+        """
+        Records the time documents were checked against the API. Check times are kept apart from the documents,
+        so checking a document does not write it, nor show it in the changes feed.
+
+        :param doc_ids: list of document '_id's
+        :param checked: UNIX time, None for now
+        """
+
+        raise NotImplementedError()
+
+    def changes(self, since=None, timeout=10.0):
+        """
+        Returns documents written since some point, by any process sharing the storage.
+        Waits for the first change up to timeout.
+
+        :param since: sequence returned by the previous call, None to get the current sequence without waiting
+        :param timeout: seconds to wait for changes
+        :return: Tuple of list of (doc_id, revision or None) tuples and sequence to continue from.
+        """
+
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Releases storage resources.
+        """
+
+        pass
+
+
+class SpCouchStorage(SpStorage):
+    """
+    CouchDB storage. Uses _all_docs for bulk reads and _bulk_docs for bulk writes.
+    """
+
+    # view of documents by UNIX time of their 'timestamp', documents without timestamp first
+    DESIGN_DOC = {
+        '_id': '_design/sp',
+        'views': {
+            'by_timestamp': {
+                'map': 'function (doc) {'
+                       '  var t = doc.timestamp;'
+                       '  emit(t ? Date.UTC(t[0], t[1] - 1, t[2], t[3], t[4], t[5]) / 1000 : null, null);'
+                       '}'
+            }
+        }
+    }
+
+    # check times are kept in _local documents, which are neither replicated nor in views and the changes feed
+    CHECKED_PREFIX = '_local/checked_'
+
+    def __init__(self, couch_db, iter_batch_size=1000):
+        """
+        :param couch_db: couchdb.Database object
+        :param iter_batch_size: number of documents fetched per request while iterating the database
+        """
+
+        self.couch_db = couch_db
+        self.iter_batch_size = iter_batch_size
+
+    def get(self, doc_id):
+        return self.couch_db.get(doc_id)
+
+    def get_many(self, doc_ids):
+        rows = self.couch_db.view('_all_docs', keys=list(doc_ids), include_docs=True)
+        return {row.key: row.doc for row in rows if row.doc is not None}
+
+    def put_many(self, docs):
+        return [(doc_id, ex)
+                for success, doc_id, ex in self.couch_db.update(docs)
+                if not success]
+
+    def __iter__(self):
+        for row in self.couch_db.iterview('_all_docs', self.iter_batch_size, include_docs=True):
+            if not row.id.startswith('_design/'):
+                yield row.doc
+
+    def stale_ids(self, before):
+        design_doc = self.couch_db.get(self.DESIGN_DOC['_id'])
+        if design_doc is None or design_doc.get('views') != self.DESIGN_DOC['views']:
+            self.couch_db.save(dict(self.DESIGN_DOC, **({} if design_doc is None else {'_rev': design_doc['_rev']})))
+
+        checks = {row.id[len(self.CHECKED_PREFIX):]: row.doc['checked']
+                  for row in self.couch_db.view('_local_docs', include_docs=True,
+                                                startkey=self.CHECKED_PREFIX, endkey=self.CHECKED_PREFIX + '\ufff0')
+                  if row.doc is not None}
+
+        # a document is stale only if its timestamp is, so the view is read up to the time
+        return stale_order(((row.id, row.key, checks.get(row.id))
+                            for row in self.couch_db.iterview('sp/by_timestamp', self.iter_batch_size,
+                                                              endkey=before, inclusive_end=False)),
+                           before)
+
+    def mark_checked(self, doc_ids, checked=None):
+        checked = time.time() if checked is None else checked
+        local_ids = [self.CHECKED_PREFIX + doc_id for doc_id in doc_ids]
+
+        revs = {row.id: row.value['rev']
+                for row in self.couch_db.view('_local_docs', keys=local_ids)
+                if isinstance(row.value, dict)}
+
+        self.couch_db.update([dict({'_id': local_id, 'checked': checked},
+                                   **({'_rev': revs[local_id]} if local_id in revs else {}))
+                              for local_id in local_ids])
+
+    def changes(self, since=None, timeout=10.0):
+        if since is None:
+            return [], self.couch_db.changes(since='now')['last_seq']
+
+        result = self.couch_db.changes(feed='longpoll', since=since, timeout=int(timeout * 1000))
+        return [(row['id'], row['changes'][-1]['rev'] if len(row.get('changes', [])) > 0 else None)
+                for row in result['results']
+                if not row['id'].startswith('_design/')], result['last_seq']
+
+
+class SpSqliteStorage(SpStorage):
+    """
+    Embedded SQLite storage. Documents are kept as json text in a table indexed by '_id'.
+    Writes are numbered in a changes table, which other processes poll as the changes feed.
+    Check times of SpCacheRefresher are kept in a checks table, outside of the documents and the changes feed.
+    Full scans read the table in batches ordered by '_id' and hold the lock only while a batch is read,
+    so the scanned rows are never all in memory and writers are not blocked until the scan ends.
+    """
+
+    # SQLite limits number of bound parameters in a single statement
+    MAX_PARAMS = 900
+
+    def __init__(self, path='sp.sqlite', poll_interval=0.5, iter_batch_size=1000):
+        """
+        :param path: database file path
+        :param poll_interval: seconds between changes table reads while waiting for changes
+        :param iter_batch_size: number of rows read at once while scanning the database
+        """
+
+        self.path = path
+        self.poll_interval = poll_interval
+        self.iter_batch_size = iter_batch_size
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, doc TEXT NOT NULL) WITHOUT ROWID')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS changes (id TEXT PRIMARY KEY, seq INTEGER NOT NULL) WITHOUT ROWID')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS changes_seq ON changes (seq)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS checks (id TEXT PRIMARY KEY, checked REAL NOT NULL) WITHOUT ROWID')
+        self.connection.commit()
+
+    def get(self, doc_id):
+        with self.lock:
+            row = self.connection.execute('SELECT doc FROM docs WHERE id = ?', (doc_id,)).fetchone()
+
+        return None if row is None else loads(row[0])
+
+    def get_many(self, doc_ids):
+        doc_ids = list(doc_ids)
+        found = {}
+
+        with self.lock:
+            for i in range(0, len(doc_ids), self.MAX_PARAMS):
+                chunk = doc_ids[i:i + self.MAX_PARAMS]
+                rows = self.connection.execute('SELECT id, doc FROM docs WHERE id IN (%s)' % ','.join('?' * len(chunk)),
+                                               chunk)
+                for doc_id, doc in rows:
+                    found[doc_id] = loads(doc)
+
+        return found
+
+    def put_many(self, docs):
+        rows = [(doc['_id'], dumps({k: v for k, v in doc.items() if k != '_rev'}))
+                for doc in docs]
+
+        with self.lock:
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO docs (id, doc) VALUES (?, ?)', rows)
+
+                # the write above locks the database, so sequence numbers of concurrent writers do not collide
+                seq = self.connection.execute('SELECT IFNULL(MAX(seq), 0) FROM changes').fetchone()[0]
+                self.connection.executemany('INSERT OR REPLACE INTO changes (id, seq) VALUES (?, ?)',
+                                            [(doc_id, seq + i + 1) for i, (doc_id, _) in enumerate(rows)])
+
+        return []
+
+    def __iter__(self):
+        for _, doc in self.__scan('doc'):
+            yield loads(doc)
+
+    def stale_ids(self, before):
+        return stale_order(((doc_id, None if timestamp is None else fetch_time(loads(timestamp)), checked)
+                            for doc_id, timestamp, checked in self.__scan("json_extract(doc, '$.timestamp'), "
+                                                                          "(SELECT checked FROM checks "
+                                                                          "WHERE checks.id = docs.id)")),
+                           before)
+
+    def mark_checked(self, doc_ids, checked=None):
+        checked = time.time() if checked is None else checked
+
+        with self.lock:
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO checks (id, checked) VALUES (?, ?)',
+                                            [(doc_id, checked) for doc_id in doc_ids])
+
+    def changes(self, since=None, timeout=10.0):
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self.lock:
+                if since is None:
+                    return [], self.connection.execute('SELECT IFNULL(MAX(seq), 0) FROM changes').fetchone()[0]
+
+                rows = self.connection.execute('SELECT id, seq FROM changes WHERE seq > ? ORDER BY seq',
+                                               (since,)).fetchall()
+
+            if len(rows) > 0:
+                return [(doc_id, None) for doc_id, _ in rows], rows[-1][1]
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], since
+
+            time.sleep(min(self.poll_interval, remaining))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __scan(self, columns):
+        """
+        Reads all rows of the docs table in batches of iter_batch_size rows.
+
+        :param columns: SQL expressions selected after the id column
+        :return: generator of (id, *columns) tuples ordered by id
+        """
+
+        last_id = ''
+
+        while True:
+            with self.lock:
+                rows = self.connection.execute('SELECT id, %s FROM docs WHERE id > ? ORDER BY id LIMIT ?' % columns,
+                                               (last_id, self.iter_batch_size)).fetchmany(self.iter_batch_size)
+
+            yield from rows
+
+            if len(rows) < self.iter_batch_size:
+                return
+
+            last_id = rows[-1][0]
+
+
+def fetch_time(timestamp):
+    """
+    :param timestamp: document 'timestamp', a time.gmtime() list
+    :return: UNIX time
+    """
+
+    return calendar.timegm(tuple(timestamp[:6]))
+
+
+def stale_order(rows, before):
+    """
+    Orders documents by the later of their fetch and check times.
+
+    :param rows: iterable of (doc_id, UNIX fetch time or None, UNIX check time or None) tuples
+    :param before: UNIX time, documents fetched or checked later are left out
+    :return: list of document '_id's, the stalest first, documents without timestamp before all others
+    """
+
+    stale = []
+
+    for doc_id, fetched, checked in rows:
+        if fetched is None:
+            fetched = float('-inf')
+        elif checked is not None:
+            fetched = max(fetched, checked)
+
+        if fetched < before:
+            stale.append((fetched, doc_id))
+
+    return [doc_id for _, doc_id in sorted(stale)]
+
+
+def migrate(source: SpStorage, target: SpStorage, batch_size=1000):
+    """
+    Copies all documents from one storage to another.
+
+    :param source: storage to read documents from
+    :param target: storage to write documents to
+    :param batch_size: number of documents written at once
+    :return: number of copied documents
+    """
+
+    count = 0
+    batch = []
+
+    for doc in source:
+        batch.append(doc)
+
+        if len(batch) >= batch_size:
+            count += len(batch) - len(target.put_many(batch))
+            batch = []
+            logger.info('Migrated %s documents.', count)
+
+    if len(batch) > 0:
+        count += len(batch) - len(target.put_many(batch))
+
+    logger.info('Migrated %s documents.', count)
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Imports CouchDB level 2 cache database into SQLite storage.')
+    parser.add_argument('--couchdb-url', default='http://localhost:5984/')
+    parser.add_argument('--couchdb-name', default='sp')
+    parser.add_argument('--sqlite-path', default='sp.sqlite')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    enable_logging()
+
+    import couchdb
+
+    couch_storage = SpCouchStorage(couchdb.Server(args.couchdb_url)[args.couchdb_name], args.batch_size)
+    sqlite_storage = SpSqliteStorage(args.sqlite_path)
+
+    migrate(couch_storage, sqlite_storage, args.batch_size)
+    sqlite_storage.close()
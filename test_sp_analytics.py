@@ -0,0 +1,138 @@
+import json
+
+import networkx as nx
+import numpy as np
+import pytest
+from networkx.algorithms import bipartite
+
+from sp_analytics import SpAnalytics
+from sp_scrapper import SpScrapper
+
+
+@pytest.fixture(scope='module')
+def analytics(full_index):
+    return SpAnalytics.from_index(full_index)
+
+
+@pytest.fixture
+def crawled(make_cache, person_refs):
+    """
+    :return: Tuple of crawled SpGraph and its networkx graph of node ids.
+    """
+
+    graph = SpScrapper(make_cache()).expand_person(person_refs(1, seed=0)[0], 2)
+    nx_graph = nx.relabel_nodes(graph.nx_graph, {graph.node_key(node_id): node_id
+                                                 for node_id in range(len(graph.natural_keys))})
+    return graph, nx_graph
+
+
+def test_from_index(analytics, full_index, full_nx_graph):
+    assert analytics.keys == list(full_index.nodes)
+    assert analytics.adjacency.nnz == 2 * full_nx_graph.number_of_edges()
+    assert list(analytics.degree()) == [full_nx_graph.degree(node_id) for node_id in full_nx_graph]
+    assert all(analytics.is_person[node_id] == doc_id.startswith('p_') for node_id, doc_id in enumerate(analytics.keys))
+
+
+def test_from_graph(crawled):
+    graph, nx_graph = crawled
+    analytics = SpAnalytics.from_graph(graph)
+
+    assert analytics.keys == [graph.node_key(node_id) for node_id in range(len(graph.natural_keys))]
+    assert list(analytics.degree()) == [nx_graph.degree(node_id) for node_id in range(len(graph.natural_keys))]
+    assert list(analytics.persons) == [node_id for node_id in nx_graph if graph.kinds[node_id] == graph.PERSON]
+
+
+def test_components_match_networkx(analytics, full_nx_graph):
+    count, components = analytics.components()
+    expected = list(nx.connected_components(full_nx_graph))
+
+    assert count == len(expected)
+    assert {frozenset(np.flatnonzero(components == component)) for component in range(count)} == \
+        {frozenset(component) for component in expected}
+
+
+def test_pagerank_matches_networkx(analytics, full_nx_graph):
+    rank = analytics.pagerank()
+    expected = nx.pagerank(full_nx_graph, alpha=0.85, tol=1e-6)
+
+    assert rank.sum() == pytest.approx(1.0)
+    assert np.allclose(rank, [expected[node_id] for node_id in full_nx_graph], atol=1e-5)
+
+
+def test_empty_graph():
+    analytics = SpAnalytics(np.zeros((0, 0)), np.zeros(0, dtype=bool), [], [])
+
+    assert len(analytics.pagerank()) == 0
+    assert analytics.modularity(np.zeros(0, dtype=int)) == 0.0
+    assert analytics.summary()['components'] == 0
+
+
+def test_betweenness_matches_networkx(crawled):
+    graph, nx_graph = crawled
+    analytics = SpAnalytics.from_graph(graph)
+    expected = nx.betweenness_centrality(nx_graph)
+    expected = np.array([expected[node_id] for node_id in range(len(graph.natural_keys))])
+
+    assert np.allclose(analytics.betweenness(batch_size=7), expected)
+    assert np.allclose(analytics.betweenness(samples=len(expected) + 1), expected)
+    assert np.allclose(analytics.betweenness(normalized=False),
+                       [value for _, value in sorted(nx.betweenness_centrality(nx_graph, normalized=False).items())])
+
+    # sampled sources estimate the exact values
+    sampled = analytics.betweenness(samples=len(expected) // 2, seed=1)
+    assert np.corrcoef(sampled, expected)[0, 1] > 0.8
+
+
+def test_projection_matches_networkx(crawled):
+    graph, nx_graph = crawled
+    analytics = SpAnalytics.from_graph(graph)
+    persons = list(analytics.persons)
+    projection = analytics.projection().tocoo()
+
+    expected = bipartite.weighted_projected_graph(nx_graph, persons)
+    assert {(persons[row], persons[col], value) for row, col, value in
+            zip(projection.row, projection.col, projection.data) if row < col} == \
+        {(min(a, b), max(a, b), data['weight']) for a, b, data in expected.edges(data=True)}
+
+    # boards larger than max_board are left out
+    max_board = int(analytics.degree()[analytics.companies].max()) - 1
+    small = nx_graph.subgraph(persons + [company_id for company_id in analytics.companies
+                                         if nx_graph.degree(company_id) <= max_board])
+    limited = analytics.projection(max_board)
+    assert 0 < limited.nnz < projection.nnz
+    assert limited.nnz == 2 * bipartite.projected_graph(small, persons).number_of_edges()
+
+
+def test_communities_and_modularity(analytics, full_nx_graph):
+    communities = analytics.communities()
+    sizes = np.bincount(communities)
+
+    assert len(communities) == len(full_nx_graph)
+    assert list(sizes) == sorted(sizes, reverse=True)
+
+    # communities never span components
+    _, components = analytics.components()
+    assert all(len(set(components[communities == community])) == 1 for community in range(len(sizes)))
+
+    partition = [set(np.flatnonzero(communities == community)) for community in range(len(sizes))]
+    assert analytics.modularity(communities) == pytest.approx(nx.community.modularity(full_nx_graph, partition))
+    assert analytics.modularity(communities) > 0.5
+    assert analytics.modularity(np.zeros(len(communities), dtype=int)) == pytest.approx(0.0)
+
+
+def test_top_and_summary(analytics, full_index):
+    degree = analytics.degree()
+    top = analytics.top(degree, 5, 'company')
+
+    assert [entry['score'] for entry in top] == sorted(degree[analytics.companies], reverse=True)[:5]
+    assert all(entry['key'].startswith('c_') for entry in top)
+    assert analytics.top(degree, 3)[0]['score'] == degree.max()
+
+    summary = analytics.summary(k=3, betweenness_samples=64)
+    json.dumps(summary)
+
+    assert summary['persons'] + summary['companies'] == len(full_index.nodes)
+    assert summary['relations'] == analytics.adjacency.nnz // 2
+    assert summary['largest_components'][0] == np.bincount(analytics.components()[1]).max()
+    assert len(summary['top_pagerank_persons']) == 3
+    assert all(entry['key'].startswith('p_') for entry in summary['top_betweenness_persons'])
@@ -0,0 +1,114 @@
+import json
+import os
+import random
+
+import pytest
+import urllib3
+
+from sp_benchmark import SpBenchmark, SpStandInServer, SpSyntheticWorld, compare
+from sp_rest_client import SpRestClient
+
+
+def test_world_is_deterministic():
+    world_1 = SpSyntheticWorld(500, 200, seed=3)
+    world_2 = SpSyntheticWorld(500, 200, seed=3)
+
+    assert world_1.company_persons == world_2.company_persons
+    assert world_1.company_roles == world_2.company_roles
+    assert [world_1.person(id) for id in range(500)] == [world_2.person(id) for id in range(500)]
+    assert SpSyntheticWorld(500, 200, seed=4).company_persons != world_1.company_persons
+
+    with pytest.raises(Exception):
+        SpSyntheticWorld(10 ** 8, 10)
+
+
+def test_world_documents_agree(world):
+    assert len({(info['name'], info['birthYear']) for info in map(world.person_info, range(world.persons))}) == \
+        world.persons
+    assert sum(len(world.person(id)['companies']) for id in range(world.persons)) == world.relations()
+
+    for company_id in range(0, world.companies, 37):
+        company = world.company(company_id)
+        members = company['representation'] + company['directorsBoard']
+
+        for person_ref in members:
+            person = world.person(int(person_ref['id']))
+            assert person['information'] == {k: v for k, v in person_ref.items() if k != 'type'}
+            assert company_id in [int(company_ref['id']) for company_ref in person['companies']]
+
+    assert world.person(world.persons) is None
+    assert world.company(-1) is None
+
+
+def test_world_search(world):
+    person_info = world.person_info(1234)
+    company_info = world.company_info(56)
+
+    assert dict(person_info, type='person') in world.search(person_info['name'])
+    assert all(result['name'] == person_info['name'] for result in world.search(person_info['name']))
+    for number in [company_info['krs'], company_info['nip'], company_info['regon']]:
+        assert world.search(number) == [dict(company_info, type='company')]
+    assert world.search('Nobody Known') == []
+
+
+def test_missing_people():
+    world = SpSyntheticWorld(1000, 300, missing_rate=0.3)
+    missing = sum(world.person(id) is None for id in range(1000))
+
+    assert 200 < missing < 400
+    assert all(world.person(int(world.random_person_ref(random.Random(i))['id'])) is not None
+               for i in range(20))
+
+
+def test_stand_in_server_serves_the_world(world, server):
+    client = SpRestClient(server.url)
+    requests = server.requests
+
+    assert client.person('12', 'x') == world.person(12)
+    assert client.company('34', 'x') == world.company(34)
+    assert client.search(world.person_info(12)['name'])[0]['id'] == '12'
+    assert server.requests == requests + 3
+
+
+@pytest.mark.parametrize('error_rate, throttle_rate, status', [(1.0, 0.0, 503), (0.0, 1.0, 429)])
+def test_stand_in_server_injects_failures(world, error_rate, throttle_rate, status):
+    http = urllib3.PoolManager()
+
+    with SpStandInServer(world, error_rate=error_rate, throttle_rate=throttle_rate) as stand_in:
+        response = http.request('POST', stand_in.url + 'person', fields={'id': '1', 'slug': 'x'}, retries=False)
+        missing = http.request('POST', stand_in.url + 'person', fields={'id': 'x', 'slug': 'x'}, retries=False)
+
+    assert response.status == status
+    assert response.headers.get('Retry-After') == ('0.1' if status == 429 else None)
+    assert missing.status == status
+
+    with SpStandInServer(world) as stand_in:
+        assert http.request('POST', stand_in.url + 'person', fields={'id': 'x'}, retries=False).status == 404
+
+
+def test_benchmark_report(world, server, tmp_path):
+    benchmark = SpBenchmark(world, server, work_dir=str(tmp_path))
+    report = benchmark.run(graph_queries=5, cache_lookups=20, scrapper_queries=2, distance=1, workers=(1, 4))
+
+    assert set(report) == {'graph', 'cache', 'scrapper_1', 'scrapper_4', 'peak_rss_bytes'}
+    assert report['graph']['nodes'] == len({key for key in range(world.persons)
+                                            if world.person_offsets[key + 1] > world.person_offsets[key]}) + \
+        world.companies
+    assert report['cache']['lookups'] == 20
+    assert report['scrapper_1']['cold_api_calls'] > 0
+    assert report['scrapper_1']['warm_api_calls'] == 0
+    assert report['scrapper_4']['warm_l1_hit_rate'] == 1.0
+    json.dumps(report)
+
+    benchmark.close()
+    assert not os.path.exists(str(tmp_path))
+
+
+def test_compare():
+    baseline = {'graph': {'build_relations_per_second': 100.0, 'path_median_seconds': 0.01, 'nodes': 10},
+                'scrapper_1': {'cold_api_calls': 10}, 'peak_rss_bytes': 100}
+
+    assert compare(baseline, baseline) == []
+    assert compare({'graph': {'build_relations_per_second': 70.0, 'path_median_seconds': 0.011, 'nodes': 20},
+                    'scrapper_1': {'cold_api_calls': 13}, 'peak_rss_bytes': 1000}, baseline) == \
+        [('graph', 'build_relations_per_second', 100.0, 70.0), ('scrapper_1', 'cold_api_calls', 10, 13)]
@@ -0,0 +1,62 @@
+import pytest
+
+from sp_checkpoint import SpCheckpoint
+from sp_scrapper import SpScrapper
+
+
+def interrupt(checkpoint, layers):
+    """
+    Leaves the crawl root and some completed layers in a checkpoint, followed by a torn layer line.
+    """
+
+    with open(checkpoint.path, 'rb') as checkpoint_file:
+        lines = checkpoint_file.readlines()
+
+    assert len(lines) > layers + 1
+
+    with open(checkpoint.path, 'wb') as checkpoint_file:
+        checkpoint_file.writelines(lines[:layers + 1])
+        checkpoint_file.write(lines[layers + 1][:len(lines[layers + 1]) // 2])
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return SpCheckpoint(str(tmp_path / 'crawl.jsonl'))
+
+
+def test_resume_explores_larger_distance(make_cache, person_refs, checkpoint, graph_contents):
+    person_ref = person_refs(1, seed=8)[0]
+    scrapper = SpScrapper(make_cache('resumed'))
+    scrapper.expand_person(person_ref, 1, checkpoint)
+
+    graph = scrapper.resume(checkpoint, 2)
+
+    assert graph_contents(graph) == graph_contents(SpScrapper(make_cache('fresh')).expand_person(person_ref, 2))
+
+
+@pytest.mark.parametrize('layers', [0, 1, 2])
+def test_resume_after_interrupted_person_crawl(make_cache, person_refs, checkpoint, layers, graph_contents):
+    person_ref = person_refs(1, seed=9)[0]
+    fresh_cache = make_cache('fresh')
+    expected = graph_contents(SpScrapper(fresh_cache).expand_person(person_ref, 3, checkpoint))
+    interrupt(checkpoint, layers)
+
+    resumed_cache = make_cache('resumed')
+    graph = SpScrapper(resumed_cache).resume(checkpoint, 3)
+
+    assert graph_contents(graph) == expected
+    assert graph_contents(checkpoint.load()[2]) == expected
+    if layers > 0:
+        # people of completed layers are restored, not fetched again
+        assert resumed_cache.api_calls < fresh_cache.api_calls
+
+
+def test_resume_after_interrupted_company_crawl(make_cache, checkpoint, graph_contents):
+    company_ref = {'id': '3', 'slug': 'x'}
+    expected = graph_contents(SpScrapper(make_cache('fresh')).expand_company(company_ref, 2, checkpoint))
+    interrupt(checkpoint, 1)
+
+    graph = SpScrapper(make_cache('resumed')).resume(checkpoint, 2)
+
+    assert graph_contents(graph) == expected
+
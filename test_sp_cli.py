@@ -0,0 +1,121 @@
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+
+import networkx as nx
+import pytest
+
+from sp_cli import SpCli, SpCliError, read_batch
+
+
+def json_lines(out):
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def cli(cache, output_format='json'):
+    return SpCli(cache, scrapper_workers=2, output_format=output_format, out=io.StringIO())
+
+
+def test_search(make_cache, world):
+    sp_cli = cli(make_cache())
+    person_info = world.person_info(12)
+    company_info = world.company_info(3)
+
+    sp_cli.search([person_info['name'], company_info['krs']])
+    results = json_lines(sp_cli.out)
+
+    assert dict(person_info, type='person', query=person_info['name']) in results
+    assert dict(company_info, type='company', query=company_info['krs']) in results
+
+    sp_cli = cli(make_cache(), 'csv')
+    sp_cli.search([person_info['name'], company_info['krs']], 'company')
+    rows = list(csv.DictReader(io.StringIO(sp_cli.out.getvalue())))
+
+    assert rows == [{'query': company_info['krs'], 'type': 'company', 'id': '3', 'slug': company_info['slug'],
+                     'name': company_info['name'], 'birthYear': '', 'krs': company_info['krs']}]
+
+
+def test_path(make_cache, world, full_index, person_refs):
+    refs = person_refs(400, seed=5)
+    person_ref_1, person_ref_2 = next((person_ref_1, person_ref_2)
+                                      for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2])
+                                      if full_index.connected(person_ref_1, person_ref_2, 2))
+    spec_1 = '%s/%s' % (person_ref_1['id'], person_ref_1['slug'])
+    spec_2 = '%s#0' % person_ref_2['name']
+
+    sp_cli = cli(make_cache())
+    sp_cli.path([(spec_1, spec_2), (spec_1, '99999999/x'), (spec_2, spec_1)], 2)
+    results = json_lines(sp_cli.out)
+
+    assert sp_cli.errors == 1
+    assert [(result['person_1'], result['person_2'], result['found']) for result in results] == \
+        [(spec_1, spec_2, True), (spec_2, spec_1, True)]
+    assert len(results[0]['path']) == len(full_index.shortest_path(person_ref_1, person_ref_2))
+    assert results[0]['path'][0]['label'] == '%s, %s' % (person_ref_1['name'], person_ref_1['birthYear'])
+
+    sp_cli = cli(make_cache(), 'csv')
+    sp_cli.path([(spec_1, spec_2)], 2)
+    row = next(csv.DictReader(io.StringIO(sp_cli.out.getvalue())))
+
+    assert row['found'] == 'True'
+    assert row['path'] == ' -> '.join(node['label'] for node in results[0]['path'])
+
+
+def test_expand(make_cache, world):
+    sp_cli = cli(make_cache())
+    sp_cli.expand(['7/x', 'Nobody Known'], 1)
+    results = json_lines(sp_cli.out)
+
+    assert sp_cli.errors == 1
+    assert [result['query'] for result in results] == ['7/x']
+    assert len(results[0]['graph']['companies']) == len(world.person(7)['companies'])
+
+    company_info = world.company_info(5)
+    sp_cli = cli(make_cache(), 'csv')
+    sp_cli.expand([company_info['krs'], '%s/x' % world.companies], 1, company=True)
+    rows = list(csv.DictReader(io.StringIO(sp_cli.out.getvalue())))
+    company = world.company(5)
+
+    assert sp_cli.errors == 1
+    assert len([row for row in rows if row['company'] == 'c_krs_' + company_info['krs']]) == \
+        len(company['representation']) + len(company['directorsBoard'])
+    assert {row['query'] for row in rows} == {company_info['krs']}
+
+
+def test_export(make_cache, tmp_path):
+    sp_cli = cli(make_cache())
+
+    sp_cli.export('7/x', 1, str(tmp_path / 'graph.graphml'))
+    sp_cli.export('5/x', 1, str(tmp_path / 'graph.gexf'), company=True)
+
+    assert nx.read_graphml(str(tmp_path / 'graph.graphml')).number_of_nodes() > 1
+    assert nx.read_gexf(str(tmp_path / 'graph.gexf')).number_of_nodes() > 1
+    assert sp_cli.errors == 0
+
+
+def test_read_batch(tmp_path):
+    (tmp_path / 'pairs.tsv').write_text('1/a\t2/b\n\nJan Nowak#1\t3/c\n', encoding='utf-8')
+    (tmp_path / 'bad.tsv').write_text('1/a\t2/b\n3/c\n', encoding='utf-8')
+
+    assert read_batch(str(tmp_path / 'pairs.tsv'), 2) == [('1/a', '2/b'), ('Jan Nowak#1', '3/c')]
+    with pytest.raises(SpCliError, match='bad.tsv:2'):
+        read_batch(str(tmp_path / 'bad.tsv'), 2)
+
+
+def test_command_line(server, world, tmp_path):
+    command = [sys.executable, 'sp_cli.py', '--api-url', server.url, '--sqlite-path', str(tmp_path / 'sp.sqlite'),
+               '--format', 'csv']
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    found = subprocess.run(command + ['search', world.person_info(12)['name']], cwd=cwd, capture_output=True,
+                           text=True, timeout=60)
+    missing = subprocess.run(command + ['path', '12/x', 'Nobody Known'], cwd=cwd, capture_output=True, text=True,
+                             timeout=60)
+
+    assert found.returncode == 0
+    assert found.stdout.splitlines()[0] == ','.join(SpCli.SEARCH_FIELDS)
+    assert missing.returncode == 1
+    assert 'Nobody Known' in missing.stderr
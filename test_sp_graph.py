@@ -0,0 +1,148 @@
+import networkx as nx
+
+from sp_graph import SpGraph
+from sp_scrapper import SpScrapper
+
+
+def person(name, birth_year='1970'):
+    return {'name': name, 'birthYear': birth_year, 'id': name.lower(), 'slug': name.lower()}
+
+
+def company(krs, name=None):
+    return {'krs': krs, 'name': name or 'Company ' + krs, 'id': krs, 'slug': krs}
+
+
+def chain():
+    """
+    :return: SpGraph of people A - B - C - D, each pair sitting on a board of one company.
+    """
+
+    graph = SpGraph()
+    people = [person(name) for name in 'ABCD']
+
+    for number, (person_1, person_2) in enumerate(zip(people, people[1:])):
+        graph.add_company(company(str(number)))
+        graph.add_company_person(company(str(number)), person_1, {'roles': ['prezes']})
+        graph.add_company_person(company(str(number)), person_2, {'roles': ['członek']})
+
+    for item in people:
+        graph.add_person(item)
+
+    return graph, people
+
+
+def test_nodes_are_interned_once():
+    graph = SpGraph()
+
+    assert graph.add_person(person('A'))
+    assert not graph.add_person(person('A'))
+    assert graph.add_company(company('1'))
+    assert not graph.add_company({'krs': '1'})
+
+    assert graph.add_company_person({'krs': '1'}, {'name': 'A', 'birthYear': '1970'})
+    assert not graph.add_company_person(company('1'), person('A'))
+    assert graph.add_company_person(company('1'), person('B'))
+
+    assert len(graph.natural_keys) == 3
+    assert graph.exist_person(person('A'))
+    # B is known only from the relation, so it has no metadata
+    assert not graph.exist_person(person('B'))
+    assert graph.neighbours(graph.get_company_id(company('1'))).tolist() == \
+        [graph.get_person_id(person('A')), graph.get_person_id(person('B'))]
+
+
+def test_keys_match_json_keys():
+    graph, people = chain()
+
+    for item in people:
+        assert graph.node_key(graph.get_person_id(item)) == SpGraph.get_person_key(item)
+
+    company_id = graph.get_company_id(company('0'))
+    assert graph.node_key(company_id) == SpGraph.get_company_key(company('0'))
+    assert graph.records[company_id].to_dict() == company('0')
+
+
+def test_shortest_path_and_found_paths():
+    graph, people = chain()
+    path = graph.shortest_path(graph.get_person_id(people[0]), graph.get_person_id(people[3]))
+
+    assert [graph.node_key(node_id) for node_id in path] == \
+        nx.shortest_path(graph.nx_graph, SpGraph.get_person_key(people[0]), SpGraph.get_person_key(people[3]))
+
+    graph.add_person(person('E'))
+    assert graph.shortest_path(graph.get_person_id(people[0]), graph.get_person_id(person('E'))) is None
+    assert not graph.person_person_path(people[0], person('E'))
+    assert graph.person_person_path(people[0], people[3])
+
+    graph_json = graph.to_json()
+    assert graph_json['paths'] == [[graph.node_key(node_id) for node_id in path]]
+    assert len(graph_json['relations']) == 6
+    assert {'company': SpGraph.get_company_key(company('0')), 'person': SpGraph.get_person_key(people[0]),
+            'roles': ['prezes']} in graph_json['relations']
+    assert [node['label'] for node in graph.path_json()[0]][:2] == ['A, 1970', 'Company 0, KRS 0']
+
+
+def test_neighbourhood_and_subgraph():
+    graph, people = chain()
+    graph.person_person_path(people[0], people[1])
+    graph.person_person_path(people[0], people[3])
+    person_id = graph.get_person_id(people[1])
+
+    neighbourhood = graph.neighbourhood([person_id], radius=2)
+    assert {graph.node_key(node_id) for node_id in neighbourhood} == \
+        set(nx.single_source_shortest_path_length(graph.nx_graph, graph.node_key(person_id), cutoff=2))
+
+    subgraph = graph.subgraph(neighbourhood)
+    assert set(subgraph.nx_graph.edges) == set(graph.nx_graph.subgraph(subgraph.nx_graph.nodes).edges)
+    assert subgraph.paths == graph.paths[:1]
+    assert subgraph.exist_person(people[0])
+
+
+def test_crawled_graph_matches_networkx(make_cache, person_refs):
+    graph = SpScrapper(make_cache()).expand_person(person_refs(1, seed=7)[0], 2)
+    nx_graph = graph.nx_graph
+
+    assert nx_graph.number_of_nodes() == len(graph.natural_keys)
+    assert nx_graph.number_of_edges() == len(graph.edge_records)
+    assert graph.nx_graph is nx_graph
+
+    source_id = 0
+    lengths = nx.single_source_shortest_path_length(nx_graph, graph.node_key(source_id))
+
+    for node_id in range(len(graph.natural_keys)):
+        path = graph.shortest_path(source_id, node_id)
+        assert len(path) - 1 == lengths[graph.node_key(node_id)]
+        assert all(graph.nx_graph.has_edge(graph.node_key(u), graph.node_key(v)) for u, v in zip(path, path[1:]))
+
+    graph.add_company_person(company('new'), person('New'))
+    assert graph.nx_graph is not nx_graph
+    assert graph.nx_graph.number_of_edges() == nx_graph.number_of_edges() + 1
+
+
+def test_person_person_paths_enumerate_simple_paths_shortest_first(make_cache, person_refs):
+    graph = SpScrapper(make_cache()).expand_person(person_refs(1, seed=9)[0], 3)
+    people = [{'name': name, 'birthYear': birth_year} for name, birth_year in graph.person_ids]
+    source = people[0]
+
+    for target in people[1:40]:
+        paths = [[key for key, _ in path] for path in graph.person_person_paths(source, target, 3)]
+        expected = nx.all_simple_paths(graph.nx_graph, SpGraph.get_person_key(source),
+                                       SpGraph.get_person_key(target), cutoff=6)
+
+        assert sorted(map(tuple, paths)) == sorted(map(tuple, expected))
+        assert list(map(len, paths)) == sorted(map(len, paths))
+        assert [[key for key, _ in path] for path in graph.person_person_paths(source, target, 3, k=2)] == paths[:2]
+        assert [[key for key, _ in path] for path in graph.person_person_paths(source, target, 3, min_distance=2)] == \
+            [path for path in paths if len(path) > 3]
+
+
+def test_person_person_paths_carry_roles():
+    graph, people = chain()
+    graph.add_company_person(company('3'), people[0], {'roles': ['prokurent']})
+    graph.add_company_person(company('3'), people[2])
+
+    paths = list(graph.person_person_paths(people[0], people[2]))
+
+    assert [[roles for _, roles in path] for path in paths] == [[None, ['prokurent'], None],
+                                                               [None, ['prezes'], ['członek'], ['prezes'], ['członek']]]
+    assert list(graph.person_person_paths(people[0], person('E'))) == []
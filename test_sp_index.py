@@ -0,0 +1,153 @@
+import math
+import random
+
+import networkx as nx
+import pytest
+
+from sp_index import SpIndex
+from sp_storage import SpSqliteStorage
+
+
+def person(id, name, company_roles):
+    return {'_id': 'p_%s' % id,
+            'information': {'id': str(id), 'slug': 'x', 'name': name, 'birthYear': '1970'},
+            'companies': [{'id': str(company_id), 'roles': roles} for company_id, roles in company_roles]}
+
+
+def company(id, person_ids):
+    return {'_id': 'c_%s' % id,
+            'information': {'id': str(id), 'slug': 'x', 'name': 'Company %s' % id, 'krs': str(id)},
+            'representation': [{'id': str(person_id)} for person_id in person_ids],
+            'directorsBoard': []}
+
+
+@pytest.fixture
+def index(tmp_path):
+    """
+    :return: SpIndex of two components, 1 - c10 - 2 - c11 - 3 and 4 - c12 - 5, where 5 and c11 are not cached.
+    """
+
+    storage = SpSqliteStorage(str(tmp_path / 'sp.sqlite'))
+    storage.put_many([person(1, 'A', [(10, ['prezes'])]),
+                      person(2, 'B', [(10, ['członek']), (11, ['prokurent'])]),
+                      person(3, 'C', [(11, [])]),
+                      person(4, 'D', [(12, ['prezes'])]),
+                      company(10, [1, 2]),
+                      company(12, [4, 5])])
+
+    sp_index = SpIndex.build(storage, str(tmp_path / 'index'), landmarks=2)
+    storage.close()
+
+    yield sp_index
+    sp_index.close()
+
+
+def test_build_compiles_relations(index):
+    def neighbours(doc_id):
+        return sorted((index.nodes[node_id], role) for node_id, role in index.neighbours(index.node_id(doc_id)))
+
+    assert neighbours('p_2') == [('c_10', 'członek'), ('c_11', 'prokurent')]
+    assert neighbours('c_10') == [('p_1', 'prezes'), ('p_2', 'członek')]
+    # relations of documents which are not cached come from the other side
+    assert neighbours('c_11') == [('p_2', 'prokurent'), ('p_3', '')]
+    assert neighbours('p_5') == [('c_12', '')]
+
+    assert index.cached(index.node_id('p_1'))
+    assert not index.cached(index.node_id('c_11'))
+    assert index.labels[index.node_id('c_10')]['krs'] == '10'
+    assert index.node_id({'id': 10}, 'c_') == index.node_id('c_10')
+    assert index.node_id('p_6') is None
+
+
+def test_shortest_path_and_distance_limit(index):
+    assert index.shortest_path({'id': 1}, {'id': 3}) == ['p_1', 'c_10', 'p_2', 'c_11', 'p_3']
+    assert index.shortest_path({'id': 3}, {'id': 1}) == ['p_3', 'c_11', 'p_2', 'c_10', 'p_1']
+    assert index.shortest_path({'id': 1}, {'id': 1}) == ['p_1']
+    assert index.connected({'id': 1}, {'id': 3}, 2)
+    assert not index.connected({'id': 1}, {'id': 3}, 1)
+    assert not index.connected({'id': 1}, {'id': 4})
+    assert not index.connected({'id': 1}, {'id': 6})
+
+
+def test_path_graph(index):
+    graph = index.path_graph(index.shortest_path({'id': 1}, {'id': 3}))
+    path = graph.path_json()[0]
+
+    assert [node['type'] for node in path] == ['person', 'company', 'person', 'company', 'person']
+    assert [node['label'] for node in path[:3]] == ['A, 1970', 'Company 10, KRS 10', 'B, 1970']
+    assert graph.to_json()['relations'][0]['roles'] == ['prezes']
+
+
+def test_reopened_index_answers_the_same(index):
+    reopened = SpIndex(index.path)
+
+    assert reopened.nodes == index.nodes
+    assert reopened.landmarks == index.landmarks
+    assert reopened.shortest_path({'id': 1}, {'id': 3}) == index.shortest_path({'id': 1}, {'id': 3})
+    reopened.close()
+
+
+def test_shortest_paths_match_networkx(full_index, full_nx_graph, person_refs):
+    refs = person_refs(200, seed=8)
+
+    for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2]):
+        path = full_index.shortest_path(person_ref_1, person_ref_2)
+        node_id_1 = full_index.node_id(person_ref_1)
+        node_id_2 = full_index.node_id(person_ref_2)
+
+        if path is None:
+            assert not nx.has_path(full_nx_graph, node_id_1, node_id_2)
+            continue
+
+        node_ids = [full_index.node_id(doc_id) for doc_id in path]
+        assert node_ids[0] == node_id_1 and node_ids[-1] == node_id_2
+        assert all(full_nx_graph.has_edge(u, v) for u, v in zip(node_ids, node_ids[1:]))
+        assert len(path) - 1 == nx.shortest_path_length(full_nx_graph, node_id_1, node_id_2)
+
+        companies = (len(path) - 1) // 2
+        assert full_index.connected(person_ref_1, person_ref_2, companies)
+        assert not full_index.connected(person_ref_1, person_ref_2, companies - 1)
+
+
+def test_hop_bounds_contain_bfs_distance(full_index, full_nx_graph):
+    r = random.Random(23)
+    reached = set(nx.node_connected_component(full_nx_graph, full_index.landmarks[0]))
+    unreachable = 0
+
+    for _ in range(2000):
+        node_id_1 = r.randrange(len(full_index.nodes))
+        node_id_2 = r.choice(list(reached)) if r.random() < 0.5 else r.randrange(len(full_index.nodes))
+        lower, upper = full_index.hop_bounds(node_id_1, node_id_2)
+
+        if nx.has_path(full_nx_graph, node_id_1, node_id_2):
+            assert lower <= nx.shortest_path_length(full_nx_graph, node_id_1, node_id_2) <= upper
+        else:
+            unreachable += 1
+            assert upper == math.inf
+            # a landmark reaching only one of the nodes proves they are not connected
+            if (node_id_1 in reached) != (node_id_2 in reached):
+                assert lower == math.inf
+
+    assert unreachable > 0
+
+
+def test_hop_bounds_without_landmarks(index):
+    def bounds(doc_id_1, doc_id_2):
+        return index.hop_bounds(index.node_id(doc_id_1), index.node_id(doc_id_2))
+
+    assert bounds('p_1', 'p_1') == (0, 0)
+    assert bounds('p_1', 'p_4') == (math.inf, math.inf)
+    lower, upper = bounds('p_1', 'p_3')
+    assert lower <= 4 <= upper
+
+    index.build_landmarks(0)
+    assert index.landmarks == [] and index.landmark_distances is None
+    assert bounds('p_1', 'p_3') == (0, math.inf)
+    reopened = SpIndex(index.path)
+    assert reopened.hop_bounds(index.node_id('p_1'), index.node_id('p_3')) == (0, math.inf)
+    reopened.close()
+
+    index.build_landmarks(1)
+    assert len(index.landmarks) == 1
+    assert bounds('p_1', 'p_4') == (math.inf, math.inf)
+    assert index.distance_bounds({'id': 1}, {'id': 6}) == (0, math.inf)
@@ -0,0 +1,55 @@
+from sp_lru_cache import SpLruCache, estimate_size
+
+
+def test_least_recently_used_items_are_evicted():
+    cache = SpLruCache(max_items=3)
+    for key in 'abc':
+        cache[key] = key
+
+    cache.get('a')
+    cache['d'] = 'd'
+
+    assert 'b' not in cache
+    assert [key for key in 'acd' if key in cache] == ['a', 'c', 'd']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_peek_does_not_mark_items_as_used():
+    cache = SpLruCache(max_items=2)
+    cache['a'] = 1
+    cache['b'] = 2
+
+    assert cache.peek('a') == 1
+    cache['c'] = 3
+
+    assert 'a' not in cache
+    assert cache.stats()['hits'] == 0
+
+
+def test_items_are_bounded_by_memory_cost():
+    cache = SpLruCache(max_bytes=3 * estimate_size({'name': 'x' * 100}))
+    for key in range(10):
+        cache[key] = {'name': 'x' * 100}
+
+    assert len(cache) == 3
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    assert [key for key in range(10) if key in cache] == [7, 8, 9]
+
+
+def test_replacing_and_popping_items_keeps_cost():
+    cache = SpLruCache(max_bytes=10 ** 6, cost_method=len)
+    cache['a'] = 'xxx'
+    cache['a'] = 'xxxxx'
+    cache['b'] = 'xx'
+
+    assert cache.stats()['bytes'] == 7
+    assert cache.pop('a') == 'xxxxx'
+    assert cache.pop('a', 'missing') == 'missing'
+    assert cache.stats()['bytes'] == 2
+
+
+def test_single_item_larger_than_limit_is_kept():
+    cache = SpLruCache(max_bytes=1, cost_method=len)
+    cache['a'] = 'xxx'
+
+    assert cache['a'] == 'xxx'
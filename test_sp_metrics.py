@@ -0,0 +1,125 @@
+import io
+import json
+import logging
+import os
+
+import pytest
+
+from sp_metrics import SpMetrics, enable_logging, get_logger, instrumented, metrics
+
+
+@pytest.fixture
+def registry():
+    """
+    :return: Default registry without trace hooks and profiling, restored after the test.
+    """
+
+    hooks, profile_dir = metrics.trace_hooks, metrics.profile_dir
+    metrics.trace_hooks = []
+    yield metrics
+    metrics.trace_hooks, metrics.profile_dir = hooks, profile_dir
+
+
+def test_counters_gauges_and_histograms():
+    sp_metrics = SpMetrics()
+    sp_metrics.inc('requests_total', kind='person')
+    sp_metrics.inc('requests_total', 2, kind='person')
+    sp_metrics.inc('requests_total', kind='company')
+    sp_metrics.set('items', 5)
+    sp_metrics.set('items', 3)
+    sp_metrics.observe('batch', 3, buckets=SpMetrics.SIZE_BUCKETS)
+    sp_metrics.observe('batch', 30000, buckets=SpMetrics.SIZE_BUCKETS)
+
+    with sp_metrics.timer('seconds', operation='test'):
+        pass
+
+    result = sp_metrics.to_dict()
+
+    assert result['counters'] == [{'name': 'requests_total', 'labels': {'kind': 'company'}, 'value': 1},
+                                  {'name': 'requests_total', 'labels': {'kind': 'person'}, 'value': 3}]
+    assert result['gauges'] == [{'name': 'items', 'labels': {}, 'value': 3}]
+
+    batch, seconds = result['histograms']
+    assert batch['count'] == 2 and batch['sum'] == 30003
+    assert batch['buckets'][:3] == [[1, 0], [2, 0], [5, 1]]
+    assert batch['buckets'][-1] == [50000, 2]
+    assert seconds['labels'] == {'operation': 'test'} and seconds['count'] == 1
+    assert json.loads(sp_metrics.to_json()) == result
+
+    sp_metrics.reset()
+    assert sp_metrics.to_dict() == {'counters': [], 'gauges': [], 'histograms': []}
+
+
+def test_prometheus_format():
+    sp_metrics = SpMetrics()
+    sp_metrics.inc('sp_total', kind='a "quoted"\nvalue')
+    sp_metrics.inc('sp_total', kind='b')
+    sp_metrics.observe('sp_seconds', 0.2, buckets=(0.1, 1.0))
+
+    assert sp_metrics.to_prometheus() == '\n'.join([
+        '# TYPE sp_total counter',
+        'sp_total{kind="a \\"quoted\\"\\nvalue"} 1',
+        'sp_total{kind="b"} 1',
+        '# TYPE sp_seconds histogram',
+        'sp_seconds_bucket{le="0.1"} 0',
+        'sp_seconds_bucket{le="1.0"} 1',
+        'sp_seconds_bucket{le="+Inf"} 1',
+        'sp_seconds_sum 0.2',
+        'sp_seconds_count 1',
+        ''])
+
+
+def test_write(tmp_path):
+    sp_metrics = SpMetrics()
+    sp_metrics.inc('sp_total')
+
+    sp_metrics.write(str(tmp_path / 'metrics.prom'))
+    sp_metrics.write(str(tmp_path / 'metrics.json'))
+
+    assert (tmp_path / 'metrics.prom').read_text().startswith('# TYPE sp_total counter')
+    assert json.loads((tmp_path / 'metrics.json').read_text()) == sp_metrics.to_dict()
+
+
+def test_instrumented_calls_are_timed_traced_and_profiled(registry, tmp_path):
+    @instrumented('test_call')
+    def call(fail):
+        if fail:
+            raise ValueError('failed')
+        return 'done'
+
+    def count():
+        return next((histogram['count'] for histogram in registry.to_dict()['histograms']
+                     if histogram['name'] == 'sp_call_seconds' and histogram['labels'] == {'call': 'test_call'}), 0)
+
+    traces = []
+    registry.add_trace_hook(lambda name, seconds, error: traces.append((name, error)))
+    registry.enable_profiling(str(tmp_path / 'profiles'))
+    calls = count()
+
+    assert call(False) == 'done'
+    with pytest.raises(ValueError):
+        call(True)
+
+    assert count() == calls + 2
+    assert traces[0] == ('test_call', None)
+    assert isinstance(traces[1][1], ValueError)
+    assert len([name for name in os.listdir(tmp_path / 'profiles') if name.startswith('test_call-')]) == 2
+
+    registry.enable_profiling(None)
+    call(False)
+    assert len(os.listdir(tmp_path / 'profiles')) == 2
+
+
+def test_logging():
+    stream = io.StringIO()
+    level = logging.getLogger('sp').level
+    handler = enable_logging(logging.DEBUG, stream)
+
+    try:
+        get_logger('test').debug('Visited %s.', 'someone')
+    finally:
+        logging.getLogger('sp').removeHandler(handler)
+        logging.getLogger('sp').setLevel(level)
+
+    assert stream.getvalue() == 'Visited someone.\n'
+    assert get_logger('test').name == 'sp.test'
@@ -0,0 +1,85 @@
+import pytest
+
+from sp_name_index import SpNameIndex
+
+
+@pytest.fixture
+def name_index(tmp_path):
+    index = SpNameIndex(str(tmp_path / 'names.sqlite'))
+    yield index
+    index.close()
+
+
+def test_fold():
+    assert SpNameIndex.fold('Łukasz Żółć') == 'lukasz zolc'
+    assert SpNameIndex.words('  Łukasz, ŻÓŁĆ 1970 ') == ['lukasz', 'zolc', '1970']
+
+
+def test_search_is_prefix_and_diacritic_insensitive(name_index):
+    name_index.add_docs([
+        {'_id': 'p_1', 'information': {'id': '1', 'slug': 'lukasz-zolc', 'name': 'Łukasz Żółć', 'birthYear': '1970'},
+         'companies': [{'id': '10', 'slug': 'spoldzielnia', 'name': 'Spółdzielnia Mleczarska', 'krs': '0000123'}]},
+        {'_id': 'c_11', 'information': {'id': '11', 'slug': 'zolc', 'name': 'Żółć SA', 'krs': '0000456'},
+         'representation': [{'id': '2', 'name': 'Anna Żółć', 'birthYear': '1980'}], 'directorsBoard': []}
+    ])
+
+    def found(query, type=None):
+        return sorted(result['id'] for result in name_index.search(query, type))
+
+    assert len(name_index) == 4
+    assert found('lukasz zol') == ['1']
+    assert found('ZOLC') == ['1', '11', '2']
+    assert found('zolc', 'person') == ['1', '2']
+    assert found('zolc 1980') == ['2']
+    assert found('spoldz mlecz') == ['10']
+    assert found('0000456') == ['11']
+    assert found('nowak') == []
+    assert found('!!') == []
+    assert len(name_index.search('zolc', limit=2)) == 2
+    assert [sorted(result['id'] for result in results) for results in name_index.search_many(['anna', 'sa'])] == \
+        [['2'], ['11']]
+    assert name_index.search('lukasz')[0] == {'id': '1', 'slug': 'lukasz-zolc', 'name': 'Łukasz Żółć',
+                                              'birthYear': '1970', 'type': 'person'}
+
+
+def test_complete_refs_are_not_replaced_by_partial_ones(name_index):
+    name_index.add_docs([{'_id': 'p_1', 'information': {'id': '1', 'name': 'Anna Nowak', 'birthYear': '1970'}}])
+    name_index.add_search_results([{'type': 'person', 'id': '1', 'name': 'Anna Kowalska'},
+                                   {'type': 'person', 'id': '2', 'name': 'Jan Kowalski'},
+                                   {'type': 'unknown', 'id': '3', 'name': 'Jan Kowalski'}])
+
+    assert [result['id'] for result in name_index.search('anna nowak')] == ['1']
+    assert name_index.search('anna kowalska') == []
+    assert [result['id'] for result in name_index.search('kowal')] == ['2']
+
+    name_index.add_docs([{'_id': 'p_2', 'information': {'id': '2', 'name': 'Jan Kowalczyk', 'birthYear': '1960'}}])
+    assert [result['id'] for result in name_index.search('kowalczyk 1960')] == ['2']
+    assert name_index.search('kowalski') == []
+
+
+def test_cache_searches_local_index(make_cache, world, tmp_path):
+    cache = make_cache()
+    cache.get_person_by_ref({'id': '123', 'slug': 'x'})
+    cache.flush()
+
+    name_index = SpNameIndex.build(cache.storage, str(tmp_path / 'names.sqlite'), batch_size=2)
+    name_index.close()
+    cache.init_name_index(str(tmp_path / 'names.sqlite'))
+
+    api_calls = cache.api_calls
+    name = world.person_info(123)['name']
+    assert [result['id'] for result in cache.search(name + ' ' + world.person_info(123)['birthYear'])] == ['123']
+    assert cache.api_calls == api_calls
+
+    # unknown names are searched with the API once, then found locally
+    name = world.person_info(1999)['name']
+    assert '1999' in [result['id'] for result in cache.search(name)]
+    assert '1999' in [result['id'] for result in cache.search(name)]
+    assert cache.api_calls == api_calls + 1
+
+    # documents written to level 2 cache are indexed as well
+    company = cache.get_company_by_ref({'id': '7', 'slug': 'x'})
+    cache.flush()
+    api_calls = cache.api_calls
+    assert [result['id'] for result in cache.search(company['information']['krs'], 'company')] == ['7']
+    assert cache.api_calls == api_calls
@@ -0,0 +1,63 @@
+from sp_projection import SpProjection
+
+
+def company_payload():
+    return {
+        'information': {'id': '1', 'slug': 'x', 'name': 'Spółka', 'krs': '0000000001', 'summaryText': 'long text'},
+        'representation': [{'id': '2', 'slug': 'y', 'name': 'Jan Kowalski', 'type': 'person', 'unknown': 1}],
+        'directorsBoard': [],
+        'shareholders': [],
+        'buttons': [{'label': 'more'}],
+        'summaryText': 'long text'
+    }
+
+
+def test_project_keeps_schema_fields():
+    projection = SpProjection()
+
+    item = projection.project('company', company_payload())
+
+    assert sorted(item) == ['directorsBoard', 'information', 'representation', 'shareholders']
+    assert 'summaryText' not in item['information']
+    assert 'unknown' not in item['representation'][0]
+    assert item['representation'][0]['name'] == 'Jan Kowalski'
+
+
+def test_raw_payload_is_kept_compressed():
+    projection = SpProjection(keep_raw=True)
+    payload = company_payload()
+
+    item = projection.project('company', payload)
+
+    assert SpProjection.raw(item) == payload
+    assert 'raw' not in projection.lean('company', item)
+
+
+def test_lean_does_not_project_lean_documents_again():
+    projection = SpProjection(keep_raw=True)
+    doc = dict(projection.project('company', company_payload()), _id='c_1', timestamp=[2026, 1, 1, 0, 0, 0])
+
+    lean = projection.lean('company', doc)
+
+    assert projection.lean('company', lean) is lean
+    assert all(lean[field] is doc[field] for field in lean)
+    assert sorted(lean) == sorted(set(doc) - {'raw'})
+
+
+def test_lean_projects_full_documents():
+    projection = SpProjection()
+
+    lean = projection.lean('company', dict(company_payload(), _id='c_1'))
+
+    assert 'buttons' not in lean
+    assert 'summaryText' not in lean['information']
+
+
+def test_level_1_cache_keeps_lean_items(make_cache, person_refs):
+    cache = make_cache(keep_raw=True)
+    item = cache.get_person_by_ref(person_refs(1, seed=17)[0])
+    cache.flush()
+
+    assert 'raw' not in item
+    assert 'raw' not in cache.person_cache.peek(item['information']['id'])
+    assert SpProjection.raw(cache.storage.get(item['_id']))['information'] == item['information']
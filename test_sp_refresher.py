@@ -0,0 +1,94 @@
+import time
+
+from sp_refresher import SpCacheRefresher
+
+DAY = 24 * 3600
+
+
+def age(cache, docs, days):
+    """
+    Rewrites documents as if they were fetched some days ago.
+
+    :return: Rewritten documents.
+    """
+
+    docs = aged(docs, days)
+    cache.storage.put_many(docs)
+    return docs
+
+
+def aged(docs, days):
+    timestamp = list(time.gmtime(time.time() - days * DAY))
+    return [dict(doc, timestamp=timestamp) for doc in docs]
+
+
+def cached_persons(cache, n):
+    docs = [cache.get_person_by_ref({'id': str(id), 'slug': 'x'}) for id in range(n)]
+    cache.flush()
+    return list(cache.storage.get_many(['p_%s' % doc['information']['id'] for doc in docs]).values())
+
+
+def test_sweeps_move_on_to_unchecked_documents(make_cache):
+    cache = make_cache()
+    age(cache, cached_persons(cache, 35), 10)
+    refresher = SpCacheRefresher(cache, max_age=DAY, workers=4)
+
+    api_calls = cache.api_calls
+    assert refresher.sweep(limit=20) == {'checked': 20, 'changed': 0, 'failed': 0}
+    assert refresher.sweep(limit=20) == {'checked': 15, 'changed': 0, 'failed': 0}
+    assert refresher.sweep(limit=20) == {'checked': 0, 'changed': 0, 'failed': 0}
+    assert cache.api_calls - api_calls == 35
+    assert cache.storage.stale_ids(time.time() - DAY) == []
+
+
+def test_unchanged_documents_are_not_written(make_cache):
+    cache = make_cache()
+    docs = age(cache, cached_persons(cache, 10), 10)
+    since = cache.storage.changes()[1]
+
+    assert SpCacheRefresher(cache, max_age=DAY).sweep() == {'checked': 10, 'changed': 0, 'failed': 0}
+
+    assert cache.storage.changes(since, timeout=0.0) == ([], since)
+    assert cache.storage.get_many([doc['_id'] for doc in docs]) == {doc['_id']: doc for doc in docs}
+
+
+def test_sweep_writes_changed_documents(make_cache):
+    cache = make_cache()
+    docs = cached_persons(cache, 10)
+    changed = [dict(doc, companies=[]) for doc in docs[:3]]
+    age(cache, changed + docs[3:], 10)
+    since = cache.storage.changes()[1]
+    refresher = SpCacheRefresher(cache, max_age=DAY)
+
+    assert refresher.sweep() == {'checked': 10, 'changed': 3, 'failed': 0}
+
+    assert sorted(cache.storage.changes(since, timeout=0.0)[0]) == sorted((doc['_id'], None) for doc in changed)
+    for doc in changed:
+        assert len(cache.storage.get(doc['_id'])['companies']) > 0
+
+
+def test_changed_documents_are_lean_in_level_1_cache(make_cache):
+    cache = make_cache(keep_raw=True)
+    docs = cached_persons(cache, 3)
+    age(cache, [dict(doc, companies=[]) for doc in docs], 10)
+
+    assert SpCacheRefresher(cache, max_age=DAY).sweep()['changed'] == 3
+
+    for doc in docs:
+        assert 'raw' in cache.storage.get(doc['_id'])
+        assert 'raw' not in cache.person_cache.peek(doc['_id'][2:])
+
+
+def test_failed_documents_are_retried_after_max_age(make_cache):
+    cache = make_cache()
+    docs = cached_persons(cache, 5)
+    missing = dict(docs[0], _id='p_999999', information=dict(docs[0]['information'], id='999999'))
+    missing = age(cache, docs + [missing], 10)[-1]
+    refresher = SpCacheRefresher(cache, max_age=DAY)
+
+    assert refresher.sweep() == {'checked': 6, 'changed': 0, 'failed': 1}
+    assert refresher.sweep() == {'checked': 0, 'changed': 0, 'failed': 0}
+
+    # the failed document is kept as it was, but is not checked again before max_age
+    assert cache.storage.get('p_999999') == missing
+    assert 'p_999999' in cache.storage.stale_ids(time.time() + 2 * DAY)
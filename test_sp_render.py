@@ -0,0 +1,102 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from sp_render import SpRenderer, fast_layout, write_gexf, write_graphml
+from sp_scrapper import SpScrapper
+
+
+@pytest.fixture
+def graph(make_cache, person_refs):
+    """
+    :return: Crawled SpGraph with a found path.
+    """
+
+    person_ref_1, person_ref_2 = person_refs(2, seed=3)
+    scrapper = SpScrapper(make_cache())
+    graph = scrapper.expand_person(person_ref_1, 2)
+
+    company = next(company_id for company_id in graph.company_ids.values() if len(graph.neighbours(company_id)) > 1)
+    person_1, person_2 = graph.neighbours(company)[:2]
+    graph.paths.append((graph.node_key(person_1), graph.node_key(person_2)))
+
+    return graph
+
+
+def test_graphml_export(graph, tmp_path):
+    write_graphml(graph, str(tmp_path / 'graph.graphml'))
+    exported = nx.read_graphml(str(tmp_path / 'graph.graphml'))
+
+    assert set(exported.nodes) == set(graph.nx_graph.nodes)
+    assert {frozenset(edge) for edge in exported.edges} == {frozenset(edge) for edge in graph.nx_graph.edges}
+
+    for node_id in range(len(graph.natural_keys)):
+        attributes = exported.nodes[graph.node_key(node_id)]
+        assert attributes['label'] == graph.label(node_id)
+        assert attributes['kind'] == ('person' if graph.kinds[node_id] == graph.PERSON else 'company')
+
+    company_id, person_id = next(iter(graph.edge_records)) >> 32, next(iter(graph.edge_records)) & 0xffffffff
+    assert exported.edges[graph.node_key(person_id), graph.node_key(company_id)]['roles'] == \
+        ', '.join(graph.edge_records[company_id << 32 | person_id].roles)
+
+
+def test_gexf_export_of_part_of_the_graph(graph, tmp_path):
+    node_ids = graph.neighbourhood([0], 1)
+    pos = SpRenderer(layout='fast').layout(graph)
+
+    write_gexf(graph, str(tmp_path / 'graph.gexf'), node_ids, pos)
+    exported = nx.read_gexf(str(tmp_path / 'graph.gexf'), version='1.2draft')
+    expected = graph.nx_graph.subgraph(graph.node_key(node_id) for node_id in node_ids)
+
+    assert set(exported.nodes) == set(expected.nodes)
+    assert exported.number_of_edges() == expected.number_of_edges()
+    assert exported.nodes[graph.node_key(0)]['label'] == graph.label(0)
+
+
+def test_save_draws_without_display(graph, tmp_path):
+    renderer = SpRenderer(figsize=(4, 3), dpi=50)
+
+    renderer.save(graph, str(tmp_path / 'graph.png'))
+    renderer.save_paths(graph, str(tmp_path / 'paths.png'))
+    renderer.save_top(graph, str(tmp_path / 'top.svg'), k=10)
+    graph.draw(str(tmp_path / 'draw.png'), renderer, node_ids=graph.top_nodes(5))
+
+    for name in ['graph.png', 'paths.png', 'draw.png']:
+        assert (tmp_path / name).read_bytes()[:8] == b'\x89PNG\r\n\x1a\n'
+    assert b'<svg' in (tmp_path / 'top.svg').read_bytes()
+
+
+@pytest.mark.parametrize('layout', ['spring', 'fast'])
+def test_layout_cache_keeps_positions(graph, tmp_path, layout):
+    renderer = SpRenderer(layout=layout, layout_cache=str(tmp_path / 'layout.json'))
+    pos = renderer.layout(graph)
+
+    assert pos.shape == (len(graph.natural_keys), 2)
+    assert np.isfinite(pos).all()
+    assert np.allclose(renderer.layout(graph), pos)
+
+    new_id = graph.add_node(('krs', 'new'), graph.COMPANY)
+    graph.add_edge(new_id, 0)
+    grown = renderer.layout(graph)
+
+    assert np.allclose(grown[:new_id], pos)
+    assert np.isfinite(grown[new_id]).all()
+
+
+def test_fast_layout_pulls_neighbours_together():
+    graph = nx.connected_caveman_graph(20, 10)
+    src, dst = np.array(graph.edges).T
+    rng = np.random.default_rng(0)
+    initial = rng.random((graph.number_of_nodes(), 2))
+    fixed = np.zeros(len(initial), dtype=bool)
+    fixed[:5] = True
+
+    pos = fast_layout(initial, src, dst, iterations=100, fixed=fixed, chunk_size=64)
+
+    def mean_distance(pairs):
+        return np.mean([np.linalg.norm(pos[a] - pos[b]) for a, b in pairs])
+
+    assert pos.shape == initial.shape
+    assert np.array_equal(pos[:5], initial[:5])
+    assert mean_distance(graph.edges) < mean_distance(rng.integers(0, len(pos), (500, 2))) / 2
+    assert np.array_equal(fast_layout(initial[:1], src[:0], dst[:0]), initial[:1])
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from sp_benchmark import SpStandInServer
+from sp_rest_client import SpRestClient
+from sp_rest_scheduler import SpRestError, SpRestScheduler
+
+
+class Response:
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+def responses(*statuses):
+    """
+    :return: Request lambda answering with the statuses in turn, the last one for ever.
+    """
+
+    answers = iter(statuses)
+    last = [None]
+
+    def request():
+        last[0] = next(answers, last[0])
+        return last[0]
+
+    return request
+
+
+def test_retries_server_errors():
+    scheduler = SpRestScheduler(backoff=0.001)
+
+    response = scheduler.run(responses(Response(503), Response(502), Response(200)))
+
+    assert response.status == 200
+    assert {key: scheduler.stats()[key] for key in ['requests', 'retries', 'failures']} == \
+        {'requests': 3, 'retries': 2, 'failures': 0}
+
+
+def test_does_not_retry_client_errors():
+    scheduler = SpRestScheduler(backoff=0.001)
+
+    assert scheduler.run(responses(Response(404), Response(200))).status == 404
+    assert scheduler.stats()['retries'] == 0
+
+
+def test_waits_retry_after_when_throttled():
+    scheduler = SpRestScheduler(backoff=0.001)
+    start = time.monotonic()
+
+    response = scheduler.run(responses(Response(429, {'Retry-After': '0.2'}), Response(200)))
+
+    assert response.status == 200
+    assert time.monotonic() - start >= 0.2
+    assert scheduler.stats()['throttled'] == 1
+
+
+def test_fails_after_max_retries():
+    scheduler = SpRestScheduler(max_retries=2, backoff=0.001)
+
+    with pytest.raises(SpRestError):
+        scheduler.run(responses(Response(503)))
+
+    assert {key: scheduler.stats()[key] for key in ['requests', 'retries', 'failures']} == \
+        {'requests': 3, 'retries': 2, 'failures': 1}
+
+
+def test_burst_of_errors_halves_limit_once():
+    scheduler = SpRestScheduler(max_concurrency=8, initial_concurrency=8, max_retries=0)
+    barrier = threading.Barrier(8)
+
+    def request():
+        # all requests are in flight before any of them fails
+        barrier.wait()
+        return Response(503)
+
+    def run():
+        with pytest.raises(SpRestError):
+            scheduler.run(request)
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert scheduler.stats()['concurrency_limit'] == 4.0
+    assert scheduler.stats()['failures'] == 8
+
+    # later failures decrease it again
+    with pytest.raises(SpRestError):
+        scheduler.run(responses(Response(503)))
+    assert scheduler.stats()['concurrency_limit'] == 2.0
+
+
+def test_client_recovers_from_injected_errors(world):
+    with SpStandInServer(world, error_rate=0.2, throttle_rate=0.1, seed=1) as server:
+        scheduler = SpRestScheduler(max_retries=8, backoff=0.001, max_backoff=0.01)
+        client = SpRestClient(server.url, scheduler=scheduler)
+
+        people = [client.person(str(id), 'x') for id in range(50)]
+
+        assert all(person['information']['id'] == str(id) for id, person in enumerate(people))
+        assert scheduler.stats()['retries'] > 0
+        assert scheduler.stats()['throttled'] > 0
+        assert scheduler.stats()['requests'] == server.requests
@@ -0,0 +1,108 @@
+import networkx as nx
+
+from sp_graph import SpGraph
+from sp_scrapper import SpScrapper
+
+
+def test_concurrent_layers_build_the_same_graph(make_cache, person_refs, graph_contents):
+    person_ref = person_refs(1, seed=18)[0]
+
+    sequential = SpScrapper(make_cache('sequential')).expand_person(person_ref, 2)
+    concurrent_cache = make_cache('concurrent')
+    concurrent = SpScrapper(concurrent_cache, max_workers=8).expand_person(person_ref, 2)
+
+    assert graph_contents(concurrent) == graph_contents(sequential)
+    assert concurrent.natural_keys == sequential.natural_keys
+    assert concurrent_cache.api_calls == len(concurrent.natural_keys)
+
+
+def test_concurrent_company_expansion(make_cache, graph_contents):
+    company_ref = {'id': '5', 'slug': 'x'}
+
+    sequential = SpScrapper(make_cache('sequential')).expand_company(company_ref, 2)
+    concurrent = SpScrapper(make_cache('concurrent'), max_workers=8).expand_company(company_ref, 2)
+
+    assert graph_contents(concurrent) == graph_contents(sequential)
+
+
+def test_expand_person_reaches_board_members(make_cache, world, person_refs):
+    person_ref = person_refs(1, seed=19)[0]
+    cache = make_cache()
+    graph = SpScrapper(cache, max_workers=4).expand_person(person_ref, 2)
+    person = cache.get_person_by_ref(person_ref)
+
+    for company_ref in person['companies']:
+        company = cache.get_company_by_ref(company_ref)
+        assert graph.exist_company(company['information'])
+
+        for member in company['representation'] + company['directorsBoard']:
+            assert graph.exist_person(member)
+
+
+def test_batch_paths_match_single_searches(make_cache, full_index, person_refs):
+    refs = person_refs(16, seed=20)
+    pairs = list(zip(refs[::2], refs[1::2])) + [(refs[0], refs[3]), (refs[0], refs[5])]
+
+    graph = SpGraph()
+    results = list(SpScrapper(make_cache('batch')).find_paths(pairs, 2, graph))
+
+    assert sorted(map(id, (pair for result in results for pair in result[:2]))) == \
+        sorted(map(id, (person_ref for pair in pairs for person_ref in pair)))
+    assert any(path is not None for _, _, path in results)
+
+    single_scrapper = SpScrapper(make_cache('single'))
+
+    for person_ref_1, person_ref_2, path in results:
+        single = single_scrapper.find_path(person_ref_1, person_ref_2, 2).path_node_ids()
+        # a search of a distance can find one more company
+        index_path = full_index.shortest_path(person_ref_1, person_ref_2, 3)
+
+        if path is None:
+            assert single == [] and index_path is None
+            continue
+
+        assert len(path) == len(single[0]) == len(index_path)
+        assert path[0] == SpGraph.get_person_key(person_ref_1) and path[-1] == SpGraph.get_person_key(person_ref_2)
+        assert all(graph.nx_graph.has_edge(key_1, key_2) for key_1, key_2 in zip(path, path[1:]))
+
+
+def test_one_to_many_paths(make_cache, person_refs):
+    refs = person_refs(6, seed=21)
+    scrapper = SpScrapper(make_cache())
+
+    one_to_many = [path for _, _, path in scrapper.find_paths_one_to_many(refs[0], refs[1:], 2)]
+    batch = [path for _, _, path in scrapper.find_paths([(refs[0], person_ref) for person_ref in refs[1:]], 2)]
+
+    assert sorted(map(len, filter(None, one_to_many))) == sorted(map(len, filter(None, batch)))
+
+
+def test_all_paths_match_networkx(make_cache, full_index, full_nx_graph, person_refs):
+    refs = person_refs(400, seed=22)
+
+    def key(node_id):
+        label = full_index.labels[node_id]
+        return SpGraph.get_person_key(label) if full_index.nodes[node_id].startswith('p_') else \
+            SpGraph.get_company_key(label)
+
+    for person_ref_1, person_ref_2 in [(refs[108], refs[109]), (refs[374], refs[375])]:
+        paths = [[node_key for node_key, _ in path]
+                 for path in SpScrapper(make_cache()).find_all_paths(person_ref_1, person_ref_2, 3)]
+        expected = [list(map(key, path)) for path in nx.all_simple_paths(full_nx_graph,
+                                                                          full_index.node_id(person_ref_1),
+                                                                          full_index.node_id(person_ref_2), cutoff=6)]
+
+        assert len(paths) > 1
+        assert sorted(paths) == sorted(expected)
+        assert list(map(len, paths)) == sorted(map(len, paths))
+
+
+def test_all_paths_limit(make_cache, person_refs):
+    refs = person_refs(400, seed=22)
+    cache = make_cache()
+
+    paths = list(SpScrapper(cache).find_all_paths(refs[108], refs[109], 3))
+    api_calls = cache.api_calls
+
+    assert list(SpScrapper(make_cache('limited')).find_all_paths(refs[108], refs[109], 3, k=2)) == paths[:2]
+    assert list(SpScrapper(cache).find_all_paths(refs[108], refs[109], 1)) == []
+    assert cache.api_calls == api_calls
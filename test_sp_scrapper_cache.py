@@ -0,0 +1,169 @@
+import calendar
+import sys
+import threading
+import time
+
+import pytest
+
+from sp_benchmark import SpStandInServer
+from sp_rest_client import SpRestClient
+from sp_scrapper_cache import SpScrapperCache
+
+
+def fetch_concurrently(cache, item_ref, threads=16):
+    """
+    :return: Items returned by concurrent get_person_by_ref calls started at the same time.
+    """
+
+    barrier = threading.Barrier(threads)
+    items = [None] * threads
+
+    def fetch(i):
+        barrier.wait()
+        items[i] = cache.get_person_by_ref(item_ref)
+
+    workers = [threading.Thread(target=fetch, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return items
+
+
+@pytest.fixture
+def frequent_switches():
+    """
+    Switches threads as often as possible, which makes races between them likely.
+    """
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_fetches_are_coalesced(make_cache, server, person_refs, frequent_switches):
+    for i, person_ref in enumerate(person_refs(300, seed=5)):
+        cache = make_cache('sp_%s' % i)
+        requests = server.requests
+
+        items = fetch_concurrently(cache, person_ref)
+
+        assert server.requests - requests == 1
+        assert cache.api_calls == 1
+        assert all(item is items[0] for item in items)
+
+
+def test_concurrent_fetches_of_slow_api_are_coalesced(world, tmp_path, person_refs):
+    with SpStandInServer(world, latency=0.05) as server:
+        cache = SpScrapperCache(SpRestClient(server.url))
+        cache.init_sqlite(str(tmp_path / 'sp.sqlite'))
+
+        items = fetch_concurrently(cache, person_refs(1, seed=6)[0])
+
+        assert server.requests == 1
+        assert cache.stats()['coalesced'] == 15
+        assert all(item is items[0] for item in items)
+        cache.storage.close()
+
+
+def test_failed_fetches_are_not_repeated(make_cache, server):
+    cache = make_cache()
+    requests = server.requests
+
+    items = fetch_concurrently(cache, {'id': '999999', 'slug': 'x'})
+
+    assert items == [None] * 16
+    assert server.requests - requests == 1
+    assert cache.get_person_by_ref({'id': '999999', 'slug': 'x'}) is None
+    assert server.requests - requests == 1
+
+
+def test_buffered_documents_are_written_after_batch_interval(make_cache, person_refs):
+    cache = make_cache(storage_batch_interval=0.2)
+    item = cache.get_person_by_ref(person_refs(1, seed=7)[0])
+
+    assert cache.storage.get(item['_id']) is None
+
+    deadline = time.monotonic() + 5.0
+    while cache.storage.get(item['_id']) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert cache.storage.get(item['_id']) is not None
+    assert cache.storage_write_buffer == []
+
+
+def test_writes_are_buffered_until_batch_is_full(make_cache, server):
+    cache = make_cache(storage_batch_size=5, storage_batch_interval=60.0)
+
+    items = [cache.get_person_by_ref({'id': str(id), 'slug': 'x'}) for id in range(7)]
+
+    assert set(cache.storage.get_many([item['_id'] for item in items])) == {item['_id'] for item in items[:5]}
+    assert len(cache.storage_write_buffer) == 2
+
+    cache.flush()
+    assert len(cache.storage.get_many([item['_id'] for item in items])) == 7
+
+
+def test_preload_reads_level_2_cache_in_bulk(make_cache, server):
+    refs = [{'id': str(id), 'slug': 'x'} for id in range(30)] + [{'id': '999999', 'slug': 'x'}]
+    writer = make_cache()
+    for ref in refs[:-1]:
+        writer.get_person_by_ref(ref)
+    writer.flush()
+
+    cache = make_cache(storage_batch_size=8)
+    requests = server.requests
+    items = cache.preload_persons(refs)
+
+    assert [item['information']['id'] for item in items[:-1]] == [ref['id'] for ref in refs[:-1]]
+    assert items[-1] is None
+    assert all(cache.person_cache.peek(ref['id']) is not None for ref in refs[:-1])
+    assert server.requests == requests
+    assert cache.api_calls == 0
+
+
+def age(item):
+    return time.time() - calendar.timegm(tuple(item['timestamp'][:6]))
+
+
+def age_in_level_1_cache(cache, item, seconds):
+    cache.person_cache[item['information']['id']] = dict(item, timestamp=list(time.gmtime(time.time() - seconds)))
+
+
+def test_stale_items_are_served_and_refreshed_in_background(make_cache, person_refs):
+    person_ref = person_refs(1, seed=20)[0]
+    cache = make_cache(refresh_ttl=60.0, expire_ttl=3600.0)
+    age_in_level_1_cache(cache, cache.get_person_by_ref(person_ref), 600)
+
+    stale = cache.get_person_by_ref(person_ref)
+    cache.refresh_executor.shutdown(wait=True)
+
+    assert cache.stats()['refreshed'] == 1
+    assert cache.api_calls == 2
+    assert age(stale) >= 600
+    assert age(cache.get_person_by_ref(person_ref)) < 60
+
+
+def test_expired_items_are_fetched_again(make_cache, person_refs):
+    person_ref = person_refs(1, seed=21)[0]
+    cache = make_cache(refresh_ttl=60.0, expire_ttl=300.0)
+    age_in_level_1_cache(cache, cache.get_person_by_ref(person_ref), 600)
+
+    item = cache.get_person_by_ref(person_ref)
+
+    assert cache.stats()['expired'] == 1
+    assert cache.stats()['refreshed'] == 0
+    assert cache.api_calls == 2
+    assert age(item) < 60
+
+
+def test_level_1_cache_is_bounded(make_cache):
+    cache = make_cache(cache_max_items=10)
+
+    for id in range(25):
+        cache.get_company_by_ref({'id': str(id), 'slug': 'x'})
+
+    assert cache.stats()['company']['items'] == 10
+    assert cache.stats()['company']['evictions'] == 15
@@ -0,0 +1,194 @@
+import math
+
+from sp_index import SpIndex
+from sp_scrapper import SpScrapper
+from sp_search import SpSearchPolicy
+
+
+def companies(graph):
+    """
+    :return: Number of companies on the found path, None if there is none.
+    """
+
+    paths = graph.path_node_ids()
+    return None if len(paths) == 0 else (len(paths[0]) - 1) // 2
+
+
+def index_distance(index, person_ref_1, person_ref_2):
+    path = index.shortest_path(person_ref_1, person_ref_2)
+    return math.inf if path is None else (len(path) - 1) // 2
+
+
+def test_find_path_finds_shortest_paths(make_cache, full_index, person_refs):
+    scrapper = SpScrapper(make_cache())
+    refs = person_refs(40)
+
+    for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2]):
+        graph = scrapper.find_path(person_ref_1, person_ref_2, 2)
+        distance = index_distance(full_index, person_ref_1, person_ref_2)
+
+        assert graph.exact
+        if distance <= 2:
+            assert companies(graph) == distance
+        if companies(graph) is not None:
+            assert companies(graph) == distance
+
+
+def test_find_path_budget_marks_result_inexact(make_cache, person_refs):
+    cache = make_cache()
+    person_ref_1, person_ref_2 = person_refs(2, seed=1)
+
+    graph = SpScrapper(cache).find_path(person_ref_1, person_ref_2, 3, SpSearchPolicy(max_api_calls=1))
+
+    assert not graph.exact
+    assert companies(graph) is None
+
+
+def test_landmark_bounds_contain_distance(full_index, person_refs):
+    refs = person_refs(200, seed=2)
+
+    for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2]):
+        lower, upper = full_index.distance_bounds(person_ref_1, person_ref_2)
+        assert lower <= index_distance(full_index, person_ref_1, person_ref_2) <= upper
+
+
+def test_landmark_pruning_marks_result_inexact(make_cache, full_index, person_refs):
+    refs = person_refs(200, seed=3)
+    person_ref_1, person_ref_2 = next((person_ref_1, person_ref_2)
+                                      for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2])
+                                      if 2 < full_index.distance_bounds(person_ref_1, person_ref_2)[0] < math.inf)
+    cache = make_cache()
+
+    graph = SpScrapper(cache).find_path(person_ref_1, person_ref_2, 1, SpSearchPolicy(landmarks=full_index))
+
+    assert companies(graph) is None
+    assert not graph.exact
+    assert cache.api_calls == 0
+
+
+def test_landmark_pruning_keeps_paths_of_partial_cache(make_cache, person_refs, tmp_path):
+    scrapper = SpScrapper(make_cache('full'))
+    person_ref_1, person_ref_2 = next((person_ref_1, person_ref_2)
+                                      for person_ref_1, person_ref_2 in zip(*[iter(person_refs(400, seed=4))] * 2)
+                                      if companies(scrapper.find_path(person_ref_1, person_ref_2, 3)) == 3)
+
+    # the index of a partial crawl does not connect the people
+    cache = make_cache('partial')
+    scrapper = SpScrapper(cache)
+    scrapper.expand_person(person_ref_1, 1)
+    scrapper.expand_person(person_ref_2, 1)
+    cache.flush()
+    index = SpIndex.build(cache.storage, str(tmp_path / 'index'))
+
+    try:
+        assert index.distance_bounds(person_ref_1, person_ref_2)[0] == math.inf
+
+        graph = scrapper.find_path(person_ref_1, person_ref_2, 3, SpSearchPolicy(landmarks=index))
+        assert companies(graph) == 3
+    finally:
+        index.close()
+
+
+def doc_ids(graph, path):
+    return [('p_' if graph.kinds[node_id] == graph.PERSON else 'c_') + graph.records[node_id].id for node_id in path]
+
+
+def test_found_paths_are_registry_paths(make_cache, full_index, person_refs):
+    scrapper = SpScrapper(make_cache())
+    refs = person_refs(40, seed=11)
+    found = 0
+
+    for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2]):
+        graph = scrapper.find_path(person_ref_1, person_ref_2, 3)
+
+        for path in graph.path_node_ids():
+            ids = doc_ids(graph, path)
+            found += 1
+
+            assert {ids[0], ids[-1]} == {'p_' + person_ref_1['id'], 'p_' + person_ref_2['id']}
+            assert all(doc_id.startswith('p_' if i % 2 == 0 else 'c_') for i, doc_id in enumerate(ids))
+            for doc_id_1, doc_id_2 in zip(ids, ids[1:]):
+                node_id_2 = full_index.node_id(doc_id_2)
+                assert any(node_id == node_id_2 for node_id, _ in full_index.neighbours(full_index.node_id(doc_id_1)))
+
+    assert found > 0
+
+
+def test_find_path_is_symmetric(make_cache, person_refs):
+    scrapper = SpScrapper(make_cache())
+    refs = person_refs(20, seed=12)
+
+    for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2]):
+        assert companies(scrapper.find_path(person_ref_1, person_ref_2, 3)) == \
+            companies(scrapper.find_path(person_ref_2, person_ref_1, 3))
+
+
+def test_find_path_of_board_members_of_one_company(make_cache):
+    cache = make_cache()
+    company = cache.get_company_by_ref({'id': '0', 'slug': 'x'})
+    person_ref_1, person_ref_2 = [ref for section in ['representation', 'directorsBoard'] for ref in company[section]][:2]
+
+    graph = SpScrapper(cache).find_path(person_ref_1, person_ref_2, 1)
+
+    assert graph.exact
+    assert companies(graph) == 1
+
+
+def test_find_path_beyond_distance_finds_nothing(make_cache, full_index, person_refs):
+    refs = person_refs(200, seed=13)
+    person_ref_1, person_ref_2 = next((person_ref_1, person_ref_2)
+                                      for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2])
+                                      if index_distance(full_index, person_ref_1, person_ref_2) == 3)
+
+    graph = SpScrapper(make_cache()).find_path(person_ref_1, person_ref_2, 1)
+
+    assert graph.exact
+    assert companies(graph) is None
+
+
+def company(people):
+    return {'information': {'id': str(people)}, 'representation': [{}] * people, 'directorsBoard': []}
+
+
+def test_policy_splits_hubs_and_orders_by_degree():
+    policy = SpSearchPolicy(hub_degree=2, order_by_degree=True)
+
+    companies, hubs = policy.split([company(3), company(1), company(2), company(5)])
+
+    assert [SpSearchPolicy.degree(c) for c in companies] == [1, 2]
+    assert [SpSearchPolicy.degree(c) for c in hubs] == [3, 5]
+    assert SpSearchPolicy().split([company(3), company(1)]) == ([company(3), company(1)], [])
+
+
+def distant_pair(full_index, refs, distance):
+    return next((person_ref_1, person_ref_2)
+                for person_ref_1, person_ref_2 in zip(refs[::2], refs[1::2])
+                if index_distance(full_index, person_ref_1, person_ref_2) == distance)
+
+
+def test_dropped_hubs_mark_result_inexact(make_cache, full_index, person_refs):
+    person_ref_1, person_ref_2 = distant_pair(full_index, person_refs(200, seed=22), 3)
+    cache = make_cache()
+
+    graph = SpScrapper(cache).find_path(person_ref_1, person_ref_2, 3, SpSearchPolicy(hub_degree=0, defer_hubs=False))
+
+    assert not graph.exact
+    assert companies(graph) is None
+
+
+def test_deferred_hubs_are_expanded_last(make_cache, full_index, person_refs):
+    person_ref_1, person_ref_2 = distant_pair(full_index, person_refs(200, seed=23), 2)
+
+    graph = SpScrapper(make_cache()).find_path(person_ref_1, person_ref_2, 2, SpSearchPolicy(hub_degree=0))
+
+    assert not graph.exact
+    assert companies(graph) == 2
+
+
+def test_time_budget_marks_result_inexact(make_cache, full_index, person_refs):
+    person_ref_1, person_ref_2 = distant_pair(full_index, person_refs(200, seed=24), 3)
+
+    graph = SpScrapper(make_cache()).find_path(person_ref_1, person_ref_2, 3, SpSearchPolicy(max_seconds=0.0))
+
+    assert not graph.exact
+    assert companies(graph) is None
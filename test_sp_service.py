@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from sp_service import SpQueryService, SpUnknownEndpoint
+
+
+async def get(address, target):
+    """
+    :return: Tuple of HTTP status code and json body of a GET request.
+    """
+
+    reader, writer = await asyncio.open_connection(*address)
+    writer.write(('GET %s HTTP/1.1\r\nConnection: close\r\n\r\n' % target).encode('latin-1'))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+def serve(service, *targets):
+    """
+    :return: Responses to requests sent at the same time.
+    """
+
+    async def run():
+        address = await service.start('127.0.0.1', 0)
+        try:
+            return await asyncio.gather(*[get(address, target) for target in targets])
+        finally:
+            await service.stop()
+
+    return asyncio.run(run())
+
+
+def test_endpoints(make_cache, person_refs):
+    person_ref = person_refs(1, seed=14)[0]
+    service = SpQueryService(make_cache())
+
+    (status, person), (company_status, _), (missing_status, missing), (stats_status, stats) = serve(
+        service,
+        '/person?id=%s&slug=%s' % (person_ref['id'], person_ref['slug']),
+        '/company?id=1&slug=x',
+        '/person?slug=x',
+        '/stats')
+
+    assert status == 200 and len(person['companies']) > 0
+    assert company_status == 200
+    assert missing_status == 400 and 'id' in missing['error']
+    assert stats_status == 200 and 'cache' in stats
+
+
+def test_unknown_endpoint_and_failed_query(make_cache):
+    cache = make_cache()
+    service = SpQueryService(cache)
+
+    def search(query, type=None):
+        raise KeyError('information')
+
+    cache.search = search
+
+    (unknown_status, unknown), (failed_status, _) = serve(service, '/nothing', '/search?q=x')
+
+    assert unknown_status == 404 and 'nothing' in unknown['error']
+    assert failed_status == 500
+
+    with pytest.raises(SpUnknownEndpoint):
+        asyncio.run(service.query('/nothing', {}))
+
+
+def test_identical_queries_crawl_once(make_cache, person_refs):
+    person_ref = person_refs(1, seed=15)[0]
+    target = '/person?id=%s&slug=%s&distance=2' % (person_ref['id'], person_ref['slug'])
+    single_cache = make_cache('single')
+    cache = make_cache('concurrent')
+
+    serve(SpQueryService(single_cache), target)
+    responses = serve(SpQueryService(cache), *[target] * 8)
+
+    assert all(response == responses[0] for response in responses)
+    assert cache.api_calls == single_cache.api_calls > 0
+
+
+def test_overlapping_queries_are_served_from_memory(make_cache, person_refs):
+    person_ref = person_refs(1, seed=16)[0]
+    cache = make_cache()
+    service = SpQueryService(cache)
+    ref = 'id=%s&slug=%s' % (person_ref['id'], person_ref['slug'])
+
+    serve(service, '/person?%s&distance=2' % ref)
+    api_calls = cache.api_calls
+
+    service = SpQueryService(cache)
+    (status, _), = serve(service, '/person?%s&distance=1' % ref)
+
+    assert status == 200
+    assert cache.api_calls == api_calls
@@ -0,0 +1,45 @@
+import functools
+
+from sp_rest_client import SpRestClient
+from sp_scrapper import SpScrapper
+from sp_scrapper_cache import SpScrapperCache
+from sp_shard_pool import SpShardPool
+
+
+def worker_cache(url, path):
+    cache = SpScrapperCache(SpRestClient(url))
+    cache.init_sqlite(path)
+    return cache
+
+
+def test_sharded_crawl_builds_the_same_graph(make_cache, server, person_refs, graph_contents, tmp_path):
+    person_ref = person_refs(1, seed=18)[0]
+    expected = SpScrapper(make_cache('local')).expand_person(person_ref, 2)
+
+    cache = make_cache('sharded')
+    factory = functools.partial(worker_cache, server.url, str(tmp_path / 'sharded.sqlite'))
+
+    with SpShardPool(factory, processes=2, threads=2, batch_size=3) as shard_pool:
+        graph = SpScrapper(cache, shard_pool=shard_pool).expand_person(person_ref, 2)
+
+        assert graph_contents(graph) == graph_contents(expected)
+        assert cache.api_calls == len(graph.natural_keys)
+        assert len(list(cache.storage)) == len(graph.natural_keys)
+
+        # the second crawl is served by the coordinator's level 1 cache
+        SpScrapper(cache, shard_pool=shard_pool).expand_person(person_ref, 2)
+        assert cache.api_calls == len(graph.natural_keys)
+
+
+def test_missing_refs_are_remembered(make_cache, server, tmp_path):
+    cache = make_cache('sharded', negative_ttl=60.0)
+    factory = functools.partial(worker_cache, server.url, str(tmp_path / 'sharded.sqlite'))
+    refs = [{'id': '1', 'slug': 'x'}, {'id': '99999999', 'slug': 'x'}, {'slug': 'x'}]
+
+    with SpShardPool(factory, processes=2) as shard_pool:
+        items = shard_pool.fetch_missing(cache, refs, [None, None, None], 'person')
+
+    assert items[0]['information']['id'] == '1'
+    assert items[1:] == [None, None]
+    assert cache.get_person_by_ref(refs[1]) is None
+    assert cache.api_calls == 2
@@ -0,0 +1,146 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from sp_storage import SpCouchStorage, SpSqliteStorage, migrate, stale_order
+
+
+def person(id, days=None):
+    doc = {'_id': 'p_%s' % id, 'information': {'id': str(id)}}
+    if days is not None:
+        doc['timestamp'] = list(time.gmtime(time.time() - days * 24 * 3600))
+    return doc
+
+
+@pytest.fixture
+def storage(tmp_path):
+    sqlite_storage = SpSqliteStorage(str(tmp_path / 'sp.sqlite'), poll_interval=0.01, iter_batch_size=7)
+    yield sqlite_storage
+    sqlite_storage.close()
+
+
+def test_put_and_get(storage):
+    assert storage.put_many([person(id) for id in range(2000)]) == []
+
+    assert storage.get('p_5') == person(5)
+    assert storage.get('p_2000') is None
+    assert storage.get_many(['p_%s' % id for id in range(0, 4000, 2)]) == {'p_%s' % id: person(id)
+                                                                          for id in range(0, 2000, 2)}
+
+
+def test_put_replaces_documents(storage):
+    storage.put_many([person(1)])
+    storage.put_many([dict(person(1), _rev='1-a', name='x')])
+
+    assert storage.get('p_1') == dict(person(1), name='x')
+
+
+def test_iteration_reads_all_documents_in_batches(storage):
+    storage.put_many([person(id) for id in range(50)])
+
+    assert sorted(doc['_id'] for doc in storage) == sorted('p_%s' % id for id in range(50))
+
+
+def test_iteration_does_not_block_writers(storage):
+    storage.put_many([person(id) for id in range(50)])
+
+    for i, doc in enumerate(storage):
+        storage.put_many([dict(doc, visited=True)])
+
+    assert i == 49
+    assert all(doc['visited'] for doc in storage)
+
+
+def test_stale_ids_are_ordered_by_fetch_and_check_time(storage):
+    storage.put_many([person(1, 5), person(2, 3), person(3), person(4, 1), person(5, 10)])
+    since = storage.changes()[1]
+    storage.mark_checked(['p_5'], time.time() - 2 * 24 * 3600)
+
+    assert storage.stale_ids(time.time() - 12 * 3600) == ['p_3', 'p_1', 'p_2', 'p_5', 'p_4']
+    assert storage.stale_ids(time.time() - 4 * 24 * 3600) == ['p_3', 'p_1']
+    assert storage.changes(since, timeout=0.0) == ([], since)
+
+
+def test_stale_order():
+    assert stale_order([('a', 100.0, None), ('b', None, None), ('c', 100.0, 190.0)], 200.0) == ['b', 'a', 'c']
+    assert stale_order([('a', 100.0, None), ('c', 100.0, 190.0)], 150.0) == ['a']
+    assert stale_order([('a', 100.0, None), ('b', None, 190.0)], 50.0) == ['b']
+
+
+def test_changes_feed(storage):
+    other = SpSqliteStorage(storage.path, poll_interval=0.01)
+
+    try:
+        changes, since = other.changes()
+        assert changes == []
+
+        storage.put_many([person(1), person(2)])
+        changes, since = other.changes(since, timeout=1.0)
+        assert sorted(changes) == [('p_1', None), ('p_2', None)]
+
+        assert other.changes(since, timeout=0.05) == ([], since)
+    finally:
+        other.close()
+
+
+def test_migrate(storage, tmp_path):
+    storage.put_many([person(id) for id in range(30)])
+    target = SpSqliteStorage(str(tmp_path / 'target.sqlite'))
+
+    try:
+        assert migrate(storage, target, batch_size=8) == 30
+        assert sorted(doc['_id'] for doc in target) == sorted(doc['_id'] for doc in storage)
+    finally:
+        target.close()
+
+
+@pytest.fixture
+def couch_storage():
+    """
+    :return: SpCouchStorage of a new database on the CouchDB server given by SP_COUCHDB_URL, dropped afterwards.
+    """
+
+    url = os.environ.get('SP_COUCHDB_URL')
+    if url is None:
+        pytest.skip('SP_COUCHDB_URL is not set')
+
+    import couchdb
+
+    server = couchdb.Server(url)
+    name = 'sp_test_%s' % uuid.uuid4().hex
+    couch_storage = SpCouchStorage(server.create(name), iter_batch_size=7)
+    yield couch_storage
+    del server[name]
+
+
+def without_rev(doc):
+    return {key: value for key, value in doc.items() if key != '_rev'}
+
+
+def test_migrate_from_couchdb(couch_storage, storage):
+    assert couch_storage.put_many([person(id) for id in range(30)]) == []
+
+    assert migrate(couch_storage, storage, batch_size=8) == 30
+    assert sorted(map(without_rev, storage), key=lambda doc: doc['_id']) == \
+        sorted((person(id) for id in range(30)), key=lambda doc: doc['_id'])
+
+
+def test_migrate_to_couchdb(couch_storage, storage):
+    storage.put_many([person(id) for id in range(30)])
+
+    assert migrate(storage, couch_storage, batch_size=8) == 30
+    assert {doc_id: without_rev(doc) for doc_id, doc in couch_storage.get_many(['p_%s' % id
+                                                                               for id in range(30)]).items()} == \
+        {'p_%s' % id: person(id) for id in range(30)}
+
+
+def test_couchdb_stale_ids(couch_storage):
+    couch_storage.put_many([person(1, 5), person(2, 3), person(3), person(5, 10)])
+    since = couch_storage.changes()[1]
+    couch_storage.mark_checked(['p_5'], time.time() - 2 * 24 * 3600)
+    couch_storage.mark_checked(['p_5'], time.time() - 2 * 24 * 3600)
+
+    assert couch_storage.stale_ids(time.time() - 12 * 3600) == ['p_3', 'p_1', 'p_2', 'p_5']
+    assert couch_storage.changes(since, timeout=0.1)[0] == []